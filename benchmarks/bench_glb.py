@@ -0,0 +1,46 @@
+'''
+Benchmark building GLB data with many bufferViews.
+
+Usage: python benchmarks/bench_glb.py [--repeat N] [--buffer-views N]
+'''
+import argparse
+import io
+import timeit
+import numpy as np
+
+import frames # noqa: F401, adds the repository into path
+from xviz.io.gltf import GLTFBuilder, AccessorWrapper, ImageWrapper
+
+def build_object(buffer_views=200, points=64, seed=0):
+    '''
+    Build an object with half of the binaries as accessors and half as images
+    '''
+    rng = np.random.default_rng(seed)
+    primitives = {}
+    for i in range(buffer_views // 2):
+        primitives['/stream/%d' % i] = dict(
+            points=[dict(points=AccessorWrapper(rng.random((points, 3), dtype=np.float32), bounds=True))],
+            images=[dict(data=ImageWrapper(rng.bytes(256), 16, 16, 'image/png'))]
+        )
+    return dict(type='xviz/state_update', data=dict(updates=[dict(timestamp=0., primitives=primitives)]))
+
+def build_glb(obj):
+    builder = GLTFBuilder()
+    builder.add_extension('AVS_xviz', builder.pack_binary_json(obj))
+    with io.BytesIO() as fout:
+        builder.flush(fout)
+        return fout.getvalue()
+
+def run(repeat=20, buffer_views=200):
+    # pack_binary_json modifies the object in place, so a new one is built for each run
+    objects = [build_object(buffer_views) for _ in range(repeat)]
+    times = timeit.repeat(lambda: build_glb(objects.pop()), number=1, repeat=repeat)
+    print("GLB build with %d bufferViews: best %.2f ms, mean %.2f ms" % (
+        buffer_views, min(times) * 1000, sum(times) / len(times) * 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--buffer-views', type=int, default=200)
+    args = parser.parse_args()
+    run(args.repeat, args.buffer_views)
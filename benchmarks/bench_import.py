@@ -0,0 +1,48 @@
+'''
+Benchmark startup time of importing xviz modules, measured by `python -X importtime` in fresh interpreters.
+
+Usage: python benchmarks/bench_import.py [--repeat N]
+'''
+import argparse
+import os
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import xviz',
+    'import xviz.io',
+    'import xviz.server',
+    'import xviz.builder',
+    'from xviz.io import XVIZGLBWriter',
+]
+
+def import_time(statement: str) -> int:
+    '''
+    Return cumulative import time of the statement in microseconds
+    '''
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True, cwd=root)
+
+    # Top level imports are not indented
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return total
+
+def run(repeat=5):
+    # Modules imported by the interpreter startup are excluded
+    baseline = min(import_time('pass') for _ in range(repeat))
+    for statement in STATEMENTS:
+        best = min(import_time(statement) for _ in range(repeat))
+        print("%-36s %8.1f ms" % (statement, (best - baseline) / 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,38 @@
+'''
+Benchmark serialization, parsing and dict conversion of XVIZ messages with the active protobuf backend.
+
+Usage: python benchmarks/bench_protobuf.py [--repeat N] [--points N]
+'''
+import argparse
+import timeit
+
+from frames import build_frame
+
+from xviz.v2 import PROTOBUF_BACKEND
+from xviz.v2.session_pb2 import StateUpdate
+from google.protobuf.json_format import MessageToDict
+
+def run(repeat=5, points=100000):
+    message = build_frame(points=points)
+    update = message.data
+    data = update.SerializeToString()
+
+    cases = [
+        ('serialize', lambda: update.SerializeToString()),
+        ('serialize (deterministic)', lambda: update.SerializeToString(deterministic=True)),
+        ('parse', lambda: StateUpdate.FromString(data)),
+        ('MessageToDict', lambda: MessageToDict(update, preserving_proto_field_name=True)),
+        ('XVIZMessage.to_object', lambda: message.to_object()),
+    ]
+
+    print("protobuf backend: %s, message size: %d bytes" % (PROTOBUF_BACKEND, len(data)))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print("%-28s %10.2f ms" % (name, best * 1000))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--points', type=int, default=100000)
+    args = parser.parse_args()
+    run(args.repeat, args.points)
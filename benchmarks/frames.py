@@ -0,0 +1,53 @@
+'''
+Representative XVIZ frames shared by the benchmarks.
+'''
+import sys, os
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import xviz.builder as xb
+
+def build_metadata():
+    builder = xb.XVIZMetadataBuilder()
+    builder.stream('/vehicle_pose').category(xb.CATEGORY.POSE)
+    builder.stream('/lidar/points').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.POINT)\
+        .coordinate(xb.COORDINATE_TYPES.VEHICLE_RELATIVE).stream_style({'radius_pixels': 2})
+    builder.stream('/map/lanes').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.POLYLINE)\
+        .stream_style({'stroke_color': [0, 255, 0, 128], 'stroke_width': 0.2})
+    builder.stream('/tracklets').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.POLYGON)\
+        .stream_style({'fill_color': [200, 0, 70, 128], 'extruded': True, 'height': 1.5})
+    builder.stream('/tracklets/label').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.TEXT)
+    builder.stream('/camera/front').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.IMAGE)
+    builder.start_time(0.).end_time(10.)
+    return builder.get_message()
+
+def build_frame(timestamp=0., points=100000, lanes=50, objects=30, image_size=200000, seed=0, metadata=None):
+    '''
+    Build a state update with a lidar sweep, map lanes, tracked objects and a camera image
+
+    :param image_size: size of the (fake) encoded image in bytes
+    :param metadata: metadata message, `build_metadata()` will be used by default
+    '''
+    rng = np.random.default_rng(seed)
+    metadata = metadata or build_metadata()
+    builder = xb.XVIZBuilder(metadata=metadata.data)
+    builder.pose().timestamp(timestamp).position(1., 2., 0.).orientation(0., 0., 0.1)
+
+    vertices = rng.uniform(-50, 50, size=(points, 3)).astype(np.float32)
+    colors = rng.integers(0, 255, size=(points, 4), dtype=np.uint8)
+    builder.primitive('/lidar/points').points(vertices.ravel().tolist()).colors(colors.ravel().tolist())
+
+    for i in range(lanes):
+        lane = np.stack([np.linspace(0, 100, 20), np.full(20, i * 3.5), np.zeros(20)], axis=1)
+        builder.primitive('/map/lanes').polyline(lane.ravel().tolist())
+
+    for i in range(objects):
+        x, y = rng.uniform(-40, 40, size=2)
+        box = [x-2, y-1, 0, x+2, y-1, 0, x+2, y+1, 0, x-2, y+1, 0]
+        builder.primitive('/tracklets').polygon(box).id('object-%d' % i)
+        builder.primitive('/tracklets/label').text('object-%d' % i).position([x, y, 2.])
+
+    image = b'\x89PNG\r\n\x1a\n' + rng.bytes(image_size)
+    builder.primitive('/camera/front').image(image).dimensions(1920, 1080)
+    return builder.get_message()
@@ -65,8 +65,8 @@ class CircleScenario:
         if not self._live:
             log_start_time = self._timestamp
             metadata['data']['log_info'] = {
-                "log_start_time": log_start_time,
-                "log_end_time": log_start_time + self._duration
+                "start_time": log_start_time,
+                "end_time": log_start_time + self._duration
             }
 
         return metadata
@@ -5,7 +5,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 import xviz
 from xviz.builder import XVIZBuilder, XVIZMetadataBuilder
-from xviz.server import XVIZServer, XVIZBaseSession
+from xviz.message import XVIZMessage
+from xviz.server import XVIZServer, XVIZBaseSession, XVIZAdaptiveSender
 
 from scenarios.circle import CircleScenario
 
@@ -23,16 +24,21 @@ class ScenarioSession(XVIZBaseSession):
         print("Disconnect!")
 
     async def main(self):
-        metadata = self._scenario.get_metadata()
-        await self._socket.send(json.dumps(metadata))
+        # frames are generated at fixed rate, the sender merges them if the client falls behind
+        sender = XVIZAdaptiveSender(self)
+        sending = asyncio.ensure_future(sender.run())
+        sender.push(XVIZMessage.from_object(self._scenario.get_metadata()))
 
         t = 0
-        while True:
-            message = self._scenario.get_message(t)
-            await self._socket.send(json.dumps(message))
+        try:
+            while not sending.done():
+                sender.push(XVIZMessage.from_object(self._scenario.get_message(t)))
 
-            t += 0.5
-            await asyncio.sleep(0.5)
+                t += 0.5
+                await asyncio.sleep(0.5)
+        finally:
+            sending.cancel()
+        await sending
 
 class ScenarioHandler:
     def __init__(self):
@@ -47,6 +53,4 @@ if __name__ == "__main__":
     logging.getLogger("xviz-server").addHandler(handler)
 
     server = XVIZServer(ScenarioHandler(), port=8081)
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(server.serve())
-    loop.run_forever()
+    server.run()
@@ -1,7 +1,15 @@
 import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from easydict import EasyDict as edict
 
-from xviz.builder import XVIZBuilder, XVIZUIPrimitiveBuilder, XVIZTimeSeriesBuilder
+from xviz.builder import XVIZBuilder, XVIZMetadataBuilder, CATEGORY, PRIMITIVE_TYPES,\
+    XVIZUIPrimitiveBuilder, XVIZTimeSeriesBuilder, XVIZFrameDiffer,\
+    XVIZImageEncodingStage
+from xviz.builder.base_builder import PRIMITIVE_STYLE_MAP
+from xviz.message import XVIZMessage
+from xviz.v2.session_pb2 import StateUpdate
+from xviz.v2.style_pb2 import StyleStreamValue
 from google.protobuf.json_format import MessageToDict
 import unittest
 
@@ -102,6 +110,30 @@ class TestPrimitiveBuilder(unittest.TestCase):
         data = builder.get_data().to_object()
         assert json.dumps(data, sort_keys=True) == json.dumps(expected, sort_keys=True)
 
+    def test_style_map(self):
+        # Test whether the keys are correct
+        for fields in PRIMITIVE_STYLE_MAP.values():
+            for f in fields:
+                assert f in StyleStreamValue.DESCRIPTOR.fields_by_name
+
+class TestMetadataBuilder:
+    def test_style_class_and_ui_config(self):
+        class UIBuilder:
+            def get_ui(self):
+                return {'Camera': {'name': 'Camera', 'type': 'panel'}}
+
+        builder = XVIZMetadataBuilder()
+        builder.stream('/test/polygon').category(CATEGORY.PRIMITIVE).type(PRIMITIVE_TYPES.POLYGON)\
+            .style_class('car', {'fill_color': [255, 0, 0]})
+        builder.ui(UIBuilder())
+
+        data = builder.get_data()
+        style_class = data.streams['/test/polygon'].style_classes[0]
+        assert style_class.name == 'car'
+        assert list(style_class.style.fill_color) == [255, 0, 0]
+        assert data.ui_config['Camera'].name == 'Camera'
+        assert data.ui_config['Camera'].config['type'] == 'panel'
+
 class TestUIPrimitiveBuilder:
     def test_null(self):
         builder = XVIZUIPrimitiveBuilder(None, None)
@@ -169,3 +201,123 @@ class TestTimeSeriesBuilder:
         }]
         data = builder.get_data().to_object()
         assert json.dumps(data['time_series'], sort_keys=True) == json.dumps(expected, sort_keys=True)
+
+class TestFrameDiffer:
+    def build_message(self, differ, radius=1):
+        builder = XVIZBuilder(differ=differ)
+        setup_pose(builder)
+        builder.primitive('/grid').polyline([0., 0., 0., 1., 1., 1.])
+        if radius:
+            builder.primitive('/circle').circle([0., 0., 0.], radius)
+        return builder.get_message().to_object()
+
+    def test_unchanged_streams(self):
+        differ = XVIZFrameDiffer(keyframe_interval=3)
+
+        data = self.build_message(differ)
+        assert data['update_type'] == 'COMPLETE_STATE'
+        assert set(data['updates'][0]['primitives']) == {'/grid', '/circle'}
+
+        data = self.build_message(differ, radius=2)
+        assert data['update_type'] == 'INCREMENTAL'
+        assert set(data['updates'][0]['primitives']) == {'/circle'}
+        assert PRIMARY_POSE_STREAM in data['updates'][0]['poses']
+
+        data = self.build_message(differ, radius=None)
+        assert 'primitives' not in data['updates'][0]
+        assert data['updates'][0]['no_data_streams'] == ['/circle']
+
+        data = self.build_message(differ, radius=None)
+        assert data['update_type'] == 'COMPLETE_STATE'
+        assert set(data['updates'][0]['primitives']) == {'/grid'}
+
+    def test_multiple_updates(self):
+        differ = XVIZFrameDiffer()
+
+        def build(radius):
+            frames = []
+            for timestamp, stream_id in [(1., '/grid'), (1.1, '/circle')]:
+                builder = XVIZBuilder()
+                setup_pose(builder)
+                if stream_id == '/grid':
+                    builder.primitive(stream_id).polyline([0., 0., 0., 1., 1., 1.])
+                else:
+                    builder.primitive(stream_id).circle([0., 0., 0.], radius)
+                frames.append(builder.get_message().data.updates[0])
+            return XVIZMessage(StateUpdate(update_type=StateUpdate.UpdateType.INCREMENTAL, updates=frames))
+
+        differ.diff(build(1))
+        data = differ.diff(build(2)).to_object()
+        assert 'primitives' not in data['updates'][0]
+        assert 'no_data_streams' not in data['updates'][0]
+        assert set(data['updates'][1]['primitives']) == {'/circle'}
+        assert 'no_data_streams' not in data['updates'][1]
+
+    def test_updates_reverting(self):
+        differ = XVIZFrameDiffer()
+
+        def frame(radius=None, cleared=False):
+            builder = XVIZBuilder()
+            setup_pose(builder)
+            if radius is not None:
+                builder.primitive('/circle').circle([0., 0., 0.], radius)
+            data = builder.get_message().data.updates[0]
+            if cleared:
+                data.no_data_streams.append('/circle')
+            return data
+
+        def diff(*frames):
+            message = XVIZMessage(StateUpdate(update_type=StateUpdate.UpdateType.INCREMENTAL, updates=frames))
+            return differ.diff(message).data.updates
+
+        diff(frame(2))
+        updates = diff(frame(1), frame(2))
+        assert [update.primitives['/circle'].circles[0].radius for update in updates] == [1, 2]
+
+        updates = diff(frame(cleared=True), frame(2))
+        assert list(updates[0].no_data_streams) == ['/circle']
+        assert '/circle' in updates[1].primitives and not updates[1].no_data_streams
+
+        updates = diff(frame(), frame())
+        assert not updates[0].no_data_streams
+        assert list(updates[1].no_data_streams) == ['/circle']
+
+class TestImageBuilder:
+    PNG_HEADER = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x04\x00\x00\x00\x02'
+
+    def test_encoded_image(self):
+        builder = XVIZBuilder()
+        setup_pose(builder)
+        builder.primitive('/camera').image(self.PNG_HEADER)
+
+        image = builder.get_data().data.primitives['/camera'].images[0]
+        assert image.data == self.PNG_HEADER
+        assert (image.width_px, image.height_px) == (4, 2)
+
+    def test_array_image(self):
+        pixels = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+        with ThreadPoolExecutor(2) as executor:
+            builder = XVIZBuilder(image_executor=executor)
+            setup_pose(builder)
+            builder.primitive('/camera').image(pixels, encoder='raw')
+
+            image = builder.get_data().data.primitives['/camera'].images[0]
+        assert image.data == pixels.tobytes()
+        assert (image.width_px, image.height_px) == (4, 2)
+        assert builder.image_stage.latency_histogram('/camera').count == 1
+
+    def test_encoding_stage(self):
+        pixels = np.zeros((2, 4, 3), dtype=np.uint8)
+        with XVIZImageEncodingStage(max_workers=4) as stage:
+            for _ in range(3):
+                builder = XVIZBuilder(image_executor=stage)
+                setup_pose(builder)
+                for camera in ['/camera/front', '/camera/rear']:
+                    builder.primitive(camera).image(pixels, encoder='raw')
+
+                frame = builder.get_message().data.updates[0]
+                assert frame.primitives['/camera/rear'].images[0].data == pixels.tobytes()
+
+        histograms = stage.latency_histograms
+        assert set(histograms) == {'/camera/front', '/camera/rear'}
+        assert histograms['/camera/front'].count == 3
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+def import_time(statement):
+    '''
+    Run the statement in a fresh interpreter with `-X importtime`, return cumulative
+    import times (in microseconds) keyed by module name
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+HEAVY_MODULES = ['numpy', 'google.protobuf', 'websockets', 'easydict', 'xviz.v2']
+
+class TestImport:
+    def test_import_xviz(self):
+        times = import_time('import xviz')
+        assert 'xviz' in times
+        for module in HEAVY_MODULES:
+            assert module not in times
+
+    def test_import_io_sources(self):
+        times = import_time('import xviz.io')
+        assert 'xviz.io.sources' in times
+        for module in HEAVY_MODULES:
+            assert module not in times
+
+    def test_import_server(self):
+        times = import_time('import xviz.server')
+        assert 'websockets' not in times
+
+    def test_lazy_attributes(self):
+        statement = "import sys, xviz.io; xviz.io.XVIZGLBWriter; print('xviz.io.protobuf' in sys.modules)"
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', statement],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        assert result.stdout.strip() == 'False'
+
+    def test_star_import(self):
+        namespace = {}
+        exec('from xviz.io import *; from xviz.server import *', namespace)
+        assert 'XVIZGLBWriter' in namespace and 'DirectorySource' in namespace
+        assert 'XVIZServer' in namespace and 'XVIZLogPlayHandler' in namespace
+
+    def test_protobuf_backend_warning(self):
+        env = dict(os.environ, PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION='python')
+        result = subprocess.run([sys.executable, '-c', 'import xviz.io; xviz.io.XVIZGLBWriter; import xviz.v2'],
+            stderr=subprocess.PIPE, universal_newlines=True, check=True, env=env)
+        assert result.stderr.count('Pure python protobuf backend') == 1
+        assert 'PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=cpp' in result.stderr
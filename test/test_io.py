@@ -1,6 +1,14 @@
+import asyncio
 import json
+import pytest
+import array
+import struct
+import zlib
+import numpy as np
+import xviz
 import xviz.io as xi
 import xviz.builder as xb
+from xviz.io.gltf import GLTFBuilder, GLBDecoder, AccessorWrapper
 
 class TestIO:
     def test_json_metadata_writer(self):
@@ -83,7 +91,56 @@ class TestIO:
         assert data == expected
 
     def test_glb_point_cloud_writer(self):
-        pass
+        vertices = np.random.default_rng(0).uniform(-50, 50, (1000, 3)).astype(np.float32)
+        colors = np.full((1000, 4), 255, dtype=np.uint8)
+
+        builder = xb.XVIZBuilder()
+        builder.pose().timestamp(2.)
+        builder.primitive('/lidar').points(vertices.ravel().tolist()).colors(colors.ravel().tolist())
+        message = builder.get_message()
+
+        def read_glb(data):
+            jsonlen, = struct.unpack('<I', data[12:16])
+            gltf = json.loads(data[20:20+jsonlen].rstrip(b'\x00'))
+            return gltf, data[28+jsonlen:]
+
+        def read_accessor(gltf, binary, pointer, dtype):
+            accessor = gltf['accessors'][int(pointer.split('/')[-1])]
+            view = gltf['bufferViews'][accessor['bufferView']]
+            data = binary[view['byteOffset']:view['byteOffset']+view['byteLength']]
+            if 'extensions' in view:
+                data = zlib.decompress(data)
+            data = np.frombuffer(data, dtype=dtype).reshape(accessor['count'], -1)
+            return accessor, data[:, :['SCALAR', 'VEC2', 'VEC3', 'VEC4'].index(accessor['type']) + 1]
+
+        source = xi.MemorySource(latest_only=True)
+        xi.XVIZGLBWriter(source).write_message(message)
+        gltf, binary = read_glb(source.read())
+        point = gltf['extensions']['AVS_xviz']['data']['updates'][0]['primitives']['/lidar']['points'][0]
+        accessor, data = read_accessor(gltf, binary, point['points'], np.float32)
+        assert (accessor['type'], accessor['componentType'], accessor['count']) == ('VEC3', 5126, 1000)
+        assert np.all(data == vertices)
+        accessor, data = read_accessor(gltf, binary, point['colors'], np.uint8)
+        assert (accessor['type'], accessor['componentType'], accessor['normalized']) == ('VEC4', 5121, True)
+        assert np.all(data == colors)
+
+        xi.XVIZGLBWriter(source, quantize_points=True, compression='zlib').write_message(message)
+        gltf, binary = read_glb(source.read())
+        # the compressed positions are used by the point cloud node
+        assert gltf['extensionsRequired'] == ['KHR_mesh_quantization', 'AVS_xviz_compression']
+        point = gltf['extensions']['AVS_xviz']['data']['updates'][0]['primitives']['/lidar']['points'][0]
+        accessor, data = read_accessor(gltf, binary, point['points'], np.int16)
+        assert (accessor['componentType'], accessor['normalized']) == (5122, True)
+        assert accessor['min'] == data.min(axis=0).tolist() and accessor['max'] == data.max(axis=0).tolist()
+        # dequantized by the node transform
+        node, = gltf['nodes']
+        assert gltf['meshes'][node['mesh']]['primitives'][0]['attributes']['POSITION'] == int(point['points'][12:])
+        restored = np.array(node['translation']) + np.array(node['scale']) * data / 32767
+        assert np.abs(restored - vertices).max() < 100 / 65534
+        decoded = GLBDecoder(source.read()).to_message().data.updates[0].primitives['/lidar'].points[0]
+        assert np.abs(np.array(decoded.points).reshape(-1, 3) - vertices).max() < 100 / 65534
+
+        assert len(message.data.updates[0].primitives['/lidar'].points[0].points) == 3000
 
     def test_protobuf_normal_writer(self):
         builder = xb.XVIZBuilder()
@@ -109,3 +166,459 @@ class TestIO:
             b'["AVS_xviz"]}\x00\x00\x00\x00\x00\x00BIN\x00'
 
         # XXX: assert data == expected
+
+    def test_cached_writers(self):
+        cache = xi.XVIZFragmentCache(capacity=16)
+
+        for radius in [2, 2, 3]:
+            builder = xb.XVIZBuilder()
+            builder.pose()\
+                .timestamp(2.000000000001)\
+                .position(44., 55., 66.)
+            builder.primitive('/test_primitive').circle([0, 0, 0], radius)
+            builder.primitive('/test_points').points([1., 2., 3.]).colors([255, 0, 0, 255])
+            message = builder.get_message()
+
+            source = xi.MemorySource(latest_only=True)
+            xi.XVIZJsonWriter(source).write_message(message)
+            expected = source.read()
+            xi.XVIZJsonWriter(source, cache=cache).write_message(message)
+            assert source.read() == expected
+
+        assert cache.hits == 3
+        assert cache.misses == 3
+        assert len(cache) == 3
+
+    def test_glb_image_writer(self):
+        image = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x04\x00\x00\x00\x02'
+        builder = xb.XVIZBuilder()
+        builder.pose().timestamp(2.)
+        builder.primitive('/camera').image(image)
+        message = builder.get_message()
+
+        source = xi.MemorySource(latest_only=True)
+        writer = xi.XVIZGLBWriter(source)
+        writer.write_message(message)
+        data = source.read()
+
+        jsonlen, = struct.unpack('<I', data[12:16])
+        gltf = json.loads(data[20:20+jsonlen].rstrip(b'\x00'))
+        assert gltf['images'] == [{"bufferView": 0, "mimeType": "image/png", "width": 4, "height": 2}]
+        assert gltf['extensions']['AVS_xviz']['data']['updates'][0]['primitives']['/camera']['images'][0]['data'] == '#/images/0'
+        assert data[28+jsonlen:28+jsonlen+len(image)] == image
+        assert message.data.updates[0].primitives['/camera'].images[0].data == image
+
+    def test_point_cloud_decimation(self):
+        grid = np.stack(np.meshgrid(np.arange(10), np.arange(10), np.arange(10)), -1).reshape(-1, 3)
+        vertices = np.concatenate([grid, grid + 0.05]).astype(np.float32)
+        colors = np.repeat(np.arange(len(vertices), dtype=np.uint8)[:, None], 4, axis=1)
+
+        builder = xb.XVIZBuilder()
+        builder.pose().timestamp(2.)
+        builder.primitive('/lidar').points(vertices.ravel().tolist()).colors(colors.ravel().tolist())
+        message = builder.get_message()
+
+        decimator = xi.XVIZPointCloudDecimator(voxel_size=0.5, min_points=10)
+        result = decimator.apply(message)
+        point = result.data.updates[0].primitives['/lidar'].points[0]
+        assert len(point.points) == 1000 * 3
+        assert np.allclose(np.array(point.points).reshape(-1, 3), grid)
+        assert point.colors == colors[:1000].tobytes()
+        assert (decimator.last_input_points, decimator.last_output_points) == (2000, 1000)
+        assert len(message.data.updates[0].primitives['/lidar'].points[0].points) == 2000 * 3
+
+        decimator = xi.XVIZPointCloudDecimator(method='random', max_points=100, min_points=10, seed=0)
+        source = xi.MemorySource(latest_only=True)
+        xi.XVIZJsonWriter(source, decimator=decimator).write_message(message)
+        data = json.loads(source.read())
+        assert len(data['data']['updates'][0]['primitives']['/lidar']['points'][0]['points']) == 100 * 3
+        assert decimator.cost_histogram.count == 1
+
+    def test_voxel_grid_indices(self):
+        from xviz.io.lod import voxel_grid_indices
+        assert len(voxel_grid_indices(np.zeros((0, 3), dtype=np.float32), 0.1)) == 0
+
+        # the grid extent exceeds the range of flattened int64 keys
+        vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 2 ** 32 - 1, 2 ** 32 - 1], [0, 0, 0]], dtype=np.float64)
+        assert voxel_grid_indices(vertices, 1.).tolist() == [0, 1, 2]
+
+class TestGLTFBuilder:
+    def to_glb(self, builder):
+        source = xi.MemorySource(latest_only=True)
+        with source.open('0.glb', 'w') as fout:
+            builder.flush(fout)
+        return source.read()
+
+    def test_point_cloud(self):
+        builder = GLTFBuilder()
+        positions = np.array([[0, 0, 0], [1, 2, 3], [-1, 5, 2]], dtype=np.float32)
+        colors = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255]], dtype=np.uint8)
+        assert builder.add_point_cloud({'POSITION': positions, 'COLOR_0': colors}) == 0
+
+        gltf = builder._json
+        assert gltf['meshes'] == [{'primitives': [{'attributes': {'POSITION': 0, 'COLOR_0': 1}, 'mode': 0}]}]
+        assert gltf['accessors'][0] == {'bufferView': 0, 'type': 'VEC3', 'componentType': 5126,
+            'count': 3, 'min': [-1, 0, 0], 'max': [1, 5, 3]}
+        assert gltf['accessors'][1] == {'bufferView': 1, 'type': 'VEC4', 'componentType': 5121,
+            'count': 3, 'normalized': True}
+        assert gltf['bufferViews'][1] == {'buffer': 0, 'byteOffset': 36, 'byteLength': 12}
+
+        normals = np.array([[0, 0, 32767], [0, -32767, 0], [0, 0, -32768]], dtype=np.int16)
+        builder.add_point_cloud({'POSITION': positions, 'NORMAL': AccessorWrapper(normals, normalized=True, bounds=True)})
+        accessor = gltf['accessors'][3]
+        assert (accessor['type'], accessor['min'], accessor['max']) == ('VEC3', [0, -32767, -32768], [0, 0, 32767])
+        assert gltf['bufferViews'][accessor['bufferView']]['byteStride'] == 8
+        decoder = GLBDecoder(self.to_glb(builder))
+        assert np.all(decoder.get_accessor(3) == normals)
+
+    def test_mesh(self):
+        builder = GLTFBuilder()
+        positions = np.zeros((1000, 3), dtype=np.float32)
+        builder.add_compressed_mesh({'POSITION': positions}, indices=[[0, 1, 2], [2, 3, 0]])
+
+        gltf = builder._json
+        assert gltf['meshes'][0]['primitives'][0] == {'attributes': {'POSITION': 0}, 'mode': 4, 'indices': 1}
+        assert gltf['accessors'][1]['componentType'] == 5123
+        assert gltf['accessors'][1]['count'] == 6
+        assert gltf['bufferViews'][0]['extensions']['AVS_xviz_compression'] == {'method': 'zlib', 'byteLength': 12000}
+        assert gltf['extensionsRequired'] == ['AVS_xviz_compression']
+
+    def test_pack_binary_json(self):
+        builder = GLTFBuilder()
+        data = {
+            'name': 'xviz',
+            'pointer': '#/accessors/0',
+            'items': [{'points': np.zeros((2, 3), dtype=np.float32)}, [1.0, None, True]],
+            'colors': array.array('B', [1, 2, 3])
+        }
+        packed = builder.pack_binary_json(data)
+
+        assert packed is data
+        assert packed == {
+            'name': '#xviz',
+            'pointer': '#/accessors/0',
+            'items': [{'points': '#/accessors/0'}, [1.0, None, True]],
+            'colors': '#/accessors/1'
+        }
+        assert builder.pack_binary_json('text') == '#text'
+
+class TestReaders:
+    def build_messages(self):
+        metadata = xb.XVIZMetadataBuilder()
+        metadata.stream('/lidar').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.POINT)\
+            .stream_style({'fill_color': [255, 0, 0]})
+        metadata.start_time(1.).end_time(3.)
+
+        messages = []
+        for timestamp in [1., 2., 3.]:
+            builder = xb.XVIZBuilder()
+            builder.pose().timestamp(timestamp).position(1., 2., 3.)
+            builder.primitive('/lidar').points([timestamp, 0., 1., 2., 3., 4.])\
+                .colors([255, 0, 0, 255, 0, 255, 0, 255])\
+                .style({'fill_color': [0, 0, 255]})
+            builder.primitive('/camera').image(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x04\x00\x00\x00\x02')
+            builder.primitive('/label').text('#label').position([0., 0., 0.])
+            builder.time_series('/speed').timestamp(timestamp).value(timestamp * 10)
+            messages.append(builder.get_message())
+        return metadata.get_message(), messages
+
+    def test_glb_reader(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZGLBWriter(xi.DirectorySource(str(tmp_path)), compression='zlib')
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        reader = xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path)))
+        assert len(reader) == 3
+        assert reader.message_timings[1] == (2., 2., 3)
+        assert reader.find_message(1.5) == 3
+        assert reader.find_messages(1.5, 3.) == [3, 4]
+        assert reader.find_messages() == [2, 3, 4]
+        assert reader.find_message(5.) is None
+
+        assert reader.read_metadata().data == metadata.data
+        decoder = reader.read_glb(3)
+        assert decoder.xviz['data']['updates'][0]['timestamp'] == 2.
+        for index, message in enumerate(messages):
+            assert reader.read_message(index + 2).data == message.data
+
+        # escaped strings which look like pointers
+        assert decoder.xviz['data']['updates'][0]['time_series'][0]['streams'] == ['#/speed']
+        assert decoder.unpack(['#/speed', '#/accessors/x', '#/images']) == ['/speed', '/accessors/x', '/images']
+        with pytest.raises(ValueError):
+            decoder.resolve('#/speed')
+
+        source = xi.DirectorySource(str(tmp_path))
+        mapped = source.mmap('2-frame.glb')
+        source.close()
+        assert mapped.closed
+        reader.close()
+
+    def test_protobuf_log_reader(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZProtobufWriter(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['log.pbl', 'log.pbl.idx']
+        with open(str(tmp_path / 'log.pbl'), 'rb') as fin:
+            assert fin.read(8) == b'XVIZPBL\x01'
+
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        assert len(reader) == 3
+        assert reader.message_timings[1] == (2., 2., 3)
+        assert reader.find_message(2.5) == 4
+
+        assert reader.read_message(4).data == messages[2].data
+        assert reader.read_metadata().data == metadata.data
+        streamed = list(reader.iter_messages())
+        assert [m.data for m in streamed] == [metadata.data] + [m.data for m in messages]
+        reader.close()
+
+    def test_unwrapped_protobuf_log(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZProtobufWriter(xi.DirectorySource(str(tmp_path)), wrap_envelope=False, log_name='log.pbl')
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)), wrap_envelope=False, log_name='log.pbl')
+        assert reader.read_metadata().data == metadata.data
+        assert reader.read_message(2).data == messages[0].data
+        assert [m.data for m in reader.iter_messages()] == [metadata.data] + [m.data for m in messages]
+        reader.close()
+
+    def test_protobuf_reader(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZProtobufWriter(xi.DirectorySource(str(tmp_path)))
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)))
+        assert len(reader) == 3
+        assert reader.read_metadata().data == metadata.data
+        assert reader.read_message(2).data == messages[0].data
+        reader.close()
+
+    def test_columnar_frame(self, tmp_path):
+        metadata, messages = self.build_messages()
+        frames = [xviz.XVIZColumnarFrame.from_message(message)[0] for message in messages]
+        columns = frames[1].primitives['/lidar']['points']
+        assert len(columns) == 1
+        assert columns.vertices.dtype == np.float32
+        assert columns.get_vertices(0).tolist() == [[2., 0., 1.], [2., 3., 4.]]
+        assert columns.get_colors(0).tolist() == [255, 0, 0, 255, 0, 255, 0, 255]
+        for frame, message in zip(frames, messages):
+            assert xviz.XVIZColumnarFrame.to_message([frame]).data == message.data
+
+        writer = xi.XVIZGLBWriter(xi.DirectorySource(str(tmp_path)))
+        writer.write_message(metadata)
+        for frame in frames:
+            writer.write_frame(frame)
+        writer.close()
+
+        reader = xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path)))
+        assert reader.message_timings[1] == (2., 2., 3)
+        for index, message in enumerate(messages):
+            assert reader.read_message(index + 2).data == message.data
+            read_frame, = reader.read_frames(index + 2)
+            assert read_frame.to_frame() == message.data.updates[0]
+        reader.close()
+
+    def test_table_export(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZGLBWriter(xi.DirectorySource(str(tmp_path)))
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        for table_format in ['npz', 'parquet']:
+            if table_format == 'parquet':
+                pytest.importorskip('pyarrow')
+            output = tmp_path / table_format
+            output.mkdir()
+            exporter = xi.XVIZTableExporter(xi.DirectorySource(str(output)), table_format, row_group_size=2)
+            exporter.export(xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path))))
+
+            reader = xi.XVIZTableReader(xi.DirectorySource(str(output)))
+            speed = reader.read('time_series', ['timestamp', 'value'])
+            assert speed['value'].tolist() == [10., 20., 30.]
+            speed = reader.read('time_series', ['value'], start_time=2.5)
+            assert speed['value'].tolist() == [30.]
+
+            primitives = reader.read('primitives', start_time=2., end_time=2.)
+            assert sorted(primitives['category'].tolist()) == ['images', 'points', 'texts']
+            assert primitives['vertex_count'][primitives['category'] == 'points'].tolist() == [2]
+            reader.close()
+
+    def test_snapshots(self, tmp_path):
+        from xviz.message import XVIZMessage
+        from xviz.v2.core_pb2 import StreamSet
+        from xviz.v2.session_pb2 import StateUpdate
+        from xviz.io.snapshot import SNAPSHOT_INDEX_NAME
+
+        writer = xi.XVIZProtobufWriter(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        writer.write_message(self.build_messages()[0])
+        for i in range(10):
+            frame = StreamSet(timestamp=float(i))
+            frame.poses['/vehicle_pose'].timestamp = float(i)
+            frame.primitives['/object/%d' % i].circles.add(radius=float(i))
+            if i % 4 == 3: # object i-1 disappears
+                frame.no_data_streams.append('/object/%d' % (i - 1))
+            writer.write_message(XVIZMessage(update=StateUpdate(
+                update_type=StateUpdate.UpdateType.INCREMENTAL, updates=[frame])))
+        writer.close()
+
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        snapshots = xi.XVIZSnapshotIndex(reader, interval=3)
+        assert len(snapshots) == 3
+        expected = ['/object/%d' % i for i in [0, 1, 3, 4, 5, 7]]
+        state = snapshots.get_state_at(7.5)
+        assert sorted(state.primitives) == expected
+        assert state.timestamp == 7.
+        assert snapshots.get_state_at(-1.) is None
+
+        accumulator = xi.XVIZStateAccumulator()
+        for _, _, index in reader.message_timings:
+            accumulator.apply_message(reader.read_message(index))
+            assert snapshots.get_state(index) == accumulator.get_state()
+
+        sidecar = xi.MemorySource()
+        snapshots.save(sidecar)
+        loaded = xi.XVIZSnapshotIndex(reader, source=sidecar)
+        assert len(loaded) == 3
+        assert loaded.get_state_at(7.5) == state
+
+        # a sidecar of another log is rebuilt and overwritten
+        index = json.loads(sidecar.read(SNAPSHOT_INDEX_NAME))
+        index['timings'] = '0' * 32
+        sidecar.write(json.dumps(index).encode('ascii'), SNAPSHOT_INDEX_NAME)
+        rebuilt = xi.XVIZSnapshotIndex(reader, interval=5, source=sidecar)
+        assert not rebuilt.built
+        assert asyncio.run(rebuilt.aget_state_at(7.5)) == state
+        assert len(xi.XVIZSnapshotIndex(reader, source=sidecar)) == 2
+
+        # the built snapshots are saved along the log
+        autosaved = xi.XVIZSnapshotIndex(reader, interval=3, source=xi.DirectorySource(str(tmp_path)))
+        asyncio.run(autosaved.abuild())
+        assert (tmp_path / SNAPSHOT_INDEX_NAME).exists()
+
+    def test_zip_source(self, tmp_path):
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZGLBWriter(xi.ZipSource(str(tmp_path / 'log.zip'), 'w'))
+        writer.write_message(metadata)
+        for message in messages:
+            writer.write_message(message)
+        writer.close()
+
+        reader = xi.XVIZGLBReader(xi.ZipSource(str(tmp_path / 'log.zip')))
+        assert len(reader) == 3
+        assert list(reader.read_metadata().data.streams) == ['/lidar']
+        assert reader.read_message(3).data.updates[0].timestamp == 2.
+        reader.close()
+
+    def test_async_writer(self, tmp_path):
+        metadata, messages = self.build_messages()
+
+        async def record(writer_class, source, **options):
+            writer = xi.XVIZAsyncWriter(writer_class, source, **options)
+            await writer.write_message(metadata)
+            for message in messages:
+                await writer.write_message(message, wait=False)
+            await writer.close()
+
+        asyncio.run(record(xi.XVIZProtobufWriter, xi.AsyncDirectorySource(str(tmp_path)), log_name='log.pbl'))
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        assert len(reader) == 3
+        assert reader.read_message(3).data.updates[0].timestamp == 2.
+        reader.close()
+
+        asyncio.run(record(xi.XVIZGLBWriter, xi.AsyncZipSource(str(tmp_path / 'log.zip'), 'w')))
+        reader = xi.XVIZGLBReader(xi.ZipSource(str(tmp_path / 'log.zip')))
+        assert len(reader) == 3
+        assert list(reader.read_metadata().data.streams) == ['/lidar']
+        reader.close()
+
+        async def read():
+            source = xi.AsyncZipSource(str(tmp_path / 'log.zip'))
+            data = await source.read('1-frame.glb')
+            await source.close()
+            return data
+        assert asyncio.run(read())
+
+    def test_async_writer_in_executor(self, tmp_path):
+        from concurrent.futures import ThreadPoolExecutor
+        metadata, messages = self.build_messages()
+
+        async def record():
+            source = xi.AsyncDirectorySource(str(tmp_path), executor=ThreadPoolExecutor(4))
+            writer = xi.XVIZAsyncWriter(xi.XVIZProtobufWriter, source, serialize_in_executor=True, log_name='log.pbl')
+            await writer.write_message(metadata, wait=False)
+            for _ in range(10):
+                for message in messages:
+                    await writer.write_message(message, wait=False)
+            await writer.close()
+        asyncio.run(record())
+
+        reader = xi.XVIZProtobufReader(xi.DirectorySource(str(tmp_path)), log_name='log.pbl')
+        timestamps = [reader.read_message(i).data.updates[0].timestamp for i in range(2, 32)]
+        assert timestamps == [message.data.updates[0].timestamp for message in messages] * 10
+        reader.close()
+
+    def test_async_writer_error(self, tmp_path):
+        metadata, messages = self.build_messages()
+
+        class FailingSource(xi.DirectorySource):
+            def open(self, name, mode='r'):
+                if name.startswith('3-'):
+                    raise IOError("disk full")
+                return super().open(name, mode)
+
+        async def record():
+            writer = xi.XVIZAsyncWriter(xi.XVIZGLBWriter, xi.AsyncSource(FailingSource(str(tmp_path))))
+            await writer.write_message(metadata, wait=False)
+            for message in messages:
+                await writer.write_message(message, wait=False)
+            await writer.close()
+
+        with pytest.raises(IOError, match="disk full"):
+            asyncio.run(record())
+
+    def test_prefetch_reader(self, tmp_path):
+        import time
+        metadata, messages = self.build_messages()
+        writer = xi.XVIZGLBWriter(xi.DirectorySource(str(tmp_path)))
+        writer.write_message(metadata)
+        for _ in range(4):
+            for message in messages:
+                writer.write_message(message)
+        writer.close()
+
+        class SlowReader(xi.XVIZGLBReader):
+            def read_message(self, index):
+                time.sleep(0.01)
+                return super().read_message(index)
+
+        reader = xi.XVIZPrefetchReader(SlowReader(xi.DirectorySource(str(tmp_path))), min_window=2)
+        indices = [index for _, _, index in reader.message_timings]
+        expected = [xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path))).read_message(i).data for i in indices]
+        for index, data in zip(indices, expected):
+            assert reader.read_message(index).data == data
+            time.sleep(0.02)
+
+        stats = reader.get_stats()
+        assert stats['misses'] == 2 # the first two reads before sequential access is detected
+        assert stats['hits'] + stats['waits'] == len(indices) - 2
+        assert stats['hits'] > 0
+
+        reader.read_message(indices[3]) # random access drops the read ahead
+        assert reader.get_stats()['misses'] == 3
+        reader.close()
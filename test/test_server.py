@@ -0,0 +1,539 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import zipfile
+import pytest
+
+import xviz.builder as xb
+import xviz.io as xi
+from xviz.filter import XVIZStreamFilter
+from xviz.io.gltf import GLBDecoder
+from xviz.server import XVIZLogPlayHandler, XVIZServer, XVIZRouter
+from xviz.server.cache import XVIZFrameCache, XVIZReaderPool
+from xviz.server.bus import XVIZFrameBus, XVIZFrameBusReader
+from xviz.server.sender import XVIZAdaptiveSender
+from xviz.server.sessions import parse_session_message, XVIZBaseSession, XVIZFrameBusSession
+from xviz.v2.envelope_pb2 import Envelope
+from xviz.v2.session_pb2 import Reconfigure, Start, TransformLog
+
+class FakeSocket:
+    '''
+    Socket that records sent data and yields the given incoming messages
+    '''
+    def __init__(self, incoming=(), delay=0):
+        self.incoming = list(incoming)
+        self.sent = []
+        self.delay = delay
+        self.closed = False
+
+    async def send(self, data):
+        self.sent.append(data)
+        await asyncio.sleep(self.delay)
+
+    async def close(self):
+        self.closed = True
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for data in self.incoming:
+            yield data
+
+def build_frame(timestamp):
+    builder = xb.XVIZBuilder()
+    builder.pose().timestamp(timestamp).position(1., 2., 3.)
+    builder.primitive('/lidar/points').points([0., 1., 2.])
+    builder.primitive('/camera/front').image(b'\x89PNG\r\n\x1a\n')
+    builder.time_series('/speed').timestamp(timestamp).value(10.)
+    builder.time_series('/accel').timestamp(timestamp).value(1.)
+    return builder.get_message()
+
+def reconfigure(update_type, **config):
+    return json.dumps(dict(type='xviz/reconfigure', data=dict(update_type=update_type, config_update=config)))
+
+class TestStreamFilter:
+    def test_filter(self):
+        data = XVIZStreamFilter(denylist=['/camera/*']).apply(build_frame(1.)).data.updates[0]
+        assert list(data.primitives) == ['/lidar/points']
+        assert '/vehicle_pose' in data.poses
+
+        data = XVIZStreamFilter(allowlist=['/speed', '/lidar/*']).apply(build_frame(1.)).data.updates[0]
+        assert list(data.primitives) == ['/lidar/points']
+        assert [list(state.streams) for state in data.time_series] == [['/speed']]
+        assert not data.poses
+
+    def test_builder_disable_streams(self):
+        builder = xb.XVIZBuilder(disable_streams=['/camera/front'])
+        builder.pose().timestamp(1.).position(1., 2., 3.)
+        builder.primitive('/camera/front').image(b'\x89PNG\r\n\x1a\n')
+        assert not builder.get_data().data.primitives
+
+class TestSession:
+    def test_parse_message(self):
+        message_type, message = parse_session_message(reconfigure('delta', disabled_streams=['/a']))
+        assert message_type == 'xviz/reconfigure'
+        assert message.update_type == Reconfigure.UpdateType.DELTA
+
+        envelope = Envelope(type='xviz/transform_log')
+        envelope.data.Pack(TransformLog(id='1', start_timestamp=2.))
+        message_type, message = parse_session_message(envelope.SerializeToString())
+        assert message_type == 'xviz/transform_log'
+        assert message.id == '1' and message.start_timestamp == 2.
+
+    def test_reconfigure(self):
+        socket = FakeSocket()
+        session = XVIZBaseSession(socket, dict(path='/'))
+
+        async def run():
+            await session.handle_message(reconfigure('full', desired_streams=['/vehicle_pose', '/speed']))
+            await session.handle_message(reconfigure('delta', desired_streams=['/lidar/*']))
+            await session.send_message(build_frame(1.))
+        asyncio.run(run())
+
+        data = json.loads(socket.sent[0])['data']['updates'][0]
+        assert sorted(data['primitives']) == ['/lidar/points']
+        assert [ts['streams'] for ts in data['time_series']] == [['/speed']]
+
+    def test_fragment_cache(self):
+        cache = xi.XVIZFragmentCache()
+        cached, plain = XVIZBaseSession(FakeSocket(), {}, fragment_cache=cache), XVIZBaseSession(FakeSocket(), {})
+
+        async def run():
+            for session in (cached, plain):
+                await session.send_message(build_frame(1.))
+                await session.send_message(build_frame(2.))
+        asyncio.run(run())
+
+        assert cache.hits > 0
+        assert [json.loads(data) for data in cached.socket.sent] == [json.loads(data) for data in plain.socket.sent]
+
+    def test_decimator(self):
+        decimator = xi.XVIZPointCloudDecimator(method='random', max_points=10, min_points=10, seed=0)
+        session = XVIZBaseSession(FakeSocket(), {}, decimator=decimator)
+        builder = xb.XVIZBuilder()
+        builder.pose().timestamp(1.).position(1., 2., 3.)
+        builder.primitive('/lidar/points').points(list(range(300)))
+
+        asyncio.run(session.send_message(builder.get_message()))
+        data = json.loads(session.socket.sent[0])['data']['updates'][0]
+        assert len(data['primitives']['/lidar/points']['points'][0]['points']) == 10 * 3
+
+    def test_recorder(self, tmp_path):
+        socket = FakeSocket()
+        session = XVIZBaseSession(socket, dict(path='/'))
+
+        async def run():
+            recorder = xi.XVIZAsyncWriter(xi.XVIZGLBWriter, xi.AsyncDirectorySource(str(tmp_path)))
+            session.set_recorder(recorder)
+            await session.handle_message(reconfigure('full', desired_streams=['/speed']))
+            await session.send_message(build_frame(1.))
+            await session.send_message(build_frame(2.))
+            await recorder.close()
+        asyncio.run(run())
+
+        assert len(socket.sent) == 2
+        reader = xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path)))
+        update = reader.read_message(3).data.updates[0]
+        assert update.timestamp == 2. and '/lidar/points' in update.primitives
+
+    def test_recorder_log_play(self, tmp_path):
+        self.write_log(tmp_path / 'log', [1., 2., 3.])
+        handler = XVIZLogPlayHandler(str(tmp_path), autoplay=True, pool=XVIZReaderPool(XVIZFrameCache()))
+        sockets = [FakeSocket(), FakeSocket()]
+
+        async def run(socket, recording):
+            session = handler(socket, dict(path='/log'))
+            recorder = xi.XVIZAsyncWriter(xi.XVIZGLBWriter, xi.AsyncDirectorySource(str(recording)))
+            session.set_recorder(recorder)
+            await session.main()
+            await recorder.close()
+
+        # the second session is sent from the cache of encoded messages
+        for i, socket in enumerate(sockets):
+            (tmp_path / str(i)).mkdir()
+            asyncio.run(run(socket, tmp_path / str(i)))
+        assert sockets[0].sent == sockets[1].sent
+
+        for i in range(2):
+            reader = xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path / str(i))))
+            assert [tmin for tmin, _, _ in reader.message_timings] == [1., 2., 3.]
+            assert '/camera/front' in reader.read_metadata().data.streams
+            reader.close()
+
+    def test_recorder_frame_bus(self, tmp_path):
+        publisher = XVIZBaseSession(FakeSocket(), dict(path='/'))
+        bus = XVIZFrameBus(create=True, slot_count=4, slot_size=4096, metadata_size=4096)
+        try:
+            bus.publish_metadata(publisher.serialize(xb.XVIZMetadataBuilder().start_time(1.).get_message()))
+            socket = FakeSocket()
+            session = XVIZFrameBusSession(socket, dict(path='/live'), bus)
+
+            async def run():
+                recorder = xi.XVIZAsyncWriter(xi.XVIZGLBWriter, xi.AsyncDirectorySource(str(tmp_path)))
+                session.set_recorder(recorder)
+                main = asyncio.ensure_future(session.main())
+                while not socket.sent:
+                    await asyncio.sleep(0.01)
+                bus.publish(publisher.serialize(build_frame(1.)))
+                publisher.on_start(Start(message_format=Start.MessageFormat.BINARY))
+                bus.publish(publisher.serialize(build_frame(2.)))
+                while len(socket.sent) < 3:
+                    await asyncio.sleep(0.01)
+                main.cancel()
+                await recorder.close()
+            asyncio.run(asyncio.wait_for(run(), 5))
+        finally:
+            bus.close()
+
+        reader = xi.XVIZGLBReader(xi.DirectorySource(str(tmp_path)))
+        assert [tmin for tmin, _, _ in reader.message_timings] == [1., 2.]
+        assert list(reader.read_message(3).data.updates[0].primitives) == ['/lidar/points', '/camera/front']
+        reader.close()
+
+    def write_log(self, path, timestamps):
+        metadata = xb.XVIZMetadataBuilder()
+        metadata.stream('/lidar/points').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.POINT)
+        metadata.stream('/camera/front').category(xb.CATEGORY.PRIMITIVE).type(xb.PRIMITIVE_TYPES.IMAGE)
+        path.mkdir()
+        writer = xi.XVIZGLBWriter(xi.DirectorySource(str(path)))
+        writer.write_message(metadata.get_message())
+        for timestamp in timestamps:
+            writer.write_message(build_frame(timestamp))
+        writer.close()
+
+    def test_log_play(self, tmp_path):
+        self.write_log(tmp_path / 'log', [1., 2.])
+        handler = XVIZLogPlayHandler(str(tmp_path), autoplay=True)
+        assert handler(FakeSocket(), dict(path='/missing')) is None
+        assert handler(FakeSocket(), dict(path='/../log')) is None
+
+        socket = FakeSocket()
+        session = handler(socket, dict(path='/log'))
+
+        async def run():
+            await session.handle_message(json.dumps(dict(type='xviz/start', data=dict(message_format='binary'))))
+            await session.handle_message(reconfigure('full', disabled_streams=['/camera/*']))
+            await session.main()
+        asyncio.run(run())
+
+        assert len(socket.sent) == 3
+        messages = [GLBDecoder(data).to_message() for data in socket.sent]
+        assert list(messages[0].data.streams) == ['/lidar/points']
+        assert list(messages[2].data.updates[0].primitives) == ['/lidar/points']
+
+    def test_transform_log(self, tmp_path):
+        self.write_log(tmp_path / 'log', [1., 2., 3., 4.])
+        request = dict(type='xviz/transform_log', data=dict(id='clip', start_timestamp=1.5,
+            end_timestamp=3., desired_streams=['/vehicle_pose', '/lidar/points']))
+        socket = FakeSocket([json.dumps(request)])
+        session = XVIZLogPlayHandler(str(tmp_path))(socket, dict(path='/log'))
+        asyncio.run(session.main())
+
+        messages = [json.loads(data) for data in socket.sent]
+        assert [m['type'] for m in messages] == ['xviz/metadata', 'xviz/state_update', 'xviz/state_update',
+            'xviz/transform_log_done']
+        assert [m['data']['updates'][0]['timestamp'] for m in messages[1:3]] == [2., 3.]
+        assert list(messages[1]['data']['updates'][0]['primitives']) == ['/lidar/points']
+        assert messages[3]['data'] == dict(id='clip')
+
+    def test_transform_log_cancelled(self, tmp_path):
+        self.write_log(tmp_path / 'log', [1., 2., 3., 4.])
+        requests = [json.dumps(dict(type='xviz/transform_log', data=dict(id='all'))),
+                    json.dumps(dict(type='xviz/transform_log', data=dict(id='end', start_timestamp=3.5)))]
+        socket = FakeSocket(requests, delay=0.01)
+        session = XVIZLogPlayHandler(str(tmp_path))(socket, dict(path='/log'))
+        asyncio.run(session.main())
+
+        messages = [json.loads(data) for data in socket.sent]
+        assert [m['type'] for m in messages] == ['xviz/metadata', 'xviz/state_update', 'xviz/transform_log_done']
+        assert messages[1]['data']['updates'][0]['timestamp'] == 4.
+        assert messages[2]['data'] == dict(id='end')
+
+    def test_transform_point_in_time(self, tmp_path):
+        self.write_log(tmp_path / 'log', [1., 2., 3., 4.])
+        request = dict(type='xviz/transform_point_in_time', data=dict(id='seek', query_timestamp=3.5))
+        socket = FakeSocket([json.dumps(request)])
+        session = XVIZLogPlayHandler(str(tmp_path), snapshot_interval=2)(socket, dict(path='/log'))
+        asyncio.run(session.main())
+
+        assert len(socket.sent) == 2
+        message = json.loads(socket.sent[1])
+        assert message['data']['update_type'] == 'COMPLETE_STATE'
+        assert message['data']['updates'][0]['timestamp'] == 3.
+        assert sorted(message['data']['updates'][0]['primitives']) == ['/camera/front', '/lidar/points']
+
+class TestAdaptiveSender:
+    def test_merge_when_behind(self):
+        socket = FakeSocket(delay=0.05)
+        session = XVIZBaseSession(socket, dict(path='/'))
+        sender = XVIZAdaptiveSender(session)
+
+        async def run():
+            task = asyncio.ensure_future(sender.run())
+            for i in range(10):
+                builder = xb.XVIZBuilder()
+                builder.pose().timestamp(float(i)).position(1., 2., 3.)
+                builder.primitive('/object/%d' % (i % 3)).circle([0., 0., 0.], float(i))
+                sender.push(builder.get_message())
+                await asyncio.sleep(0.01)
+            while sender.pending:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.06)
+            task.cancel()
+        asyncio.run(run())
+
+        stats = sender.get_stats()
+        assert stats['sent'] == len(socket.sent) < 10
+        assert stats['sent'] + stats['merged'] == 10
+
+        last = json.loads(socket.sent[-1])['data']['updates'][0]
+        assert last['timestamp'] == 9.
+        assert sorted(last['primitives']) == ['/object/0', '/object/1', '/object/2']
+        assert last['primitives']['/object/0']['circles'][0]['radius'] == 9.
+
+class PidSession(XVIZBaseSession):
+    def on_connect(self):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+    async def main(self):
+        await self._socket.send(str(os.getpid()))
+        await self.receive_loop()
+
+class TestServer:
+    def test_router(self):
+        router = XVIZRouter({'/logs': 'logs', '/logs/special': 'special', '^/live/(?P<vehicle>\\w+)$': 'live',
+                             '/': 'default'})
+        assert [item[:2] for item in router.resolve('/logs/special/a')] == \
+            [('special', '/a'), ('logs', '/special/a'), ('default', '/logs/special/a')]
+        assert router.resolve('/logsx') == (('default', '/logsx', {}),)
+        assert router.resolve('/live/car1')[0] == ('live', '/live/car1', dict(vehicle='car1'))
+        router.resolve('/logs/special/a')
+        assert router.cache_info().hits == 1
+
+    def test_handle_session(self, tmp_path):
+        requests = []
+        def live_handler(socket, request):
+            requests.append(request)
+            return PidSession(socket, request)
+
+        server = XVIZServer({'/logs': XVIZLogPlayHandler(str(tmp_path)), '/': live_handler})
+        socket = FakeSocket()
+        asyncio.run(server.handle_session(socket, '/logs/missing?delay=10&format=binary'))
+
+        # the log handler doesn't find the log, so the request falls through to the next route
+        assert requests == [dict(path='/logs/missing', delay='10', format='binary')]
+        assert socket.sent == [str(os.getpid())]
+        assert server.stats['setup_latency']['count'] == 1
+
+        server = XVIZServer({'/logs': XVIZLogPlayHandler(str(tmp_path))})
+        socket = FakeSocket()
+        asyncio.run(server.handle_session(socket, '/other'))
+        assert socket.closed and server.stats['rejected'] == 1
+
+    def test_workers(self):
+        import websockets
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        server = XVIZServer(lambda socket, request: PidSession(socket, request), port=port,
+                            host='127.0.0.1', workers=2)
+        process = context.Process(target=lambda: results.put(server.run()))
+        process.start()
+
+        async def connect(url):
+            for _ in range(100):
+                try:
+                    return await websockets.connect(url)
+                except OSError:
+                    await asyncio.sleep(0.05)
+            raise TimeoutError("Server is not started")
+
+        async def run_clients():
+            clients = await asyncio.gather(*[connect('ws://127.0.0.1:%d/' % port) for _ in range(20)])
+            pids = await asyncio.gather(*[client.recv() for client in clients])
+            for client in clients:
+                await client.close()
+            return set(pids)
+
+        try:
+            pids = asyncio.run(run_clients())
+        finally:
+            os.kill(process.pid, signal.SIGTERM)
+            process.join(10)
+        stats = results.get(timeout=1)
+
+        assert process.exitcode == 0
+        assert len(stats) == 2
+        assert pids <= set(str(item['pid']) for item in stats)
+        assert sum(item['connections'] for item in stats) == 20
+        assert all(item['active'] == 0 for item in stats)
+
+class TestFrameBus:
+    def test_publish_and_read(self):
+        bus = XVIZFrameBus(create=True, slot_count=4, slot_size=64, metadata_size=64)
+        try:
+            reader = XVIZFrameBusReader(bus)
+            assert reader.read() is None and bus.read_metadata() is None
+
+            bus.publish_metadata('{"type":"xviz/metadata"}')
+            assert bus.publish(b'\x01\x02') == 1
+            assert bus.publish('text') == 2
+            assert bus.read_metadata() == '{"type":"xviz/metadata"}'
+            assert reader.read() == b'\x01\x02'
+            assert reader.read() == 'text'
+            assert reader.read() is None
+
+            for i in range(10):
+                bus.publish(b'%d' % i)
+            assert reader.pending == 10
+            assert [reader.read() for _ in range(4)] == [b'6', b'7', b'8', b'9']
+            assert reader.lost == 6
+
+            with pytest.raises(ValueError):
+                bus.publish(b'\x00' * 65)
+        finally:
+            bus.close()
+
+    def test_multiprocess(self):
+        bus = XVIZFrameBus(create=True, slot_count=16, slot_size=64)
+        try:
+            reader = XVIZFrameBusReader(bus, latest=False)
+
+            def produce():
+                producer = XVIZFrameBus(bus.name, track=True) # shares the tracker of the creator
+                for i in range(8):
+                    producer.publish(b'frame %d' % i)
+                producer.close()
+
+            process = multiprocessing.get_context('fork').Process(target=produce)
+            process.start()
+            process.join(10)
+
+            async def consume():
+                return [await asyncio.wait_for(reader.next(), 5) for _ in range(8)]
+            messages = asyncio.run(consume())
+            assert messages == [b'frame %d' % i for i in range(8)]
+            assert reader.lost == 0
+        finally:
+            bus.close()
+
+    def test_session(self):
+        bus = XVIZFrameBus(create=True, slot_count=4, slot_size=64, metadata_size=64)
+        try:
+            bus.publish_metadata('{"type":"xviz/metadata"}')
+            socket = FakeSocket([reconfigure('full', disabled_streams=['/camera/*'])])
+            session = XVIZFrameBusSession(socket, dict(path='/live'), bus)
+
+            async def run():
+                main = asyncio.ensure_future(session.main())
+                while len(socket.sent) < 2:
+                    await asyncio.sleep(0.01)
+                bus.publish(b'frame')
+                while len(socket.sent) < 3:
+                    await asyncio.sleep(0.01)
+                main.cancel()
+            asyncio.run(asyncio.wait_for(run(), 5))
+
+            errors = [json.loads(data) for data in socket.sent if isinstance(data, str) and 'xviz/error' in data]
+            assert len(errors) == 1 and 'not supported' in errors[0]['data']['message']
+            assert socket.sent[-1] == b'frame'
+        finally:
+            bus.close()
+
+    def test_unrelated_process(self):
+        bus = XVIZFrameBus(create=True, slot_count=4, slot_size=64)
+        try:
+            code = "from xviz.server.bus import XVIZFrameBus; XVIZFrameBus(%r).publish(b'frame')" % bus.name
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            subprocess.run([sys.executable, '-c', code], cwd=root, check=True, timeout=30)
+            # the memory is not unlinked by the tracker of the producer
+            attached = XVIZFrameBus(bus.name, track=True)
+            assert XVIZFrameBusReader(attached, latest=False).read() == b'frame'
+            attached.close()
+        finally:
+            bus.close()
+
+class TestReaderPool:
+    def test_shared_sessions(self, tmp_path):
+        TestSession().write_log(tmp_path / 'log', [1., 2., 3.])
+        pool = XVIZReaderPool(XVIZFrameCache(max_bytes=1 << 20))
+        handler = XVIZLogPlayHandler(str(tmp_path), autoplay=True, pool=pool)
+
+        sockets = [FakeSocket() for _ in range(3)]
+        sessions = [handler(socket, dict(path='/log')) for socket in sockets]
+        assert len(pool) == 1
+
+        async def run():
+            await sessions[2].handle_message(reconfigure('full', disabled_streams=['/camera/*']))
+            await asyncio.gather(*[session.main() for session in sessions])
+        asyncio.run(run())
+
+        assert len(pool) == 0
+        assert sockets[0].sent == sockets[1].sent and len(sockets[0].sent) == 4
+        assert len(sockets[2].sent) == 4 and sockets[2].sent != sockets[0].sent
+        # each message is decoded once, and encoded once for unfiltered sessions
+        assert pool.cache.misses == 8
+        assert pool.cache.hits == 4 + 4
+
+    def test_frame_cache_budget(self):
+        cache = XVIZFrameCache(max_bytes=10)
+        cache.put('a', 'a', 4)
+        cache.put('b', 'b', 4)
+        assert cache.get('a') == 'a'
+        cache.put('c', 'c', 4) # evicts b
+        assert cache.get('b') is None and cache.get('c') == 'c'
+        assert cache.nbytes == 8
+        cache.put('d', 'd', 11) # larger than the budget
+        assert len(cache) == 2
+
+    def test_prefetch_per_session(self, tmp_path):
+        TestSession().write_log(tmp_path / 'log', [float(i) for i in range(8)])
+        pool = XVIZReaderPool(prefetch=True)
+        first, second, third = [pool.acquire(str(tmp_path / 'log')) for _ in range(3)]
+        indices = [index for _, _, index in first.message_timings]
+
+        # interleaved playback doesn't break the sequential access of each other
+        for a, b in zip(indices[:4], indices[4:]):
+            first.read_message(a)
+            second.read_message(b)
+        for reader in [first, second]:
+            stats = reader.prefetch.get_stats()
+            assert stats['misses'] == 2 and stats['hits'] + stats['waits'] == 2
+
+        # messages sent from the encoded cache still advance the read ahead
+        encode = lambda message: b'encoded'
+        for index in indices[:2]:
+            first.get_encoded(index, 'test', encode)
+            assert third.get_encoded(index, 'test', encode) == b'encoded'
+        third.read_message(indices[2])
+        stats = third.prefetch.get_stats()
+        assert stats['misses'] == 0 and stats['hits'] + stats['waits'] == 1
+
+        for reader in [first, second, third]:
+            reader.close()
+        assert len(pool) == 0
+
+    def test_zip_log_with_prefetch(self, tmp_path):
+        TestSession().write_log(tmp_path / 'log', [1., 2., 3.])
+        with zipfile.ZipFile(str(tmp_path / 'log.zip'), 'w') as archive:
+            for name in os.listdir(str(tmp_path / 'log')):
+                archive.write(str(tmp_path / 'log' / name), name)
+
+        pool = XVIZReaderPool(prefetch=True)
+        socket = FakeSocket()
+        session = XVIZLogPlayHandler(str(tmp_path), autoplay=True, pool=pool)(socket, dict(path='/log.zip'))
+        asyncio.run(session.main())
+        assert len(socket.sent) == 4 and len(pool) == 0
@@ -1,7 +1,45 @@
-from .builder import XVIZBuilder, XVIZMetadataBuilder,\
-    ANNOTATION_TYPES,\
-    CATEGORY,\
-    COORDINATE_TYPES,\
-    SCALAR_TYPE,\
-    PRIMITIVE_TYPES,\
-    UIPRIMITIVE_TYPES
+'''
+Python implementation of XVIZ protocol. Builders are imported on first access so that
+importing submodules (e.g. `xviz.io.sources`) doesn't load protobuf and numpy.
+'''
+import importlib
+from typing import TYPE_CHECKING
+
+_LAZY_IMPORTS = dict(
+    XVIZBuilder='xviz.builder',
+    XVIZMetadataBuilder='xviz.builder',
+    ANNOTATION_TYPES='xviz.builder',
+    CATEGORY='xviz.builder',
+    COORDINATE_TYPES='xviz.builder',
+    SCALAR_TYPE='xviz.builder',
+    PRIMITIVE_TYPES='xviz.builder',
+    UIPRIMITIVE_TYPES='xviz.builder',
+    XVIZColumnarFrame='xviz.columnar'
+)
+__all__ = list(_LAZY_IMPORTS)
+
+def _lazy_getattr(module_name: str, lazy_imports: dict, name: str):
+    '''
+    Import the attribute `name` of module `module_name` from the module listed in `lazy_imports`
+    '''
+    if name not in lazy_imports:
+        raise AttributeError("module %r has no attribute %r" % (module_name, name))
+    return getattr(importlib.import_module(lazy_imports[name]), name)
+
+def __getattr__(name):
+    value = _lazy_getattr(__name__, _LAZY_IMPORTS, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+if TYPE_CHECKING:
+    from .builder import XVIZBuilder, XVIZMetadataBuilder,\
+        ANNOTATION_TYPES,\
+        CATEGORY,\
+        COORDINATE_TYPES,\
+        SCALAR_TYPE,\
+        PRIMITIVE_TYPES,\
+        UIPRIMITIVE_TYPES
+    from .columnar import XVIZColumnarFrame
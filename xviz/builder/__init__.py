@@ -13,6 +13,8 @@ from .base_builder import XVIZBaseBuilder,\
     PRIMITIVE_TYPES,\
     UIPRIMITIVE_TYPES
 from .xviz_builder import XVIZBuilder
+from .delta import XVIZFrameDiffer
+from .image import XVIZImageEncodingStage
 
 from .metadata import XVIZMetadataBuilder
 from .pose import XVIZPoseBuilder
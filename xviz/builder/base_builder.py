@@ -1,10 +1,8 @@
 import logging
 from typing import Union
-from easydict import EasyDict as edict
 
 from xviz.message import XVIZMessage
 from xviz.v2.session_pb2 import Metadata, StreamMetadata
-from xviz.v2.style_pb2 import StyleStreamValue
 
 ANNOTATION_TYPES = StreamMetadata.AnnotationType
 CATEGORY = StreamMetadata.Category
@@ -73,11 +71,6 @@ PRIMITIVE_STYLE_MAP = dict([
     ])
 ])
 
-# Test whether the keys are correct
-for fields in PRIMITIVE_STYLE_MAP.values():
-    for f in fields:
-        assert f in StyleStreamValue.__dict__
-
 class XVIZBaseBuilder:
     """
     # Reference
@@ -0,0 +1,115 @@
+import hashlib
+
+from xviz.message import XVIZMessage
+from xviz.v2.core_pb2 import StreamSet
+from xviz.v2.session_pb2 import StateUpdate
+
+# Stream-keyed fields of StreamSet that are subject to diffing. Poses and time series
+# are always sent since the pose defines the frame timestamp and time series are not keyed.
+DIFF_FIELDS = ('primitives', 'future_instances', 'variables', 'annotations', 'ui_primitives', 'links')
+
+def stream_digest(state) -> bytes:
+    '''
+    Compute content hash of a stream state (e.g. PrimitiveState) from its serialized form.
+    '''
+    return hashlib.blake2b(state.SerializeToString(deterministic=True), digest_size=16).digest()
+
+class XVIZFrameDiffer:
+    '''
+    Remove unchanged streams from consecutive state updates. The differ remembers the digest of
+    every stream it has sent, streams that disappear are reported through `no_data_streams` and
+    a `COMPLETE_STATE` keyframe is emitted every `keyframe_interval` messages.
+
+    One differ should be used per receiver (e.g. per session), since it tracks what was sent.
+    '''
+    def __init__(self, keyframe_interval=100):
+        '''
+        :param keyframe_interval: number of messages between two keyframes, 0 or None to only
+            send the first message as keyframe
+        '''
+        self._keyframe_interval = keyframe_interval
+        self._digests = {}
+        self._counter = 0
+
+    @property
+    def keyframe_interval(self):
+        return self._keyframe_interval
+
+    def reset(self):
+        '''
+        Forget the sent state, so that next message will be a keyframe.
+        '''
+        self._digests = {}
+        self._counter = 0
+
+    def diff(self, message: XVIZMessage) -> XVIZMessage:
+        '''
+        Return a new message only containing streams changed since the last call.
+        Messages other than incremental or complete state updates are passed through.
+        '''
+        data = message.data
+        if not isinstance(data, StateUpdate) or data.update_type not in \
+            (StateUpdate.UpdateType.INCREMENTAL, StateUpdate.UpdateType.COMPLETE_STATE):
+            return message
+
+        keyframe = self._counter == 0 or data.update_type == StateUpdate.UpdateType.COMPLETE_STATE \
+            or (self._keyframe_interval and self._counter % self._keyframe_interval == 0)
+        self._counter += 1
+
+        if keyframe:
+            self._digests = {}
+            for frame in data.updates:
+                self._record_frame(frame)
+            return XVIZMessage(StateUpdate(
+                update_type=StateUpdate.UpdateType.COMPLETE_STATE,
+                updates=data.updates
+            ))
+
+        # Every update is compared with the state left by the update before it, and the streams
+        # still live after the last update but missing from all updates of this message are cleared.
+        digests, seen = dict(self._digests), set()
+        updates = [self._diff_frame(frame, digests, seen) for frame in data.updates]
+        cleared = set(stream_id for stream_id in digests if stream_id not in seen)
+        if updates and cleared:
+            cleared.update(updates[-1].no_data_streams)
+            del updates[-1].no_data_streams[:]
+            updates[-1].no_data_streams.extend(sorted(cleared))
+        for stream_id in cleared:
+            digests.pop(stream_id, None)
+        self._digests = digests
+
+        return XVIZMessage(StateUpdate(
+            update_type=StateUpdate.UpdateType.INCREMENTAL,
+            updates=updates
+        ))
+
+    def _record_frame(self, frame: StreamSet):
+        for field in DIFF_FIELDS:
+            for stream_id, state in getattr(frame, field).items():
+                self._digests[stream_id] = stream_digest(state)
+        for stream_id in frame.no_data_streams:
+            self._digests.pop(stream_id, None)
+
+    def _diff_frame(self, frame: StreamSet, digests: dict, seen: set) -> StreamSet:
+        '''
+        Keep streams changed since the previous update, and update the running `digests` with the
+        frame. Streams in the frame are added to `seen`.
+        '''
+        result = StreamSet(timestamp=frame.timestamp)
+        for stream_id, pose in frame.poses.items():
+            result.poses[stream_id].CopyFrom(pose)
+        result.time_series.extend(frame.time_series)
+
+        for field in DIFF_FIELDS:
+            result_states = getattr(result, field)
+            for stream_id, state in getattr(frame, field).items():
+                digest = stream_digest(state)
+                seen.add(stream_id)
+                if digests.get(stream_id) != digest:
+                    result_states[stream_id].CopyFrom(state)
+                digests[stream_id] = digest
+
+        for stream_id in frame.no_data_streams:
+            digests.pop(stream_id, None)
+        result.no_data_streams.extend(frame.no_data_streams)
+        return result
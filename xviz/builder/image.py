@@ -0,0 +1,162 @@
+'''
+This module contains encoders that convert raw image arrays into image data for XVIZ image primitives.
+Encoders using Pillow or OpenCV are only available if either library is installed.
+'''
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+from xviz.stats import LatencyHistogram
+
+def _encode_raw(array: np.ndarray, quality=None) -> bytes:
+    return np.ascontiguousarray(array).tobytes()
+
+def _encode_with_library(array: np.ndarray, fmt: str, quality=None) -> bytes:
+    try:
+        from PIL import Image as PILImage
+    except ImportError:
+        pass
+    else:
+        import io
+        options = dict(quality=quality) if quality is not None and fmt == 'JPEG' else {}
+        with io.BytesIO() as fout:
+            PILImage.fromarray(array).save(fout, format=fmt, **options)
+            return fout.getvalue()
+
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError("Encoding image into %s requires Pillow or OpenCV" % fmt)
+
+    options = []
+    if quality is not None and fmt == 'JPEG':
+        options = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if array.ndim == 3 and array.shape[2] in (3, 4): # OpenCV uses BGR(A) order
+        array = array[..., [2, 1, 0, 3][:array.shape[2]]]
+    ok, result = cv2.imencode('.' + fmt.lower(), array, options)
+    if not ok:
+        raise ValueError("Failed to encode image into %s" % fmt)
+    return result.tobytes()
+
+def _encode_png(array: np.ndarray, quality=None) -> bytes:
+    return _encode_with_library(array, 'PNG')
+
+def _encode_jpeg(array: np.ndarray, quality=None) -> bytes:
+    return _encode_with_library(array, 'JPEG', quality)
+
+IMAGE_ENCODERS = dict(
+    raw=_encode_raw,
+    png=_encode_png,
+    jpeg=_encode_jpeg
+)
+DEFAULT_IMAGE_ENCODER = 'png'
+
+def register_image_encoder(name: str, encoder):
+    '''
+    Register a image encoder. The encoder will be called as `encoder(array, quality)` and returns bytes.
+    '''
+    IMAGE_ENCODERS[name] = encoder
+
+def encode_image(array: np.ndarray, encoder: str = None, quality: int = None) -> bytes:
+    '''
+    Encode image of shape HxW or HxWxC into bytes
+
+    :param encoder: name of the encoder in IMAGE_ENCODERS, PNG will be used by default
+    :param quality: encoding quality (0-100) for lossy encoders
+    '''
+    encoder = encoder or DEFAULT_IMAGE_ENCODER
+    if encoder not in IMAGE_ENCODERS:
+        raise ValueError("Unknown image encoder: %s" % encoder)
+    return IMAGE_ENCODERS[encoder](array, quality)
+
+def guess_mime_type(data: bytes) -> str:
+    '''
+    Guess the mime type of encoded image from its signature, return None if it's not recognized.
+    '''
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:4] == b'GIF8':
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[:2] == b'BM':
+        return 'image/bmp'
+    return None
+
+def get_image_size(data: bytes):
+    '''
+    Read (width, height) from header of PNG or JPEG data, return None if it's not recognized.
+    '''
+    mime_type = guess_mime_type(data)
+    if mime_type == 'image/png' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if mime_type == 'image/jpeg':
+        # Look for the start of frame segment
+        offset = 2
+        while offset + 9 <= len(data):
+            if data[offset] != 0xff:
+                return None
+            marker = data[offset + 1]
+            if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+
+    return None
+
+class XVIZImageEncodingStage:
+    '''
+    Encode images on a worker pool. Compression libraries release the GIL, so images of
+    multiple cameras are encoded in parallel. The encoding latency (including waiting in
+    the queue) is recorded per stream.
+    '''
+    def __init__(self, max_workers=None, executor=None):
+        '''
+        :param max_workers: number of worker threads if the executor is not given
+        :param executor: existing concurrent.futures.Executor to submit the encodings
+        '''
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers, thread_name_prefix="xviz-image")
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def submit(self, stream_id: str, array: np.ndarray, encoder: str = None, quality: int = None) -> Future:
+        '''
+        Submit image encoding and return the future of encoded bytes
+        '''
+        with self._lock:
+            histogram = self._histograms.get(stream_id)
+            if histogram is None:
+                histogram = self._histograms[stream_id] = LatencyHistogram()
+
+        start = time.perf_counter()
+        def encode():
+            result = encode_image(array, encoder, quality)
+            histogram.add(time.perf_counter() - start)
+            return result
+        return self._executor.submit(encode)
+
+    def latency_histogram(self, stream_id: str) -> LatencyHistogram:
+        return self._histograms.get(stream_id)
+
+    @property
+    def latency_histograms(self):
+        '''
+        Dictionary of encoding latency histograms keyed by stream id
+        '''
+        return dict(self._histograms)
+
+    def shutdown(self, wait=True):
+        if self._own_executor:
+            self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -1,10 +1,10 @@
 import logging
-from easydict import EasyDict as edict
 import numpy as np
 
 from xviz.message import XVIZMessage
 from xviz.builder.base_builder import build_object_style, build_stream_style
-from xviz.v2.session_pb2 import Metadata, StreamMetadata, LogInfo, UIPanelInfo
+from xviz.v2.session_pb2 import Metadata, StreamMetadata, LogInfo
+from xviz.v2.style_pb2 import StyleClass
 
 class XVIZMetadataBuilder:
     def __init__(self, logger=logging.getLogger("xviz")):
@@ -21,13 +21,11 @@ class XVIZMetadataBuilder:
 
         if self._temp_ui_builder:
             panels = self._temp_ui_builder.get_ui()
-            metadata.ui_config = edict()
 
-            for panel_key in panels.keys():
-                metadata.ui_config[panel_key] = UIPanelInfo(
-                    name=panels[panel_key].name,
-                    config=panels[panel_key]
-                )
+            for panel_key, panel in panels.items():
+                panel_info = metadata.ui_config[panel_key]
+                panel_info.name = panel['name']
+                panel_info.config.update(panel)
         return metadata
 
     def get_message(self):
@@ -105,7 +103,7 @@ class XVIZMetadataBuilder:
             self._logger.error('A stream must set before adding a style rule.')
             return self
 
-        stream_rule = edict(name=name, style=build_object_style(style))
+        stream_rule = StyleClass(name=name, style=build_object_style(style))
         self._temp_stream.style_classes.append(stream_rule)
         return self
 
@@ -1,8 +1,8 @@
-
+import base64
 import numpy as np
-from easydict import EasyDict as edict
 
 from xviz.builder.base_builder import XVIZBaseBuilder, build_object_style, CATEGORY, PRIMITIVE_TYPES, PRIMITIVE_STYLE_MAP
+from xviz.builder.image import XVIZImageEncodingStage, encode_image, get_image_size
 from xviz.v2.core_pb2 import PrimitiveState
 from xviz.v2.primitives_pb2 import PrimitiveBase, Circle, Image, Point, Polygon, Polyline, Stadium, Text
 
@@ -13,26 +13,57 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
     # Reference
     [@xviz/builder/xviz-primitive-builder]/(https://github.com/uber/xviz/blob/master/modules/builder/src/builders/xviz-primitive-builder.js)
     """
-    def __init__(self, metadata, logger=None):
+    def __init__(self, metadata, logger=None, executor=None):
+        '''
+        :param executor: optional XVIZImageEncodingStage or concurrent.futures.Executor used to
+            encode images in background. An executor is wrapped in a stage available as `image_stage`.
+        '''
         super().__init__(CATEGORY.PRIMITIVE, metadata, logger)
 
+        if executor is not None and not isinstance(executor, XVIZImageEncodingStage):
+            executor = XVIZImageEncodingStage(executor=executor)
+        self._image_stage = executor
         self._primitives = {}
+        self._pending_images = []
         self.reset()
 
-    def image(self, data):
+    @property
+    def image_stage(self) -> XVIZImageEncodingStage:
+        '''
+        The stage encoding images in background, its latency histograms are recorded per stream
+        '''
+        return self._image_stage
+
+    def image(self, data, encoder=None, quality=None):
         '''
         Add image data
+
+        :param data: encoded image (bytes or base64 string), or numpy array of shape HxW or HxWxC
+        :param encoder: encoder name for array input, see `xviz.builder.image.IMAGE_ENCODERS`
+        :param quality: encoding quality (0-100) for lossy encoders
         '''
         if self._type:
             self._flush()
 
-        if not isinstance(data, np.ndarray) or not isinstance(data, str):
-            # TODO: support PILLOW and other image types
-            # should save raw data and preserve mimetype?
-            self._logger.error("An image data must be a string or numpy array")
         self._validate_prop_set_once("_image")
         self._type = PRIMITIVE_TYPES.IMAGE
-        self._image = Image(data=data)
+        self._image = Image()
+
+        if isinstance(data, np.ndarray):
+            self._image.height_px, self._image.width_px = data.shape[:2]
+            if self._image_stage:
+                self._image_future = self._image_stage.submit(self._stream_id, data, encoder, quality)
+            else:
+                self._image.data = encode_image(data, encoder, quality)
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            self._image.data = bytes(data)
+            size = get_image_size(self._image.data)
+            if size:
+                self._image.width_px, self._image.height_px = size
+        elif isinstance(data, str):
+            self._image.data = base64.b64decode(data)
+        else:
+            self._logger.error("An image data must be bytes, string or numpy array")
 
         return self
 
@@ -160,7 +191,7 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
         super()._validate()
 
         if self._type == PRIMITIVE_TYPES.IMAGE:
-            if self._image == None or self._image.data == None:
+            if self._image is None or not (self._image.data or self._image_future):
                 self._logger.warning("Stream {} image data are not provided.".format(self._stream_id))
         else:
             if self._vertices == None:
@@ -177,6 +208,11 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
         if len(self._primitives) == 0:
             return None
 
+        # Wait for background image encodings
+        for image, future in self._pending_images:
+            image.data = future.result()
+        self._pending_images = []
+
         return self._primitives
 
     def _validate_prerequisite(self):
@@ -193,6 +229,8 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
 
         obj = self._format_primitive()
         array.append(obj)
+        if self._image_future:
+            self._pending_images.append((array[-1], self._image_future))
 
         self.reset()
 
@@ -217,7 +255,7 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
             obj = Stadium(start=self._vertices[0], end=self._vertices[1], radius=self._radius)
         elif self._type == PRIMITIVE_TYPES.IMAGE:
             if self._vertices:
-                self._image.position = self._vertices[0]
+                self._image.position.extend(self._vertices[0])
             obj = self._image
 
         # Embed base data
@@ -252,6 +290,7 @@ class XVIZPrimitiveBuilder(XVIZBaseBuilder):
         self._type = None
 
         self._image = None
+        self._image_future = None
         self._vertices = None
         self._radius = None
         self._text = None
@@ -1,7 +1,7 @@
 import logging
-from easydict import EasyDict as edict
 
 from xviz.message import XVIZFrame, XVIZMessage
+from xviz.filter import XVIZStreamFilter
 
 from xviz.builder.link import XVIZLinkBuilder
 from xviz.builder.future_instance import XVIZFutureInstanceBuilder
@@ -19,21 +19,37 @@ PRIMARY_POSE_STREAM = '/vehicle_pose'
 
 class XVIZBuilder:
     def __init__(self, metadata=None, disable_streams=None,
-                 logger=logging.getLogger("xviz")):
+                 logger=logging.getLogger("xviz"), differ=None, image_executor=None):
+        '''
+        :param disable_streams: list of stream ids (or glob patterns) to be dropped from the output
+        :param differ: optional XVIZFrameDiffer, if given then only changed streams are kept in the message
+        :param image_executor: optional XVIZImageEncodingStage or concurrent.futures.Executor to encode
+            images in background. The encodings are joined when the frame is finalized in `get_data()`.
+            The stage and its per-stream latency histograms are available as `image_stage`.
+        '''
         self._logger = logger
+        self._differ = differ
         self._metadata = metadata
         self._disable_streams = disable_streams or []
+        self._stream_filter = XVIZStreamFilter(denylist=self._disable_streams)
         self._stream_builder = None
         self._update_type = StateUpdate.UpdateType.INCREMENTAL
 
         self._links_builder = XVIZLinkBuilder(self._metadata, self._logger)
         self._pose_builder = XVIZPoseBuilder(self._metadata, self._logger)
         self._variables_builder = XVIZVariableBuilder(self._metadata, self._logger)
-        self._primitives_builder = XVIZPrimitiveBuilder(self._metadata, self._logger)
+        self._primitives_builder = XVIZPrimitiveBuilder(self._metadata, self._logger, image_executor)
         self._future_instance_builder = XVIZFutureInstanceBuilder(self._metadata, self._logger)
         self._ui_primitives_builder = XVIZUIPrimitiveBuilder(self._metadata, self._logger)
         self._time_series_builder = XVIZTimeSeriesBuilder(self._metadata, self._logger)
 
+    @property
+    def image_stage(self):
+        '''
+        XVIZImageEncodingStage encoding images of this builder, None if images are encoded inline
+        '''
+        return self._primitives_builder.image_stage
+
     def pose(self, stream_id=PRIMARY_POSE_STREAM):
         self._stream_builder = self._pose_builder.stream(stream_id)
         return self._stream_builder
@@ -82,6 +98,8 @@ class XVIZBuilder:
             links=self._links_builder.get_data()
         ))
 
+        if self._stream_filter.enabled:
+            data = XVIZFrame(self._stream_filter.filter_frame(data.data))
         return data
 
     def get_message(self):
@@ -89,4 +107,6 @@ class XVIZBuilder:
             update_type=self._update_type,
             updates=[self.get_data().data]
         ))
+        if self._differ:
+            message = self._differ.diff(message)
         return message
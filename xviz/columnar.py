@@ -0,0 +1,180 @@
+'''
+This module provides a compact, columnar representation of frames. Vertices, colors and object ids
+of point, polyline and polygon primitives are stored as numpy arrays keyed by stream, the rest of
+the frame is kept as serialized protobuf data. It's suitable for keeping long history in memory.
+'''
+from typing import List
+import numpy as np
+
+from xviz.message import XVIZMessage
+from xviz.v2.core_pb2 import StreamSet
+from xviz.v2.session_pb2 import StateUpdate
+
+# Primitive categories stored in columns, and their vertex field. Colors are only stored in columns for points.
+VERTEX_FIELDS = dict(points='points', polylines='vertices', polygons='vertices')
+
+class PrimitiveColumns:
+    '''
+    Columns of primitives of one category in a stream. Vertices of the i-th primitive are
+    `vertices[offsets[i]:offsets[i+1]]`, and its colors (in bytes) are
+    `colors[color_offsets[i]:color_offsets[i+1]]`.
+    '''
+    __slots__ = ('vertices', 'offsets', 'colors', 'color_offsets', 'ids')
+
+    def __init__(self, vertices: np.ndarray, offsets: np.ndarray, colors: np.ndarray = None,
+                 color_offsets: np.ndarray = None, ids: np.ndarray = None):
+        '''
+        :param vertices: float32 array of shape Nx3
+        :param offsets: int64 array of vertex offsets with length (primitive count + 1)
+        :param colors: optional uint8 array of colors in bytes
+        :param color_offsets: int64 array of color offsets, required if colors are given
+        :param ids: optional string array of object ids, empty strings for primitives without id
+        '''
+        self.vertices = vertices
+        self.offsets = offsets
+        self.colors = colors
+        self.color_offsets = color_offsets
+        self.ids = ids
+
+    @staticmethod
+    def from_arrays(vertices: list, colors: list = None, ids: list = None) -> 'PrimitiveColumns':
+        '''
+        Create columns from per-primitive arrays. A single array is used without copying.
+
+        :param vertices: list of vertex arrays of shape Nx3 (or flattened)
+        :param colors: list of uint8 color arrays or None for each primitive
+        :param ids: list of object ids for each primitive
+        '''
+        vertices = [np.asarray(v, dtype=np.float32).reshape(-1, 3) for v in vertices]
+        offsets = np.zeros(len(vertices) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in vertices], out=offsets[1:])
+        if len(vertices) == 1:
+            flat_vertices = vertices[0]
+        else:
+            flat_vertices = np.concatenate(vertices) if vertices else np.empty((0, 3), dtype=np.float32)
+
+        flat_colors = color_offsets = None
+        if colors and any(c is not None and len(c) for c in colors):
+            colors = [np.empty(0, dtype=np.uint8) if c is None else np.asarray(c, dtype=np.uint8).reshape(-1)
+                      for c in colors]
+            color_offsets = np.zeros(len(colors) + 1, dtype=np.int64)
+            np.cumsum([len(c) for c in colors], out=color_offsets[1:])
+            flat_colors = colors[0] if len(colors) == 1 else np.concatenate(colors)
+
+        if ids is not None and any(ids):
+            ids = np.array(ids)
+        else:
+            ids = None
+        return PrimitiveColumns(flat_vertices, offsets, flat_colors, color_offsets, ids)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_vertices(self, index: int) -> np.ndarray:
+        return self.vertices[self.offsets[index]:self.offsets[index + 1]]
+
+    def get_colors(self, index: int) -> np.ndarray:
+        if self.colors is None:
+            return None
+        return self.colors[self.color_offsets[index]:self.color_offsets[index + 1]]
+
+    def get_id(self, index: int) -> str:
+        return str(self.ids[index]) if self.ids is not None else ''
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.vertices, self.offsets, self.colors, self.color_offsets, self.ids)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+class XVIZColumnarFrame:
+    '''
+    Columnar representation of a frame (`StreamSet`) in state update. Primitives with vertices are
+    stored in `primitives` as {stream_id: {category: PrimitiveColumns}}, and the remaining data
+    (with vertices, point colors and object ids of those primitives cleared) is stored in serialized form.
+    '''
+    __slots__ = ('timestamp', 'update_type', 'primitives', 'remainder')
+
+    def __init__(self, timestamp: float, primitives: dict = None, remainder: bytes = b'',
+                 update_type: int = StateUpdate.UpdateType.INCREMENTAL):
+        self.timestamp = timestamp
+        self.update_type = update_type
+        self.primitives = primitives or {}
+        self.remainder = remainder
+
+    @staticmethod
+    def from_frame(frame: StreamSet, update_type: int = StateUpdate.UpdateType.INCREMENTAL)\
+            -> 'XVIZColumnarFrame':
+        remainder = StreamSet()
+        remainder.CopyFrom(frame)
+
+        primitives = {}
+        for stream_id, pstate in remainder.primitives.items():
+            for category, field in VERTEX_FIELDS.items():
+                items = getattr(pstate, category)
+                if not items:
+                    continue
+
+                vertices, colors, ids = [], [], []
+                for item in items:
+                    vertices.append(np.array(getattr(item, field), dtype=np.float32))
+                    colors.append(np.frombuffer(item.colors, dtype=np.uint8)
+                                  if category == 'points' and item.colors else None)
+                    ids.append(item.base.object_id)
+
+                    item.ClearField(field)
+                    if category == 'points':
+                        item.ClearField('colors')
+                    if item.base.object_id:
+                        item.base.ClearField('object_id')
+                primitives.setdefault(stream_id, {})[category] = \
+                    PrimitiveColumns.from_arrays(vertices, colors, ids)
+
+        return XVIZColumnarFrame(frame.timestamp, primitives, remainder.SerializeToString(), update_type)
+
+    def get_remainder(self) -> StreamSet:
+        '''
+        Get the frame without columnar data
+        '''
+        return StreamSet.FromString(self.remainder)
+
+    def to_frame(self) -> StreamSet:
+        frame = self.get_remainder()
+        for stream_id, categories in self.primitives.items():
+            for category, columns in categories.items():
+                field = VERTEX_FIELDS[category]
+                for index, item in enumerate(getattr(frame.primitives[stream_id], category)):
+                    getattr(item, field).extend(columns.get_vertices(index).ravel().tolist())
+                    colors = columns.get_colors(index)
+                    if colors is not None and len(colors):
+                        item.colors = colors.tobytes()
+                    object_id = columns.get_id(index)
+                    if object_id:
+                        item.base.object_id = object_id
+        return frame
+
+    @staticmethod
+    def from_message(message: XVIZMessage) -> List['XVIZColumnarFrame']:
+        '''
+        Convert each frame in the state update into columnar frame
+        '''
+        update = message.data
+        if not isinstance(update, StateUpdate):
+            raise ValueError("Only state update can be converted into columnar frames")
+        return [XVIZColumnarFrame.from_frame(frame, update.update_type) for frame in update.updates]
+
+    @staticmethod
+    def to_message(frames: List['XVIZColumnarFrame']) -> XVIZMessage:
+        '''
+        Combine columnar frames into a state update, the update type of the first frame is used
+        '''
+        update = StateUpdate(update_type=frames[0].update_type if frames else StateUpdate.UpdateType.INCREMENTAL)
+        update.updates.extend(frame.to_frame() for frame in frames)
+        return XVIZMessage(update=update)
+
+    @property
+    def nbytes(self) -> int:
+        '''
+        Approximate memory used by the frame data
+        '''
+        return len(self.remainder) + sum(columns.nbytes
+            for categories in self.primitives.values() for columns in categories.values())
@@ -0,0 +1,117 @@
+'''
+This module provides filtering of streams in messages, which is used to drop unwanted streams
+before messages are serialized.
+'''
+from fnmatch import fnmatchcase
+
+from xviz.message import XVIZMessage
+from xviz.v2.core_pb2 import StreamSet
+from xviz.v2.session_pb2 import StateUpdate, Metadata
+
+# Stream-keyed fields of StreamSet
+STREAM_FIELDS = ('poses', 'primitives', 'future_instances', 'variables', 'annotations', 'ui_primitives', 'links')
+
+class XVIZStreamFilter:
+    '''
+    Filter streams by allow list and deny list. Entries can be stream ids or glob patterns
+    (e.g. "/camera/*"). A stream is accepted if it matches the allow list (or the allow list
+    is not set) and doesn't match the deny list.
+    '''
+    def __init__(self, allowlist=None, denylist=None):
+        '''
+        :param allowlist: streams to be kept, None to keep all streams
+        :param denylist: streams to be dropped
+        '''
+        self._allowlist = None
+        self._denylist = set()
+        self._cache = {}
+        self.update(allowlist, denylist)
+
+    @property
+    def allowlist(self):
+        return self._allowlist
+
+    @property
+    def denylist(self):
+        return self._denylist
+
+    @property
+    def enabled(self) -> bool:
+        return self._allowlist is not None or bool(self._denylist)
+
+    def update(self, allowlist=None, denylist=None, full=True):
+        '''
+        Update the filter lists
+
+        :param full: replace the lists if True, otherwise add given streams into the lists
+        '''
+        if full:
+            self._allowlist = set(allowlist) if allowlist is not None else None
+            self._denylist = set(denylist or [])
+        else:
+            if allowlist is not None:
+                self._allowlist = (self._allowlist or set()) | set(allowlist)
+            if denylist:
+                self._denylist |= set(denylist)
+        self._cache = {}
+
+    def accepts(self, stream_id: str) -> bool:
+        result = self._cache.get(stream_id)
+        if result is None:
+            result = self._cache[stream_id] = self._match(stream_id)
+        return result
+
+    def _match(self, stream_id: str) -> bool:
+        def matches(patterns):
+            return stream_id in patterns or any(fnmatchcase(stream_id, p) for p in patterns if '*' in p)
+
+        if self._allowlist is not None and not matches(self._allowlist):
+            return False
+        return not matches(self._denylist)
+
+    def filter_frame(self, frame: StreamSet) -> StreamSet:
+        '''
+        Return a copy of the frame only containing accepted streams
+        '''
+        result = StreamSet(timestamp=frame.timestamp)
+        for field in STREAM_FIELDS:
+            result_states = getattr(result, field)
+            for stream_id, state in getattr(frame, field).items():
+                if self.accepts(stream_id):
+                    result_states[stream_id].CopyFrom(state)
+
+        for state in frame.time_series:
+            accepted = [i for i, stream_id in enumerate(state.streams) if self.accepts(stream_id)]
+            if len(accepted) == len(state.streams):
+                result.time_series.add().CopyFrom(state)
+            elif accepted:
+                filtered = result.time_series.add(timestamp=state.timestamp, object_id=state.object_id)
+                filtered.streams.extend(state.streams[i] for i in accepted)
+                for field, values in state.values.ListFields():
+                    if len(values) == len(state.streams):
+                        getattr(filtered.values, field.name).extend(values[i] for i in accepted)
+
+        result.no_data_streams.extend(s for s in frame.no_data_streams if self.accepts(s))
+        return result
+
+    def apply(self, message: XVIZMessage) -> XVIZMessage:
+        '''
+        Filter streams in state update or metadata. The message is returned directly if the filter is not enabled.
+        '''
+        if not self.enabled:
+            return message
+
+        data = message.data
+        if isinstance(data, StateUpdate):
+            return XVIZMessage(update=StateUpdate(
+                update_type=data.update_type,
+                updates=[self.filter_frame(frame) for frame in data.updates]
+            ))
+        elif isinstance(data, Metadata):
+            metadata = Metadata()
+            metadata.CopyFrom(data)
+            for stream_id in list(metadata.streams):
+                if not self.accepts(stream_id):
+                    del metadata.streams[stream_id]
+            return XVIZMessage(metadata=metadata)
+        return message
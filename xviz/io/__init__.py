@@ -1,4 +1,46 @@
+'''
+This module contains readers and writers of XVIZ logs. Sources only depend on the standard
+library, while writers and readers are imported on first access.
+'''
+from typing import TYPE_CHECKING
+from xviz import _lazy_getattr
 from xviz.io.sources import MemorySource, DirectorySource, ZipSource, SQLiteSource
-from xviz.io.json import XVIZJsonWriter
-from xviz.io.gltf import XVIZGLBWriter
-from xviz.io.protobuf import XVIZProtobufWriter
+
+_LAZY_IMPORTS = dict(
+    XVIZJsonWriter='xviz.io.json',
+    XVIZGLBWriter='xviz.io.gltf',
+    XVIZGLBReader='xviz.io.gltf',
+    XVIZProtobufWriter='xviz.io.protobuf',
+    XVIZProtobufReader='xviz.io.protobuf',
+    XVIZFragmentCache='xviz.io.cache',
+    XVIZPointCloudDecimator='xviz.io.lod',
+    XVIZTableExporter='xviz.io.table',
+    XVIZTableReader='xviz.io.table',
+    XVIZStateAccumulator='xviz.io.snapshot',
+    XVIZSnapshotIndex='xviz.io.snapshot',
+    XVIZPrefetchReader='xviz.io.prefetch',
+    AsyncSource='xviz.io.aio',
+    AsyncDirectorySource='xviz.io.aio',
+    AsyncZipSource='xviz.io.aio',
+    XVIZAsyncWriter='xviz.io.aio'
+)
+__all__ = ['MemorySource', 'DirectorySource', 'ZipSource', 'SQLiteSource'] + list(_LAZY_IMPORTS)
+
+def __getattr__(name):
+    value = _lazy_getattr(__name__, _LAZY_IMPORTS, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+if TYPE_CHECKING:
+    from xviz.io.json import XVIZJsonWriter
+    from xviz.io.gltf import XVIZGLBWriter, XVIZGLBReader
+    from xviz.io.protobuf import XVIZProtobufWriter, XVIZProtobufReader
+    from xviz.io.cache import XVIZFragmentCache
+    from xviz.io.lod import XVIZPointCloudDecimator
+    from xviz.io.table import XVIZTableExporter, XVIZTableReader
+    from xviz.io.snapshot import XVIZStateAccumulator, XVIZSnapshotIndex
+    from xviz.io.prefetch import XVIZPrefetchReader
+    from xviz.io.aio import AsyncSource, AsyncDirectorySource, AsyncZipSource, XVIZAsyncWriter
@@ -0,0 +1,217 @@
+'''
+This module provides asyncio interfaces of the sources and writers, so that logs can be written
+and read inside the event loop (e.g. in server sessions) without blocking it. Blocking IO of the
+synchronous sources is run in an executor, and the synchronous writers are reused to serialize
+messages.
+'''
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from xviz.io.sources import DirectorySource, ZipSource
+from xviz.message import XVIZMessage
+
+class AsyncSource:
+    '''
+    Wrap a source in xviz.io.sources with coroutine methods. Operations run in order on a single
+    background thread by default.
+    '''
+    def __init__(self, source, executor=None):
+        '''
+        :param source: object of type in xviz.io.sources
+        :param executor: optional executor to run the blocking operations
+        '''
+        self._source = source
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(1, thread_name_prefix='xviz-io')
+
+    @property
+    def source(self):
+        '''
+        The wrapped synchronous source
+        '''
+        return self._source
+
+    def submit(self, func, *args) -> asyncio.Future:
+        '''
+        Schedule a blocking function in the executor of this source and return the future
+        '''
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def run(self, func, *args):
+        '''
+        Run a blocking function in the executor of this source
+        '''
+        return await self.submit(func, *args)
+
+    async def read(self, name):
+        return await self.run(self._source.read, name)
+
+    async def write(self, data, name):
+        await self.run(self._source.write, data, name)
+
+    async def close(self):
+        await self.run(self._source.close)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+class AsyncDirectorySource(AsyncSource):
+    def __init__(self, directory, executor=None):
+        super().__init__(DirectorySource(directory), executor)
+
+class AsyncZipSource(AsyncSource):
+    def __init__(self, path, mode='r', executor=None, **options):
+        '''
+        :param options: other options of ZipSource, such as compression
+        '''
+        super().__init__(ZipSource(path, mode, **options), executor)
+
+class _DeferredFile(io.RawIOBase):
+    '''
+    Write-only file recording written data as operations of the deferred sink
+    '''
+    def __init__(self, sink, handle):
+        self._sink = sink
+        self._handle = handle
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._sink.operations.append(('data', self._handle, data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._sink.operations.append(('close', self._handle, None))
+        super().close()
+
+class _DeferredSink:
+    '''
+    Sink given to synchronous writers, which records the operations to be applied on the real source later
+    '''
+    def __init__(self):
+        self.operations = []
+        self._counter = 0
+
+    def open(self, name, mode='r'):
+        if mode != 'w':
+            raise ValueError("Only writing is supported by the asynchronous writers")
+        self._counter += 1
+        self.operations.append(('open', self._counter, name))
+        return _DeferredFile(self, self._counter)
+
+    def write(self, data, name):
+        self.operations.append(('write', name, data))
+
+    def close(self):
+        pass # the source is closed by the asynchronous writer
+
+def _apply_operations(source, files: dict, operations: list):
+    for op, key, value in operations:
+        if op == 'open':
+            files[key] = source.open(value, 'w')
+        elif op == 'data':
+            files[key].write(value)
+        elif op == 'close':
+            files.pop(key).close()
+        elif op == 'write':
+            source.write(value, key)
+
+class XVIZAsyncWriter:
+    '''
+    Asynchronous interface of the writers. Messages are serialized by the synchronous writer in the
+    calling thread, so the message can be used again right after `write_message` returns, and the
+    serialized data is written into the source by its executor. Writes are chained so that they are
+    applied in order even if the executor has several threads.
+
+    Usage::
+
+        writer = XVIZAsyncWriter(XVIZGLBWriter, AsyncDirectorySource(path))
+        await writer.write_message(message)
+        await writer.close()
+    '''
+    def __init__(self, writer_class, sink: AsyncSource, serialize_in_executor=False, **options):
+        '''
+        :param writer_class: class of the writer, such as XVIZJsonWriter or XVIZGLBWriter
+        :param sink: AsyncSource to write into
+        :param serialize_in_executor: serialize messages in the executor of the sink as well, so that the
+            event loop is not blocked by large messages. The message must not be modified until it's written.
+        :param options: other options of the writer
+        '''
+        self._sink = sink
+        self._serialize_in_executor = serialize_in_executor
+        self._deferred = _DeferredSink()
+        self._files = {}
+        self._writer = writer_class(self._deferred, **options)
+        self._pending = set()
+        self._last = None
+        self._error = None
+
+    def _take_operations(self) -> list:
+        operations, self._deferred.operations = self._deferred.operations, []
+        return operations
+
+    def _serialize(self, func, *args):
+        func(*args)
+        _apply_operations(self._sink.source, self._files, self._take_operations())
+
+    async def _run_after(self, previous, func, *args):
+        if previous is not None:
+            await asyncio.wait([previous])
+        if self._error is not None: # the log is broken after a failed write
+            raise self._error
+        await self._sink.run(func, *args)
+
+    def _on_done(self, task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._error is None:
+            self._error = task.exception()
+
+    def _submit(self, func, *args):
+        '''
+        Run the function in the executor after the previous submission
+        '''
+        task = asyncio.ensure_future(self._run_after(self._last, func, *args))
+        task.add_done_callback(self._on_done)
+        self._pending.add(task)
+        self._last = task
+        return task
+
+    def _submit_write(self, func, *args):
+        if self._serialize_in_executor:
+            return self._submit(self._serialize, func, *args)
+
+        func(*args)
+        operations = self._take_operations()
+        if not operations:
+            return None
+        return self._submit(_apply_operations, self._sink.source, self._files, operations)
+
+    async def write_message(self, message: XVIZMessage, index: int = None, wait: bool = True):
+        '''
+        :param wait: wait until the data is written, otherwise return once the data is queued.
+            The first error of queued writes is raised by `close()`.
+        '''
+        task = self._submit_write(self._writer.write_message, message, index)
+        if task is not None and wait:
+            await asyncio.shield(task)
+
+    async def close(self):
+        '''
+        Write the index and wait for all queued writes, then close the source
+        '''
+        self._submit_write(self._writer.close)
+        try:
+            if self._pending:
+                await asyncio.wait(list(self._pending))
+        finally:
+            await self._sink.close()
+        if self._error is not None:
+            raise self._error
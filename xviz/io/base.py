@@ -1,41 +1,52 @@
 
-from easydict import EasyDict as edict
+import bisect
+import itertools
 import json
+from typing import List
 
 from xviz.io.sources import BaseSource
 from xviz.message import AllDataType, XVIZMessage, Metadata
 
 class XVIZBaseWriter:
-    def __init__(self, source: BaseSource):
+    def __init__(self, source: BaseSource, decimator=None):
         '''
         :param sink: object of type in xviz.io.sources
+        :param decimator: optional XVIZPointCloudDecimator applied to messages before writing
         '''
         if source is None:
             raise ValueError("Data source must be specified!")
         self._source = source
+        self._decimator = decimator
         self._message_timings = dict(messages={})
         self._wrote_message_index = False
         self._counter = 2
 
-    def _get_sequential_name(self, message: XVIZMessage, index=None):
+    def _get_sequential_index(self, message: XVIZMessage, index=None) -> int:
         raw_data = message.data
         if isinstance(raw_data, Metadata):
             self._save_timestamp(raw_data)
-            fname = "1-frame"
-        else:
-            if not index:
-                index = self._counter
-                self._counter += 1
+            return 1
+
+        if not index:
+            index = self._counter
+            self._counter += 1
+
+        self._save_timestamp(raw_data, index)
+        return index
 
-            self._save_timestamp(raw_data, index)
-            fname = "%d-frame" % index
-        return fname
+    def _get_sequential_name(self, message: XVIZMessage, index=None):
+        return "%d-frame" % self._get_sequential_index(message, index)
+
+    def _prepare_message(self, message: XVIZMessage) -> XVIZMessage:
+        if self._decimator:
+            message = self._decimator.apply(message)
+        return message
 
     def _write_message_index(self):
         self._check_valid()
         
-        times = sorted(self._message_timings.keys())
-        timing = [self._message_timings[t] for t in times]
+        messages = self._message_timings['messages']
+        timing = [messages[index] for index in sorted(messages)]
 
         self._message_timings['timing'] = timing
         self._source.write(json.dumps(self._message_timings, separators=(',', ':'))\
@@ -69,5 +80,88 @@ class XVIZBaseWriter:
                 self._message_timings['end_time'] = xviz_data.log_info.end_time
 
 class XVIZBaseReader:
-    def __init__(self, source):
-        raise NotImplementedError()
+    '''
+    Base class of readers for logs written by the writers. Messages are addressed by their index,
+    where index 1 is the metadata and state updates start from index 2.
+    '''
+    SUFFIX = None
+
+    def __init__(self, source: BaseSource):
+        '''
+        :param source: object of type in xviz.io.sources
+        '''
+        if source is None:
+            raise ValueError("Data source must be specified!")
+        self._source = source
+        self._timings = None
+        self._end_times = None
+
+    def _get_file_name(self, index: int) -> str:
+        return "%d-frame%s" % (index, self.SUFFIX)
+
+    def _load_index(self):
+        if self._timings is not None:
+            return
+
+        try:
+            index = json.loads(self._source.read('0-frame.json'))
+        except (IOError, KeyError):
+            self._timings, self._end_times = [], []
+            return
+
+        if 'timing' in index:
+            timings = index['timing']
+        else:
+            timings = sorted(index.get('messages', {}).values(), key=lambda item: item[2])
+        self._timings = [tuple(item[:3]) for item in timings]
+        self._end_times = [item[1] for item in self._timings]
+
+    @property
+    def message_timings(self):
+        '''
+        List of (start time, end time, index) of the state updates sorted by index
+        '''
+        self._load_index()
+        return self._timings
+
+    def __len__(self):
+        return len(self.message_timings)
+
+    def find_message(self, timestamp: float) -> int:
+        '''
+        Get index of the first state update ending at or after the timestamp, return None if
+        the timestamp is later than all updates.
+        '''
+        timings = self.message_timings
+        position = bisect.bisect_left(self._end_times, timestamp)
+        if position == len(timings):
+            return None
+        return timings[position][2]
+
+    def find_messages(self, start_time: float = None, end_time: float = None) -> List[int]:
+        '''
+        Get indices of state updates overlapping with the time range. The first update is located
+        by binary search, so no message before it is read.
+
+        :param start_time: start of the range, None to start from the first update
+        :param end_time: end of the range, None to end at the last update
+        '''
+        timings = self.message_timings
+        position = 0 if start_time is None else bisect.bisect_left(self._end_times, start_time)
+        indices = []
+        for tmin, _, index in itertools.islice(timings, position, None):
+            if end_time is not None and tmin > end_time:
+                break
+            indices.append(index)
+        return indices
+
+    def read_metadata(self) -> XVIZMessage:
+        return self.read_message(1)
+
+    def read_message(self, index: int) -> XVIZMessage:
+        raise NotImplementedError("Derived class should implement this method")
+
+    def close(self):
+        if self._source:
+            self._source.close()
+            self._source = None
@@ -0,0 +1,94 @@
+'''
+This module contains a cache of encoded stream fragments, so that streams which stay the same
+across frames (map layers, grids, etc.) are only encoded once by the JSON writer.
+
+The protobuf writer doesn't use the cache: the key is computed from the serialized state, which is
+already the encoded fragment in protobuf.
+'''
+import hashlib
+from collections import OrderedDict
+
+from xviz.builder.delta import DIFF_FIELDS
+from xviz.v2.core_pb2 import StreamSet
+
+class XVIZFragmentCache:
+    '''
+    LRU cache of encoded stream fragments, keyed by encoding kind, stream id and content hash.
+    A single cache can be shared between writers with different options.
+    '''
+    def __init__(self, capacity=4096):
+        '''
+        :param capacity: maximum number of fragments kept in the cache
+        '''
+        self._capacity = capacity
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self._capacity:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def fragment(self, kind, stream_id, state, encode):
+        '''
+        Get encoded fragment of a stream state, the fragment is generated by `encode` on cache miss.
+
+        :param kind: hashable identifier of the encoding (format and options)
+        :param stream_id: id of the stream
+        :param state: stream state message (e.g. PrimitiveState)
+        :param encode: function called as `encode(stream_id, state, serialized)` to generate fragment,
+            where `serialized` is the protobuf serialization of the state
+        '''
+        serialized = state.SerializeToString(deterministic=True)
+        key = (kind, stream_id, hashlib.blake2b(serialized, digest_size=16).digest())
+
+        value = self.get(key)
+        if value is None:
+            value = encode(stream_id, state, serialized)
+            self.put(key, value)
+        return value
+
+def split_stream_fields(frame: StreamSet):
+    '''
+    Split a frame into a StreamSet without stream-keyed fields and a list of these fields.
+
+    :return: (stripped frame, list of (field descriptor, stream map) in field order)
+    '''
+    stripped = StreamSet()
+    stream_fields = []
+    for field, value in frame.ListFields():
+        if field.name in DIFF_FIELDS:
+            stream_fields.append((field, value))
+        elif field.label == field.LABEL_REPEATED or field.message_type:
+            getattr(stripped, field.name).MergeFrom(value)
+        else:
+            setattr(stripped, field.name, value)
+    return stripped, stream_fields
@@ -3,20 +3,17 @@ This module provides basic io under GLTF format
 """
 
 import logging
-import json, array, struct, base64
+import json, array, re, struct, zlib
 from typing import Union
-from collections import namedtuple
-from easydict import EasyDict as edict
+import numpy as np
 
-from xviz.io.base import XVIZBaseWriter
+from xviz.io.base import XVIZBaseWriter, XVIZBaseReader
+from xviz.builder.image import guess_mime_type
 from xviz.message import XVIZMessage, XVIZEnvelope, StateUpdate
+from xviz.columnar import XVIZColumnarFrame, PrimitiveColumns, VERTEX_FIELDS
 
 # Constants
 
-bufferView_t = namedtuple("bufferViewItem", ("buffer", "byteOffset", "byteLength"))
-accessor_t = namedtuple("accessorItem", ("bufferView", "type", "componentType", "count"))
-image_t = namedtuple("imageItem", ("bufferView", "mimetype", "width", "height"))
-
 component_type_d = {
   'b' : 5120,
   'B' : 5121,
@@ -25,12 +22,56 @@ component_type_d = {
   'I' : 5125,
   'f' : 5126
 }
+component_dtype_d = {
+  5120 : np.int8,
+  5121 : np.uint8,
+  5122 : np.int16,
+  5123 : np.uint16,
+  5125 : np.uint32,
+  5126 : np.float32
+}
 types_d = ['SCALAR', 'VEC2', 'VEC3', 'VEC4']
 XVIZ_GLTF_EXTENSION = 'AVS_xviz'
+XVIZ_COMPRESSION_EXTENSION = 'AVS_xviz_compression'
+QUANTIZATION_EXTENSION = 'KHR_mesh_quantization'
+COMPRESSION_THRESHOLD = 1024 # Smaller bufferViews are not compressed
+
+_JSON_SCALAR_TYPES = frozenset([float, int, bool, type(None)])
+_JSON_POINTER_PATTERN = re.compile(r'#/(accessors|images)/\d+$')
+
+def _copy_fields(message, exclude=()):
+    '''
+    Copy a protobuf message except the excluded fields, which are not read at all
+    '''
+    result = type(message)()
+    for field, value in message.ListFields():
+        if field.name in exclude:
+            continue
+        if field.label == field.LABEL_REPEATED or field.message_type:
+            getattr(result, field.name).MergeFrom(value)
+        else:
+            setattr(result, field.name, value)
+    return result
 
 def pad_to_4bytes(length):
     return (length + 3) & ~3
 
+def quantize_positions(vertices: np.ndarray):
+    '''
+    Quantize positions of shape Nx3 into normalized int16 following the conventions of
+    KHR_mesh_quantization. Positions are restored by `offset + scale * quantized / 32767`,
+    which is the node transform with translation `offset` and scale `scale`.
+
+    :return: (quantized positions, offset, scale)
+    '''
+    vertices = np.asarray(vertices, dtype=np.float64)
+    vmin, vmax = vertices.min(axis=0), vertices.max(axis=0)
+    offset = (vmin + vmax) / 2
+    scale = (vmax - vmin) / 2
+    scale[scale == 0] = 1
+    quantized = np.round((vertices - offset) / scale * 32767).astype(np.int16)
+    return quantized, offset, scale
+
 # Wrappers
 class ImageWrapper:
     def __init__(self, image: bytes, width: int = None, height: int = None, mime_type: str = None):
@@ -39,6 +80,21 @@ class ImageWrapper:
         self.width = width
         self.height = height
 
+class AccessorWrapper:
+    '''
+    Typed array of shape N or NxC to be packed as an accessor
+    '''
+    def __init__(self, data: np.ndarray, normalized: bool = False, extras: dict = None, bounds: bool = False,
+                 quantization: tuple = None):
+        '''
+        :param quantization: (offset, scale) of positions quantized by `quantize_positions`
+        '''
+        self.data = data
+        self.normalized = normalized
+        self.extras = extras
+        self.bounds = bounds
+        self.quantization = quantization
+
 class GLTFBuilder:
     """
     # Reference
@@ -50,10 +106,17 @@ class GLTFBuilder:
     MAGIC_JSON = 0x4e4f534a # JSON in ASCII
     MAGIC_BIN = 0x004e4942 # BIN\0 in ASCII
 
-    def __init__(self):
+    def __init__(self, compression=None):
+        '''
+        :param compression: method to compress large bufferViews, only 'zlib' is supported now
+        '''
+        if compression not in (None, 'zlib'):
+            raise ValueError("Unsupported compression method: %s" % compression)
+
         self._version = 2
+        self._compression = compression
         self._byte_length = 0 # keep track of body size
-        self._json = edict(
+        self._json = dict(
             asset={
                 "version": str(self._version)
             },
@@ -68,40 +131,82 @@ class GLTFBuilder:
 
     ################ Basic glTF adders ##############
 
-    def add_accessor(self, buffer_view_index: int, size: int, component_type: int, count: int):
+    def add_accessor(self, buffer_view_index: int, size: int, component_type: int, count: int,
+                     normalized: bool = False, extras: dict = None, min: list = None, max: list = None):
         '''
         Adds an accessor to a bufferView
 
         :param buffer_view_index: The index of the buffer view to access
-        :param size: XXX
-        :param component_type: XXX
-        :param count: XXX
+        :param size: Number of components in each element (1 for SCALAR, 3 for VEC3, etc.)
+        :param component_type: glTF component type code
+        :param count: Number of elements
+        :param normalized: Whether integer values are normalized into [0, 1] or [-1, 1]
+        :param extras: Application specific data attached to the accessor
+        :param min: Minimum value of each component
+        :param max: Maximum value of each component
         :return: accessor_index: Index of added buffer in "accessors" list
         '''
-        self._json.accessors.append(accessor_t(
-            bufferView=buffer_view_index,
-            type=types_d[size - 1],
-            componentType=component_type,
-            count=count
-        )._asdict())
-        return len(self._json.accessors) - 1
-
-    def add_buffer_view(self, buffer: bytes):
+        accessor = {
+            'bufferView': buffer_view_index,
+            'type': types_d[size - 1],
+            'componentType': component_type,
+            'count': count
+        }
+        if normalized:
+            accessor['normalized'] = True
+        if min is not None and max is not None:
+            accessor['min'] = min
+            accessor['max'] = max
+        if extras:
+            accessor['extras'] = extras
+
+        accessors = self._json['accessors']
+        accessors.append(accessor)
+        return len(accessors) - 1
+
+    def add_buffer_view(self, buffer: bytes, compress=None, byte_stride: int = None):
         '''
         Add one untyped source buffer, create a matching glTF `bufferView`,
         and return its index
 
         :param buffer: bytes
+        :param compress: None to compress large buffers if compression is enabled for the builder,
+            False to disable compression, or name of the method to always compress the buffer
+        :param byte_stride: stride between vertex attribute elements in bytes
         :return: buffer_view_index: The index of inserted bufferView
         '''
         if not isinstance(buffer, bytes):
             raise ValueError("add_buffer_view should be directly used with bytes")
 
-        self._json.bufferViews.append(bufferView_t(
-            buffer=0,
-            byteOffset=self._byte_length,
-            byteLength=len(buffer)
-        )._asdict())
+        method = None
+        if compress is None:
+            if self._compression and len(buffer) >= COMPRESSION_THRESHOLD:
+                method = self._compression
+        elif compress:
+            if compress != 'zlib':
+                raise ValueError("Unsupported compression method: %s" % compress)
+            method = compress
+
+        extensions = None
+        if method:
+            compressed = zlib.compress(buffer)
+            if len(compressed) < len(buffer):
+                extensions = {XVIZ_COMPRESSION_EXTENSION: dict(method=method, byteLength=len(buffer))}
+                buffer = compressed
+                # Only required if a mesh uses the bufferView, see `_add_mesh`
+                self.register_used_extension(XVIZ_COMPRESSION_EXTENSION)
+
+        buffer_view = {
+            'buffer': 0,
+            'byteOffset': self._byte_length,
+            'byteLength': len(buffer)
+        }
+        if byte_stride:
+            buffer_view['byteStride'] = byte_stride
+        if extensions:
+            buffer_view['extensions'] = extensions
+        buffer_views = self._json['bufferViews']
+        buffer_views.append(buffer_view)
 
         # Pad array
         pad_len = pad_to_4bytes(len(buffer))
@@ -109,23 +214,55 @@ class GLTFBuilder:
         self._byte_length += pad_len
         self._source_buffers.append(buffer)
 
-        return len(self._json.bufferViews) - 1
+        return len(buffer_views) - 1
 
-    def add_buffer(self, buffer: array.array):
+    def add_buffer(self, buffer: Union[array.array, np.ndarray], size: int = None,
+                   normalized: bool = False, extras: dict = None, bounds: bool = False, compress=None,
+                   align: bool = False):
         '''
         Add a binary buffer. Builds glTF "JSON metadata" and saves buffer reference.
         Buffer will be copied into BIN chunk during "pack".
         Currently encodes buffers as glTF accessors, but this could be optimized.
 
-        :param buffer: flattened array
-        :param size: XXX
-        :param component_type: XXX
-        :param count: XXX
+        :param buffer: flattened array.array, or numpy array of shape N or NxC
+        :param size: Number of components in each element, inferred from numpy array shape by default
+        :param normalized: Whether integer values are normalized
+        :param extras: Application specific data attached to the accessor
+        :param bounds: Whether to store min and max of each component in the accessor
+        :param compress: Compression option passed to `add_buffer_view`
+        :param align: Pad elements to multiples of 4 bytes as required for vertex attributes
         :return: accessor_index: Index of added buffer in "accessors" list
         '''
-        buffer_view_index = self.add_buffer_view(buffer.tobytes())
-        return self.add_accessor(buffer_view_index, size=buffer.itemsize,
-            component_type=component_type_d[buffer.typecode], count=len(buffer))
+        if isinstance(buffer, np.ndarray):
+            size = size or (buffer.shape[1] if buffer.ndim > 1 else 1)
+            typecode = buffer.dtype.char
+            buffer = np.ascontiguousarray(buffer)
+            count = buffer.size // size
+        else:
+            size = size or 1
+            typecode = buffer.typecode
+            count = len(buffer) // size
+
+        if typecode not in component_type_d:
+            raise ValueError("Unsupported component type for glTF buffer: %s" % typecode)
+
+        elements = np.asarray(buffer).reshape(count, size)
+        vmin = vmax = None
+        if bounds and count:
+            # bounds are the stored values regardless of `normalized`, as required by glTF
+            vmin, vmax = elements.min(axis=0).tolist(), elements.max(axis=0).tolist()
+
+        byte_stride = None
+        if align and (size * elements.itemsize) % 4:
+            byte_stride = pad_to_4bytes(size * elements.itemsize)
+            padded = np.zeros((count, byte_stride // elements.itemsize), dtype=elements.dtype)
+            padded[:, :size] = elements
+            buffer = padded
+
+        buffer_view_index = self.add_buffer_view(buffer.tobytes(), compress=compress, byte_stride=byte_stride)
+        return self.add_accessor(buffer_view_index, size=size,
+            component_type=component_type_d[typecode], count=count,
+            normalized=normalized, extras=extras, min=vmin, max=vmax)
 
     def add_application_data(self, key: str, data):
         '''
@@ -139,14 +276,10 @@ class GLTFBuilder:
         self._json[key] = data
 
     def add_extra_data(self, key, data):
-        if 'extras' not in self._json.keys():
-            self._json.extras = edict()
-        self._json.extras[key] = data
+        self._json.setdefault('extras', {})[key] = data
 
     def add_extension(self, ext, data):
-        if 'extensions' not in self._json.keys():
-            self._json.extensions = edict()
-        self._json.extensions[ext] = data
+        self._json.setdefault('extensions', {})[ext] = data
         self.register_used_extension(ext)
 
     def add_required_extension(self, ext, data, **options):
@@ -154,29 +287,58 @@ class GLTFBuilder:
         self.register_required_extension(ext)
 
     def register_used_extension(self, ext):
-        if 'extensionsUsed' not in self._json:
-            self._json.extensionsUsed = []
-        if ext not in self._json.extensionsUsed:
-            self._json.extensionsUsed.append(ext)
+        used = self._json.setdefault('extensionsUsed', [])
+        if ext not in used:
+            used.append(ext)
 
     def register_required_extension(self, ext):
-        if 'extensionsRequired' not in self._json:
-            self._json.extensionsRequired = []
-        if ext not in self._json.extensionsRequired:
-            self._json.extensionsRequired.append(ext)
+        required = self._json.setdefault('extensionsRequired', [])
+        if ext not in required:
+            required.append(ext)
+
+    def add_node(self, mesh: int, translation=None, scale=None) -> int:
+        '''
+        Add a node of a mesh into the default scene
+
+        :return: node_index: Index of added node in "nodes" list
+        '''
+        node = dict(mesh=mesh)
+        if translation is not None:
+            node['translation'] = [float(v) for v in translation]
+        if scale is not None:
+            node['scale'] = [float(v) for v in scale]
+
+        nodes = self._json.setdefault('nodes', [])
+        nodes.append(node)
+        self._json.setdefault('scene', 0)
+        self._json.setdefault('scenes', [dict(nodes=[])])[0]['nodes'].append(len(nodes) - 1)
+        return len(nodes) - 1
+
+    def add_quantized_points(self, accessor_index: int, offset, scale) -> int:
+        '''
+        Add a point cloud node using quantized positions in an accessor of normalized int16, whose
+        dequantization is stored in the node transform as required by KHR_mesh_quantization
+
+        :return: node_index: Index of added node in "nodes" list
+        '''
+        self.register_used_extension(QUANTIZATION_EXTENSION)
+        self.register_required_extension(QUANTIZATION_EXTENSION)
+        mesh = self._add_mesh(dict(attributes=dict(POSITION=accessor_index), mode=0)) # POINTS
+        return self.add_node(mesh, translation=offset, scale=scale)
 
     def add_image(self, obj):
         if not isinstance(obj, ImageWrapper):
             raise ValueError("Image should be wrapped with ImageWrapper")
 
-        buffer_view_index = self.add_buffer_view(obj)
-        self._json.images.append(image_t(
-            bufferView=buffer_view_index,
-            mimeType=obj.mime_type,
-            width=obj.width,
-            height=obj.height
-        )._asdict())
-        return len(self._json.images) - 1
+        images = self._json.setdefault('images', [])
+        buffer_view_index = self.add_buffer_view(obj.data, compress=False)
+        images.append({
+            'bufferView': buffer_view_index,
+            'mimeType': obj.mime_type,
+            'width': obj.width,
+            'height': obj.height
+        })
+        return len(images) - 1
 
     ################ Output ############
 
@@ -189,7 +351,7 @@ class GLTFBuilder:
         '''
 
         # Prepare data
-        self._json.buffers = [{"byteLength": self._byte_length}]
+        self._json['buffers'] = [{"byteLength": self._byte_length}]
         binary = b''.join(self._source_buffers)
         jsonstr = json.dumps(self._json, separators=(',', ':')).encode('ascii')
         jsonlen = pad_to_4bytes(len(jsonstr))
@@ -217,56 +379,422 @@ class GLTFBuilder:
     ################ glTF Applications ##############
 
     def pack_binary_json(self, data):
-        # Check if string has same syntax as our "JSON pointers", if so "escape it".
-        if isinstance(data, str) and data.find("#/") == -1:
-            return '#' + data
+        '''
+        Replace binary leaves (images and arrays) with JSON pointers and escape strings. Containers
+        are modified in place and traversed iteratively in depth-first order.
 
-        # Recursively deal with containers
-        if isinstance(data, list):
-            return [self.pack_binary_json(obj) for obj in data]
-        if isinstance(data, dict):
-            return {k:self.pack_binary_json(v) for k, v in data.items()}
+        :return: packed data, which is the input itself if it's a container
+        '''
+        if not isinstance(data, (dict, list)):
+            return self._pack_binary_leaf(data)
+
+        containers = [data]
+        iterators = [iter(data.items()) if isinstance(data, dict) else enumerate(data)]
+        while iterators:
+            container = containers[-1]
+            for key, value in iterators[-1]:
+                if type(value) in _JSON_SCALAR_TYPES:
+                    continue
+                if isinstance(value, str):
+                    # Check if string has same syntax as our "JSON pointers", if so "escape it".
+                    if "#/" not in value:
+                        container[key] = '#' + value
+                elif isinstance(value, dict):
+                    containers.append(value)
+                    iterators.append(iter(value.items()))
+                    break
+                elif isinstance(value, list):
+                    containers.append(value)
+                    iterators.append(enumerate(value))
+                    break
+                elif isinstance(value, (ImageWrapper, AccessorWrapper, array.array, np.ndarray)):
+                    container[key] = self._pack_binary_leaf(value)
+            else:
+                containers.pop()
+                iterators.pop()
+
+        return data
+
+    def _pack_binary_leaf(self, data):
+        if isinstance(data, str) and "#/" not in data:
+            return '#' + data
 
         # Pack specific data to binary
         if isinstance(data, ImageWrapper):
-            image_index = self.add_image(data.data)
+            image_index = self.add_image(data)
             return "#/images/{}".format(image_index)
-        if isinstance(data, array.array):
+        if isinstance(data, AccessorWrapper):
+            buffer_index = self.add_buffer(data.data, normalized=data.normalized,
+                extras=data.extras, bounds=data.bounds, align=data.quantization is not None)
+            if data.quantization is not None:
+                self.add_quantized_points(buffer_index, *data.quantization)
+            return "#/accessors/{}".format(buffer_index)
+        if isinstance(data, (array.array, np.ndarray)):
             buffer_index = self.add_buffer(data)
             return "#/accessors/{}".format(buffer_index)
 
         # Else return original
         return data
-    
-    def add_point_cloud(self, obj):
-        raise NotImplementedError()
 
-    def add_mesh(self, indices, mode):
-        raise NotImplementedError()
+    def _add_attributes(self, attributes: dict, compress=None) -> dict:
+        '''
+        Add accessors for mesh attributes (POSITION, NORMAL, COLOR_0, etc.), return dictionary
+        of accessor indices. Values are numpy arrays of shape NxC or AccessorWrapper
+        '''
+        indices = {}
+        for name, value in attributes.items():
+            if isinstance(value, AccessorWrapper):
+                data, normalized, extras, bounds = value.data, value.normalized, value.extras, value.bounds
+            else:
+                data, extras, bounds = np.asarray(value), None, False
+                normalized = name.startswith('COLOR_') and data.dtype.kind in 'iu'
+            if data.dtype == np.float64:
+                data = data.astype(np.float32)
+            if name.startswith('COLOR_') and data.ndim == 2 and data.shape[1] == 3 and data.dtype.kind == 'u':
+                # RGBA colors keep the elements aligned to 4 bytes
+                alpha = np.full((len(data), 1), np.iinfo(data.dtype).max, dtype=data.dtype)
+                data = np.concatenate([data, alpha], axis=1)
+
+            indices[name] = self.add_buffer(data, normalized=normalized, extras=extras,
+                bounds=bounds or name == 'POSITION', compress=compress, align=True)
+        return indices
+
+    def _add_mesh(self, primitive: dict) -> int:
+        # Loaders must decompress the buffers used by meshes
+        accessors = list(primitive['attributes'].values())
+        if 'indices' in primitive:
+            accessors.append(primitive['indices'])
+        buffer_views = [self._json['bufferViews'][self._json['accessors'][i]['bufferView']] for i in accessors]
+        if any(XVIZ_COMPRESSION_EXTENSION in view.get('extensions', {}) for view in buffer_views):
+            self.register_required_extension(XVIZ_COMPRESSION_EXTENSION)
+
+        meshes = self._json['meshes']
+        meshes.append(dict(primitives=[primitive]))
+        return len(meshes) - 1
+
+    def add_point_cloud(self, attributes: dict, compress=None):
+        '''
+        Add a point cloud as a mesh with POINTS mode
+
+        :param attributes: dictionary of attribute arrays, must contain 'POSITION'
+        :param compress: Compression option passed to `add_buffer_view`
+        :return: mesh_index: Index of added mesh in "meshes" list
+        '''
+        if 'POSITION' not in attributes:
+            raise ValueError("Point cloud requires POSITION attribute")
+
+        return self._add_mesh(dict(
+            attributes=self._add_attributes(attributes, compress),
+            mode=0 # POINTS
+        ))
+
+    def add_mesh(self, attributes: dict, indices: np.ndarray = None, mode: int = 4, compress=None):
+        '''
+        Add a mesh, triangles are used by default
+
+        :param attributes: dictionary of attribute arrays, must contain 'POSITION'
+        :param indices: optional integer array of vertex indices
+        :param mode: glTF primitive mode
+        :param compress: Compression option passed to `add_buffer_view`
+        :return: mesh_index: Index of added mesh in "meshes" list
+        '''
+        if 'POSITION' not in attributes:
+            raise ValueError("Mesh requires POSITION attribute")
+
+        primitive = dict(attributes=self._add_attributes(attributes, compress), mode=mode)
+        if indices is not None:
+            indices = np.asarray(indices).ravel()
+            dtype = np.uint16 if indices.max(initial=0) < 0xffff else np.uint32
+            primitive['indices'] = self.add_buffer(indices.astype(dtype), compress=compress)
+        return self._add_mesh(primitive)
+
+    def add_compressed_mesh(self, attributes: dict, indices: np.ndarray = None, mode: int = 4):
+        '''
+        Add a mesh with all buffers compressed, see `add_mesh`
+        '''
+        return self.add_mesh(attributes, indices, mode, compress=self._compression or 'zlib')
+
+    def add_compressed_point_cloud(self, attributes: dict):
+        '''
+        Add a point cloud with all buffers compressed, see `add_point_cloud`
+        '''
+        return self.add_point_cloud(attributes, compress=self._compression or 'zlib')
+
+class GLBDecoder:
+    '''
+    Decode GLB data generated by GLTFBuilder. The JSON chunk is parsed on creation, while JSON pointers
+    to accessors and images are only resolved on request, as numpy views over the BIN chunk.
+    '''
+    def __init__(self, data):
+        '''
+        :param data: GLB data as bytes or other buffer object (e.g. memoryview or mmap)
+        '''
+        view = memoryview(data)
+        magic, version, length = struct.unpack_from("<III", view, 0)
+        if magic != GLTFBuilder.MAGIC_glTF:
+            raise ValueError("The data is not in GLB format")
+        if version != 2:
+            raise ValueError("Unsupported GLB version: %d" % version)
+
+        jsonlen, chunk_type = struct.unpack_from("<II", view, 12)
+        if chunk_type != GLTFBuilder.MAGIC_JSON:
+            raise ValueError("The first chunk of GLB must be JSON")
+        self._json = json.loads(bytes(view[20:20 + jsonlen]).rstrip(b'\x00 '))
+
+        self._binary = None
+        self._quantizations = None
+        offset = 20 + jsonlen
+        if offset + 8 <= length:
+            binlen, chunk_type = struct.unpack_from("<II", view, offset)
+            if chunk_type == GLTFBuilder.MAGIC_BIN:
+                self._binary = view[offset + 8:offset + 8 + binlen]
+
+    @property
+    def json(self) -> dict:
+        return self._json
+
+    @property
+    def xviz(self) -> dict:
+        '''
+        Packed XVIZ data, where strings are escaped and binaries are JSON pointers. Use `unpack`
+        to get the original data of a part.
+        '''
+        if 'extensions' in self._json and XVIZ_GLTF_EXTENSION in self._json['extensions']:
+            return self._json['extensions'][XVIZ_GLTF_EXTENSION]
+        return self._json.get('xviz')
+
+    def get_buffer_view(self, index: int):
+        buffer_view = self._json['bufferViews'][index]
+        offset = buffer_view.get('byteOffset', 0)
+        data = self._binary[offset:offset + buffer_view['byteLength']]
+
+        extension = buffer_view.get('extensions', {}).get(XVIZ_COMPRESSION_EXTENSION)
+        if extension:
+            if extension['method'] != 'zlib':
+                raise ValueError("Unsupported compression method: %s" % extension['method'])
+            data = zlib.decompress(data)
+        return data
+
+    def get_accessor(self, index: int, dequantize: bool = False) -> np.ndarray:
+        '''
+        Get accessor data as array of shape N (for scalars) or NxC
+
+        :param dequantize: restore quantized positions into float32 values
+        '''
+        accessor = self._json['accessors'][index]
+        size = types_d.index(accessor['type']) + 1
+        count = accessor['count']
+        dtype = np.dtype(component_dtype_d[accessor['componentType']])
+        stride = self._json['bufferViews'][accessor['bufferView']].get('byteStride', size * dtype.itemsize)
+        data = np.frombuffer(self.get_buffer_view(accessor['bufferView']),
+            dtype=dtype, count=count * stride // dtype.itemsize)
+        if stride != size * dtype.itemsize:
+            data = data.reshape(count, -1)[:, :size]
+        elif size > 1:
+            data = data.reshape(count, size)
+
+        quantization = self._get_quantization(index) if dequantize and accessor.get('normalized') else None
+        if quantization:
+            offset, scale = quantization
+            data = (np.array(offset) + np.array(scale) * np.maximum(data / 32767, -1)).astype(np.float32)
+        return data
+
+    def _get_quantization(self, index: int):
+        '''
+        Get (offset, scale) of quantized positions from the transform of nodes using the accessor
+        '''
+        if self._quantizations is None:
+            self._quantizations = {}
+            meshes = self._json.get('meshes', [])
+            for node in self._json.get('nodes', []):
+                if 'mesh' not in node or not ('translation' in node or 'scale' in node):
+                    continue
+                for primitive in meshes[node['mesh']]['primitives']:
+                    if 'POSITION' in primitive['attributes']:
+                        self._quantizations[primitive['attributes']['POSITION']] = \
+                            (node.get('translation', [0, 0, 0]), node.get('scale', [1, 1, 1]))
+
+        if index in self._quantizations:
+            return self._quantizations[index]
+        # Written by older versions
+        quantization = self._json['accessors'][index].get('extras', {}).get('quantization')
+        return (quantization['offset'], quantization['scale']) if quantization else None
+
+    def get_image(self, index: int) -> ImageWrapper:
+        image = self._json['images'][index]
+        return ImageWrapper(
+            image=self.get_buffer_view(image['bufferView']),
+            width=image.get('width'),
+            height=image.get('height'),
+            mime_type=image.get('mimeType')
+        )
 
-    def add_compressed_mesh(self, atrributes, indices, mode):
-        raise NotImplementedError()
+    def resolve(self, pointer: str, dequantize: bool = False):
+        '''
+        Resolve JSON pointer like `#/accessors/0` or `#/images/0`
+        '''
+        if not _JSON_POINTER_PATTERN.match(pointer):
+            raise ValueError("Unrecognized JSON pointer: %s" % pointer)
+        _, category, index = pointer.split('/')
+        if category == 'accessors':
+            return self.get_accessor(int(index), dequantize)
+        elif category == 'images':
+            return self.get_image(int(index))
+        raise ValueError("Unrecognized JSON pointer: %s" % pointer)
+
+    def unpack(self, data, dequantize: bool = False):
+        '''
+        Return a copy of packed data with strings unescaped and JSON pointers resolved
+        '''
+        if isinstance(data, str):
+            # Escaped strings like stream ids "#/lidar" are not pointers
+            if _JSON_POINTER_PATTERN.match(data):
+                return self.resolve(data, dequantize)
+            if data.startswith('#'):
+                return data[1:]
+            return data
+        if isinstance(data, list):
+            return [self.unpack(item, dequantize) for item in data]
+        if isinstance(data, dict):
+            return {k: self.unpack(v, dequantize) for k, v in data.items()}
+        return data
 
-    def add_compressed_point_cloud(self, attributes):
-        raise NotImplementedError()
+    def to_message(self) -> XVIZMessage:
+        return self._object_to_message(self.unpack(self.xviz, dequantize=True))
+
+    def to_columnar(self) -> list:
+        '''
+        Decode the state update into list of XVIZColumnarFrame. Point positions and colors
+        are views over the GLB data unless they are compressed or quantized.
+        '''
+        obj = self.unpack(self.xviz, dequantize=True)
+        dataobj = obj['data'] if 'type' in obj and 'data' in obj else obj
+
+        frame_columns = []
+        for frame in dataobj.get('updates', []):
+            primitives = {}
+            for stream_id, pdata in frame.get('primitives', {}).items():
+                for category, field in VERTEX_FIELDS.items():
+                    items = pdata.get(category)
+                    if not items:
+                        continue
+                    vertices = [item.pop(field, []) for item in items]
+                    colors = [item.pop('colors', None) if category == 'points' else None for item in items]
+                    ids = [item.get('base', {}).pop('object_id', '') for item in items]
+                    primitives.setdefault(stream_id, {})[category] = \
+                        PrimitiveColumns.from_arrays(vertices, colors, ids)
+            frame_columns.append(primitives)
+
+        update = self._object_to_message(obj).data
+        return [XVIZColumnarFrame(frame.timestamp, primitives, frame.SerializeToString(), update.update_type)
+                for frame, primitives in zip(update.updates, frame_columns)]
+
+    def _object_to_message(self, obj: dict) -> XVIZMessage:
+        dataobj = obj['data'] if 'type' in obj and 'data' in obj else obj
+
+        # Take out binaries so that they can be directly assigned to the message
+        binaries = []
+        for fidx, frame in enumerate(dataobj.get('updates', [])):
+            for stream_id, pdata in frame.get('primitives', {}).items():
+                for category, items in pdata.items():
+                    for idx, item in enumerate(items):
+                        for field in ('points', 'colors', 'data'):
+                            if isinstance(item.get(field), (np.ndarray, ImageWrapper)):
+                                binaries.append((fidx, stream_id, category, idx, field, item.pop(field)))
+
+        message = XVIZMessage.from_object(obj)
+        for fidx, stream_id, category, idx, field, value in binaries:
+            primitive = getattr(message.data.updates[fidx].primitives[stream_id], category)[idx]
+            if field == 'points':
+                primitive.points.extend(value.ravel().tolist())
+            elif isinstance(value, ImageWrapper):
+                setattr(primitive, field, bytes(value.data))
+            else:
+                setattr(primitive, field, value.tobytes())
+        return message
 
 class XVIZGLBWriter(XVIZBaseWriter):
-    def __init__(self, sink, wrap_envelope=True, use_xviz_extension=True):
+    def __init__(self, sink, wrap_envelope=True, use_xviz_extension=True, decimator=None,
+                 quantize_points=False, compression=None):
+        '''
+        :param quantize_points: store point positions as normalized int16, dequantized by the transform of a
+            point cloud node added for each quantized accessor
+        :param compression: compress large bufferViews with given method ('zlib')
+        '''
         # TODO: also support precision limit in GLTF Json
-        super().__init__(sink)
+        super().__init__(sink, decimator)
 
         self._use_xviz_extension = use_xviz_extension
         self._wrap_envelop = wrap_envelope
+        self._quantize_points = quantize_points
+        self._compression = compression
         self._counter = 2
 
     def write_message(self, message: XVIZMessage, index: int = None):
+        self._check_valid()
+        message = self._prepare_message(message)
+        stripped, wrappers = self._detach_binaries(message)
+        self._write_object(message, self._to_object(stripped), wrappers, index)
 
+    def write_frame(self, frame: XVIZColumnarFrame, index: int = None):
+        '''
+        Write a XVIZColumnarFrame. Point positions and colors are packed directly from the columns
+        without being copied into protobuf fields.
+        '''
         self._check_valid()
+        message = XVIZMessage(update=StateUpdate(update_type=frame.update_type, updates=[frame.get_remainder()]))
+        obj = self._to_object(message)
+        primitives = (obj['data'] if self._wrap_envelop else obj)['updates'][0].get('primitives', {})
+
+        wrappers = []
+        for stream_id, categories in frame.primitives.items():
+            for category, columns in categories.items():
+                items = primitives[stream_id][category]
+                for idx, item in enumerate(items):
+                    object_id = columns.get_id(idx)
+                    if object_id:
+                        item.setdefault('base', {})['object_id'] = object_id
+
+                    vertices, colors = columns.get_vertices(idx), columns.get_colors(idx)
+                    if category != 'points':
+                        item['vertices'] = vertices.ravel().tolist()
+                        continue
+
+                    if colors is not None and len(colors) % max(len(vertices), 1) != 0:
+                        colors = None
+                    if colors is not None and len(colors):
+                        colors = colors.reshape(len(vertices), -1)
+                    if self._decimator:
+                        indices = self._decimator.select(vertices)
+                        if indices is not None:
+                            vertices = vertices[indices]
+                            colors = colors[indices] if colors is not None and len(colors) else colors
+
+                    if len(vertices):
+                        wrappers.append((0, stream_id, 'points', idx, 'points', self._wrap_points(vertices)))
+                    if colors is not None and len(colors):
+                        wrappers.append((0, stream_id, 'points', idx, 'colors',
+                            AccessorWrapper(colors, normalized=True)))
+
+        self._write_object(message, obj, wrappers, index)
+
+    def _to_object(self, message: XVIZMessage) -> dict:
         if self._wrap_envelop:
-            obj = XVIZEnvelope(message).to_object()
-        else:
-            obj = message.to_object()
-        builder = GLTFBuilder()
+            return XVIZEnvelope(message).to_object()
+        return message.to_object()
+
+    def _wrap_points(self, vertices: np.ndarray) -> AccessorWrapper:
+        if self._quantize_points:
+            quantized, offset, scale = quantize_positions(vertices)
+            return AccessorWrapper(quantized, normalized=True, bounds=True, quantization=(offset, scale))
+        return AccessorWrapper(vertices, bounds=True)
+
+    def _write_object(self, message: XVIZMessage, obj: dict, wrappers: list, index: int = None):
+        '''
+        :param wrappers: list of (frame index, stream id, category, index, field, wrapper) to be
+            placed into the object
+        '''
+        builder = GLTFBuilder(compression=self._compression)
 
         fname = self._get_sequential_name(message, index) + '.glb'
 
@@ -276,23 +804,9 @@ class XVIZGLBWriter(XVIZBaseWriter):
                 dataobj = obj['data']['updates']
             else:
                 dataobj = obj['updates']
-            if 'primitives' in dataobj:
-                for pdata in dataobj['primitives'].values():
-                    # process point cloud
-                    if 'points' in pdata:
-                        for pldata in pdata['points']:
-                            if 'points' in pldata:
-                                pldata['points'] = array.array('f', pldata['points'])
-
-                    # process images
-                    if 'images' in pdata:
-                        for imdata in pdata['points']:
-                            imdata['data'] = ImageWrapper(
-                                image=base64.b64decode(imdata['data']),
-                                width=imdata['width_px'],
-                                height=imdata['height_px'],
-                                mime_type='image/png', # FIXME: use Pillow to detect type
-                            )
+
+            for fidx, stream_id, category, idx, field, wrapper in wrappers:
+                dataobj[fidx]['primitives'][stream_id][category][idx][field] = wrapper
 
         # Encode GLB into file
         packed_data = builder.pack_binary_json(obj)
@@ -301,5 +815,70 @@ class XVIZGLBWriter(XVIZBaseWriter):
         else:
             builder.add_application_data('xviz', packed_data)
 
-        with self._source.open(fname) as fout:
+        with self._source.open(fname, 'w') as fout:
             builder.flush(fout)
+
+    def _detach_binaries(self, message: XVIZMessage):
+        '''
+        Split image data, point positions and colors from the message so that they are not converted
+        by `to_object`. The input message is not modified.
+
+        :return: (message without the binaries, list of (frame index, stream id, category, index, field, wrapper))
+        '''
+        wrappers = []
+        if not isinstance(message.data, StateUpdate):
+            return message, wrappers
+
+        update = _copy_fields(message.data, exclude=('updates',))
+        for fidx, frame in enumerate(message.data.updates):
+            stripped_frame = update.updates.add()
+            stripped_frame.MergeFrom(_copy_fields(frame, exclude=('primitives',)))
+            for stream_id, pdata in frame.primitives.items():
+                stripped_pdata = stripped_frame.primitives[stream_id]
+                stripped_pdata.MergeFrom(_copy_fields(pdata, exclude=('images', 'points')))
+
+                for idx, image in enumerate(pdata.images):
+                    stripped_pdata.images.append(_copy_fields(image, exclude=('data',)))
+                    wrappers.append((fidx, stream_id, 'images', idx, 'data', ImageWrapper(
+                        image=image.data,
+                        width=image.width_px or None,
+                        height=image.height_px or None,
+                        mime_type=guess_mime_type(image.data) or 'application/octet-stream'
+                    )))
+
+                for idx, point in enumerate(pdata.points):
+                    if not point.points:
+                        stripped_pdata.points.append(point)
+                        continue
+
+                    vertices = np.fromiter(point.points, dtype=np.float32, count=len(point.points)).reshape(-1, 3)
+                    wrappers.append((fidx, stream_id, 'points', idx, 'points', self._wrap_points(vertices)))
+                    exclude = ('points',)
+                    if point.colors and len(point.colors) % len(vertices) == 0:
+                        colors = np.frombuffer(point.colors, dtype=np.uint8).reshape(len(vertices), -1)
+                        wrappers.append((fidx, stream_id, 'points', idx, 'colors', AccessorWrapper(colors, normalized=True)))
+                        exclude = ('points', 'colors')
+                    stripped_pdata.points.append(_copy_fields(point, exclude=exclude))
+
+        return XVIZMessage(update=update), wrappers
+
+class XVIZGLBReader(XVIZBaseReader):
+    SUFFIX = '.glb'
+
+    def read_glb(self, index: int) -> GLBDecoder:
+        '''
+        Get decoder of a message, the file is memory mapped if the source supports it
+        '''
+        name = self._get_file_name(index)
+        if hasattr(self._source, 'mmap'):
+            return GLBDecoder(self._source.mmap(name))
+        return GLBDecoder(self._source.read(name))
+
+    def read_message(self, index: int) -> XVIZMessage:
+        return self.read_glb(index).to_message()
+
+    def read_frames(self, index: int) -> list:
+        '''
+        Read a state update as list of XVIZColumnarFrame
+        '''
+        return self.read_glb(index).to_columnar()
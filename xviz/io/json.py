@@ -1,30 +1,82 @@
 import json
 from .base import XVIZBaseWriter
+from .cache import split_stream_fields
 
-from xviz.message import XVIZEnvelope, XVIZMessage, Metadata
+from xviz.message import XVIZEnvelope, XVIZFrame, XVIZMessage, Metadata, StateUpdate,\
+    _unravel_primitive_state
+from google.protobuf.json_format import MessageToDict
 
 class XVIZJsonWriter(XVIZBaseWriter):
-    def __init__(self, sink, wrap_envelope=True, float_precision=10, as_array_buffer=False):
-        super().__init__(sink)
+    def __init__(self, sink, wrap_envelope=True, float_precision=10, as_array_buffer=False, cache=None, decimator=None):
+        '''
+        :param cache: optional XVIZFragmentCache, encoded streams will be reused if their content is not changed
+        '''
+        super().__init__(sink, decimator)
         self._wrap_envelop = wrap_envelope
         self._json_precision = float_precision
+        self._cache = cache
 
     def write_message(self, message: XVIZMessage, index: int = None):
         self._check_valid()
-        if self._wrap_envelop:
+        message = self._prepare_message(message)
+        fragments = {}
+        if self._cache is not None and isinstance(message.data, StateUpdate):
+            obj = self._update_object(message.data, fragments)
+            if self._wrap_envelop:
+                obj = dict(type=message.get_schema().replace("session", "xviz"), data=obj)
+        elif self._wrap_envelop:
             obj = XVIZEnvelope(message).to_object()
         else:
             obj = message.to_object()
 
         fname = self._get_sequential_name(message, index) + '.json'
+        self._source.write(self._encode(obj, fragments).encode('ascii'), fname)
 
-        # Encode GLB into file
+    def _encode(self, obj, fragments=None) -> str:
         result = [] # These codes are for float truncation
         for part in json.JSONEncoder(separators=(',', ':')).iterencode(obj):
-            try:
-                rounded = round(float(part), self._json_precision)
-            except ValueError:
-                pass
-            else: part = str(rounded)
+            if fragments and part in fragments:
+                part = fragments[part]
+            else:
+                try:
+                    rounded = round(float(part), self._json_precision)
+                except ValueError:
+                    pass
+                else: part = str(rounded)
             result.append(part)
-        self._source.write(''.join(result).encode('ascii'), fname)
+        return ''.join(result)
+
+    def _update_object(self, update: StateUpdate, fragments: dict) -> dict:
+        '''
+        Convert state update to object where streams are replaced by placeholders of cached fragments
+        '''
+        return {
+            'update_type': StateUpdate.UpdateType.Name(update.update_type),
+            'updates': [self._frame_object(frame, fragments) for frame in update.updates]
+        }
+
+    def _frame_object(self, frame, fragments: dict) -> dict:
+        stripped, stream_fields = split_stream_fields(frame)
+        stripped_obj = XVIZFrame(stripped).to_object()
+        cached_fields = {field.name: states for field, states in stream_fields}
+
+        # Keep the field order of MessageToDict
+        obj = {}
+        for field, _ in frame.ListFields():
+            if field.name not in cached_fields:
+                obj[field.name] = stripped_obj[field.name]
+                continue
+
+            entries = obj[field.name] = {}
+            for stream_id, state in cached_fields[field.name].items():
+                token = '\x00%d' % len(fragments)
+                fragments[json.dumps(token)] = self._cache.fragment(
+                    ('json', field.name, self._json_precision), stream_id, state, self._encode_state)
+                entries[stream_id] = token
+        return obj
+
+    def _encode_state(self, stream_id, state, serialized) -> str:
+        obj = MessageToDict(state, preserving_proto_field_name=True)
+        if state.DESCRIPTOR.name == 'PrimitiveState':
+            _unravel_primitive_state(obj)
+        return self._encode(obj)
@@ -0,0 +1,139 @@
+'''
+This module provides level-of-detail control of point clouds when messages are written or streamed.
+'''
+import time
+import numpy as np
+
+from xviz.message import XVIZMessage, StateUpdate
+from xviz.stats import LatencyHistogram
+
+def voxel_grid_indices(vertices: np.ndarray, voxel_size: float) -> np.ndarray:
+    '''
+    Select the first point in each occupied voxel, return sorted indices of selected points
+
+    :param vertices: array of shape Nx3
+    '''
+    if len(vertices) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    keys = np.floor(vertices / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    extent = keys.max(axis=0) + 1
+    if np.prod(extent.astype(np.float64)) < np.iinfo(np.int64).max:
+        flat_keys = (keys[:, 0] * extent[1] + keys[:, 1]) * extent[2] + keys[:, 2]
+        _, indices = np.unique(flat_keys, return_index=True)
+    else: # the flattened keys would overflow
+        _, indices = np.unique(keys, axis=0, return_index=True)
+    indices.sort()
+    return indices
+
+def random_indices(count: int, target: int, rng: np.random.Generator) -> np.ndarray:
+    '''
+    Randomly select `target` from `count` points, return sorted indices of selected points
+    '''
+    indices = rng.choice(count, size=target, replace=False)
+    indices.sort()
+    return indices
+
+class XVIZPointCloudDecimator:
+    '''
+    Decimate point primitives in state updates. The voxel method keeps one point per voxel
+    and the random method keeps a random subset of points. With `max_points` given, the
+    voxel method is followed by random decimation if there are still too many points.
+
+    The decimation cost of the last frame is stored in `last_cost`, and costs of all frames
+    are collected in `cost_histogram`.
+    '''
+    def __init__(self, method='voxel', voxel_size=0.1, max_points=None, ratio=None,
+                 min_points=1000, seed=None):
+        '''
+        :param method: 'voxel' or 'random'
+        :param voxel_size: size of the voxel grid for voxel method
+        :param max_points: maximum number of points kept in each point primitive
+        :param ratio: ratio of points kept for random method
+        :param min_points: point primitives with fewer points are not decimated
+        :param seed: random seed for random decimation
+        '''
+        if method not in ('voxel', 'random'):
+            raise ValueError("Unknown decimation method: %s" % method)
+        if method == 'random' and not (max_points or ratio):
+            raise ValueError("Random decimation requires max_points or ratio")
+
+        self._method = method
+        self._voxel_size = voxel_size
+        self._max_points = max_points
+        self._ratio = ratio
+        self._min_points = min_points
+        self._rng = np.random.default_rng(seed)
+
+        self.last_cost = 0.
+        self.last_input_points = 0
+        self.last_output_points = 0
+        self.cost_histogram = LatencyHistogram()
+
+    def select(self, vertices: np.ndarray) -> np.ndarray:
+        '''
+        Return sorted indices of the points to keep, or None if all points are kept
+
+        :param vertices: array of shape Nx3
+        '''
+        count = len(vertices)
+        if count < self._min_points:
+            return None
+
+        indices = None
+        if self._method == 'voxel':
+            indices = voxel_grid_indices(vertices, self._voxel_size)
+            count = len(indices)
+
+        target = count
+        if self._ratio:
+            target = int(count * self._ratio)
+        if self._max_points:
+            target = min(target, self._max_points)
+
+        if target < count:
+            selected = random_indices(count, target, self._rng)
+            indices = selected if indices is None else indices[selected]
+        return indices
+
+    def apply(self, message: XVIZMessage) -> XVIZMessage:
+        '''
+        Return a message with decimated point clouds. The input message is not modified,
+        and it's returned directly if nothing is decimated.
+        '''
+        if not isinstance(message.data, StateUpdate):
+            return message
+
+        start = time.perf_counter()
+        result = None
+        input_points = output_points = 0
+        for i, frame in enumerate(message.data.updates):
+            for stream_id, pstate in frame.primitives.items():
+                for j, point in enumerate(pstate.points):
+                    vertices = np.asarray(point.points, dtype=np.float32).reshape(-1, 3)
+                    input_points += len(vertices)
+                    indices = self.select(vertices)
+                    if indices is None:
+                        output_points += len(vertices)
+                        continue
+
+                    # Copy on the first write
+                    if result is None:
+                        result = StateUpdate()
+                        result.CopyFrom(message.data)
+
+                    target = result.updates[i].primitives[stream_id].points[j]
+                    del target.points[:]
+                    target.points.extend(vertices[indices].ravel().tolist())
+                    if point.colors:
+                        colors = np.frombuffer(point.colors, dtype=np.uint8).reshape(len(vertices), -1)
+                        target.colors = colors[indices].tobytes()
+                    output_points += len(indices)
+
+        self.last_cost = time.perf_counter() - start
+        self.last_input_points = input_points
+        self.last_output_points = output_points
+        self.cost_histogram.add(self.last_cost)
+
+        return message if result is None else XVIZMessage(result)
@@ -0,0 +1,179 @@
+'''
+This module provides read-ahead over the readers. When messages are read sequentially, following
+messages are read and decoded on a background thread, so that playback from slow storage doesn't
+stall on each read.
+'''
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from xviz.message import XVIZMessage
+
+class XVIZPrefetchReader:
+    '''
+    Wrap a reader (e.g. XVIZGLBReader) with read-ahead. Sequential access is detected from the
+    order of requested messages. The number of messages read ahead adapts to the read time and
+    the interval between requests, and is limited by `max_window` and by `max_bytes` of decoded data.
+    '''
+    def __init__(self, reader, min_window=2, max_window=64, max_bytes=64 << 20, executor=None):
+        '''
+        :param reader: the reader to be wrapped, it should support reading from multiple threads
+        :param min_window: number of messages read ahead when sequential access is detected
+        :param max_window: maximum number of messages read ahead
+        :param max_bytes: maximum size of decoded messages read ahead
+        :param executor: optional executor to read messages, a single background thread is used by default
+        '''
+        if min_window <= 0 or max_window < min_window:
+            raise ValueError("Invalid prefetch window size")
+        self._reader = reader
+        self._min_window = min_window
+        self._max_window = max_window
+        self._max_bytes = max_bytes
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(1, thread_name_prefix='xviz-prefetch')
+
+        self._futures = OrderedDict() # message index -> future
+        self._lock = threading.Lock()
+        self._positions = None
+        self._last_position = None
+        self._last_request = None
+
+        # moving averages of read time, request interval and message size
+        self._read_time = 0.
+        self._interval = 0.
+        self._message_size = 0.
+
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+
+    def _ensure_positions(self):
+        if self._positions is None:
+            self._positions = {index: position for position, (_, _, index)
+                               in enumerate(self._reader.message_timings)}
+
+    @property
+    def message_timings(self):
+        return self._reader.message_timings
+
+    def __len__(self):
+        return len(self._reader)
+
+    def find_message(self, timestamp: float) -> int:
+        return self._reader.find_message(timestamp)
+
+    def find_messages(self, start_time: float = None, end_time: float = None):
+        return self._reader.find_messages(start_time, end_time)
+
+    def read_metadata(self) -> XVIZMessage:
+        return self._reader.read_metadata()
+
+    @property
+    def window(self) -> int:
+        '''
+        Current number of messages to read ahead
+        '''
+        window = self._min_window
+        if self._interval > 0:
+            # keep enough reads in flight to cover the read time at the current request rate
+            window = max(window, math.ceil(self._read_time / self._interval) + 1)
+        if self._message_size > 0:
+            window = min(window, int(self._max_bytes // self._message_size))
+        return max(min(window, self._max_window), 1)
+
+    def get_stats(self) -> dict:
+        return dict(hits=self.hits, waits=self.waits, misses=self.misses, window=self.window,
+                    read_time=self._read_time, interval=self._interval, message_size=self._message_size)
+
+    def _read(self, index: int) -> XVIZMessage:
+        start = time.perf_counter()
+        message = self._reader.read_message(index)
+        size = message.data.ByteSize()
+        with self._lock:
+            self._read_time = 0.8 * self._read_time + 0.2 * (time.perf_counter() - start) \
+                if self._read_time else time.perf_counter() - start
+            self._message_size = 0.8 * self._message_size + 0.2 * size if self._message_size else size
+        return message
+
+    def _get_future(self, index: int):
+        '''
+        Take the pending read of the message, and count the hit or miss
+        '''
+        with self._lock:
+            future = self._futures.pop(index, None)
+        if future is None:
+            self.misses += 1
+        elif future.done():
+            self.hits += 1
+        else:
+            self.waits += 1
+        return future
+
+    def _schedule(self, index: int):
+        '''
+        Update access pattern with requested message, and read ahead if the access is sequential
+        '''
+        self._ensure_positions()
+        now = time.perf_counter()
+        position = self._positions.get(index)
+        sequential = position is not None and self._last_position is not None \
+            and position == self._last_position + 1
+        if sequential and self._last_request is not None:
+            interval = now - self._last_request
+            self._interval = 0.8 * self._interval + 0.2 * interval if self._interval else interval
+        self._last_position, self._last_request = position, now
+
+        timings = self._reader.message_timings
+        with self._lock:
+            if not sequential:
+                for future in self._futures.values():
+                    future.cancel()
+                self._futures.clear()
+                return
+
+            ahead = [timings[p][2] for p in range(position + 1, min(position + 1 + self.window, len(timings)))]
+            for stale in [i for i in self._futures if i not in ahead]:
+                self._futures.pop(stale).cancel()
+            for i in ahead:
+                if i not in self._futures:
+                    self._futures[i] = self._executor.submit(self._read, i)
+
+    def read_message(self, index: int) -> XVIZMessage:
+        future = self._get_future(index)
+        self._schedule(index)
+        if future is not None and not future.cancelled():
+            return future.result()
+        return self._read(index)
+
+    def skip(self, index: int):
+        '''
+        Record the access of a message obtained elsewhere (e.g. from a cache of encoded data), so that
+        reading ahead follows it without reading the message
+        '''
+        with self._lock:
+            future = self._futures.pop(index, None)
+        if future is not None:
+            future.cancel()
+        self._schedule(index)
+
+    async def aread_message(self, index: int) -> XVIZMessage:
+        '''
+        Read message without blocking the event loop, messages not read ahead are read in the executor
+        '''
+        future = self._get_future(index)
+        self._schedule(index)
+        if future is None or future.cancelled():
+            future = self._executor.submit(self._read, index)
+        return await asyncio.wrap_future(future)
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+        self._reader.close()
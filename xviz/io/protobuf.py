@@ -1,22 +1,223 @@
-import json
-from .base import XVIZBaseWriter
+'''
+This module provides io of protobuf messages. Messages are either written into separate files, or
+appended into a single log file as length-delimited records with a sidecar offset index.
 
-from xviz.message import XVIZEnvelope, XVIZMessage, Metadata
+The log file starts with `PROTOBUF_LOG_MAGIC` followed by records of varint length and message
+data. The index file starts with `PROTOBUF_INDEX_MAGIC` followed by fixed size entries of
+(message index, data offset, data length, start time, end time).
+'''
+import struct
+import numpy as np
+
+from .base import XVIZBaseWriter, XVIZBaseReader
+
+from xviz.message import XVIZMessage, Metadata, StateUpdate
+from xviz.v2.envelope_pb2 import Envelope
+
+PROTOBUF_LOG_MAGIC = b'XVIZPBL\x01'
+PROTOBUF_INDEX_MAGIC = b'XVIZIDX\x01'
+INDEX_ENTRY_FORMAT = '<IQQdd'
+INDEX_ENTRY_DTYPE = np.dtype([
+    ('index', '<u4'),
+    ('offset', '<u8'),
+    ('length', '<u8'),
+    ('start_time', '<f8'),
+    ('end_time', '<f8')
+])
+
+def _encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if value:
+            result.append(bits | 0x80)
+        else:
+            result.append(bits)
+            return bytes(result)
+
+def _decode_varint(buffer, position: int):
+    '''
+    :return: (value, position after the varint)
+    '''
+    result = shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+def _encode_bytes_field(number: int, data: bytes) -> bytes:
+    '''
+    Encode a length-delimited protobuf field
+    '''
+    return _encode_varint(number << 3 | 2) + _encode_varint(len(data)) + data
+
+def _encode_envelope(message: XVIZMessage, data: bytes) -> bytes:
+    '''
+    Wrap serialized message data into a serialized Envelope without packing the message again
+    '''
+    type_url = 'type.googleapis.com/' + message.data.DESCRIPTOR.full_name
+    envelope_data = _encode_bytes_field(1, type_url.encode('ascii')) + _encode_bytes_field(2, data)
+    return _encode_bytes_field(1, message.get_schema().replace("session", "xviz").encode('ascii'))\
+        + _encode_bytes_field(2, envelope_data)
+
+def _parse_message(data: bytes, wrap_envelope: bool = True, index: int = None) -> XVIZMessage:
+    '''
+    :param index: index of the message, which tells the message type of unwrapped data
+    '''
+    if not wrap_envelope: # unwrapped data is the metadata at index 1, or a state update
+        if index == 1:
+            return XVIZMessage(metadata=Metadata.FromString(data))
+        return XVIZMessage(update=StateUpdate.FromString(data))
+
+    envelope = Envelope.FromString(data)
+    if envelope.type == "xviz/metadata":
+        return XVIZMessage(metadata=Metadata.FromString(envelope.data.value))
+    elif envelope.type == "xviz/state_update":
+        return XVIZMessage(update=StateUpdate.FromString(envelope.data.value))
+    raise ValueError("Unrecognized envelope data")
 
 class XVIZProtobufWriter(XVIZBaseWriter):
-    def __init__(self, sink, wrap_envelope=True, float_precision=10, as_array_buffer=False):
-        super().__init__(sink)
+    def __init__(self, sink, wrap_envelope=True, decimator=None, log_name=None):
+        '''
+        :param log_name: if given, messages are appended to a single log file with this name and the offset
+            index is written to `<log_name>.idx`. Otherwise each message is written into a separate file.
+        '''
+        super().__init__(sink, decimator)
         self._wrap_envelop = wrap_envelope
-        self._json_precision = float_precision
         self._counter = 2
 
+        self._log_name = log_name
+        self._log_file = None
+        self._index_file = None
+        self._log_offset = 0
+
     def write_message(self, message: XVIZMessage, index: int = None):
         self._check_valid()
+        message = self._prepare_message(message)
+        data = message.data.SerializeToString()
         if self._wrap_envelop:
-            obj = XVIZEnvelope(message).data
+            data = _encode_envelope(message, data)
+
+        index = self._get_sequential_index(message, index)
+        if self._log_name:
+            self._append_record(index, data)
+        else:
+            self._source.write(data, "%d-frame.pbe" % index)
+
+    def _append_record(self, index: int, data: bytes):
+        if self._log_file is None:
+            self._log_file = self._source.open(self._log_name, 'w')
+            self._log_file.write(PROTOBUF_LOG_MAGIC)
+            self._log_offset = len(PROTOBUF_LOG_MAGIC)
+            self._index_file = self._source.open(self._log_name + '.idx', 'w')
+            self._index_file.write(PROTOBUF_INDEX_MAGIC)
+
+        header = _encode_varint(len(data))
+        self._log_file.write(header)
+        self._log_file.write(data)
+
+        timing = self._message_timings['messages'].get(index) if index > 1 else None
+        start_time, end_time = timing[:2] if timing else (float('nan'), float('nan'))
+        self._index_file.write(struct.pack(INDEX_ENTRY_FORMAT, index,
+            self._log_offset + len(header), len(data), start_time, end_time))
+        self._log_offset += len(header) + len(data)
+
+    def close(self):
+        '''
+        Close the log files, or write timestamp list into the sink if messages are written separately.
+        '''
+        if self._source and self._log_name:
+            if self._log_file:
+                self._log_file.close()
+                self._index_file.close()
+                self._log_file = self._index_file = None
+            self._source.close()
+            self._source = None
         else:
-            obj = message.data
+            super().close()
+
+class XVIZProtobufReader(XVIZBaseReader):
+    SUFFIX = '.pbe'
+
+    def __init__(self, source, wrap_envelope=True, log_name=None):
+        '''
+        :param log_name: name of the log file if messages are written into a single log
+        '''
+        super().__init__(source)
+        self._wrap_envelop = wrap_envelope
+        self._log_name = log_name
+        self._log_data = None
+        self._entries = None
+
+    def _load_index(self):
+        if not self._log_name:
+            super()._load_index()
+            return
+        if self._entries is not None:
+            return
+
+        data = self._source.read(self._log_name + '.idx')
+        if data[:len(PROTOBUF_INDEX_MAGIC)] != PROTOBUF_INDEX_MAGIC:
+            raise ValueError("Invalid index file of %s" % self._log_name)
+        entries = np.frombuffer(data, dtype=INDEX_ENTRY_DTYPE, offset=len(PROTOBUF_INDEX_MAGIC))
+        self._entries = entries[np.argsort(entries['index'], kind='stable')]
+
+        updates = self._entries[self._entries['index'] > 1]
+        self._timings = list(zip(updates['start_time'].tolist(), updates['end_time'].tolist(),
+                                 updates['index'].tolist()))
+        self._end_times = updates['end_time'].tolist()
+
+    def _get_log_data(self):
+        if self._log_data is None:
+            if hasattr(self._source, 'mmap'):
+                data = self._source.mmap(self._log_name)
+            else:
+                data = self._source.read(self._log_name)
+            if data[:len(PROTOBUF_LOG_MAGIC)] != PROTOBUF_LOG_MAGIC:
+                raise ValueError("Invalid protobuf log file %s" % self._log_name)
+            self._log_data = data
+        return self._log_data
+
+    def read_message(self, index: int) -> XVIZMessage:
+        if not self._log_name:
+            return _parse_message(self._source.read(self._get_file_name(index)), self._wrap_envelop, index)
+
+        self._load_index()
+        position = np.searchsorted(self._entries['index'], index)
+        if position == len(self._entries) or self._entries['index'][position] != index:
+            raise KeyError("Message %d is not found in the log" % index)
+
+        offset = int(self._entries['offset'][position])
+        length = int(self._entries['length'][position])
+        return _parse_message(self._get_log_data()[offset:offset + length], self._wrap_envelop, index)
+
+    def iter_messages(self):
+        '''
+        Read all messages in the log file sequentially. The index file is not required for messages
+        wrapped in envelopes, otherwise it's used to find the metadata.
+        '''
+        if not self._log_name:
+            raise ValueError("Sequential reading is only supported for log file")
+
+        indices = {}
+        if not self._wrap_envelop:
+            self._load_index()
+            indices = dict(zip(self._entries['offset'].tolist(), self._entries['index'].tolist()))
+
+        data = self._get_log_data()
+        position = len(PROTOBUF_LOG_MAGIC)
+        while position < len(data):
+            length, position = _decode_varint(data, position)
+            yield _parse_message(data[position:position + length], self._wrap_envelop, indices.get(position))
+            position += length
 
-        
-        fname = self._get_sequential_name(message, index) + '.pbe'
-        self._source.write(obj.SerializeToString(), fname)
+    def close(self):
+        if self._log_data is not None:
+            if hasattr(self._log_data, 'close'):
+                self._log_data.close()
+            self._log_data = None
+        super().close()
@@ -0,0 +1,244 @@
+'''
+This module reconstructs the accumulated state of logs written with `INCREMENTAL` or `PERSISTENT`
+updates. Snapshots of the full state are built periodically, so the state at any time is
+obtained by replaying only the updates after the nearest snapshot.
+
+Snapshots can be saved as a sidecar of the log (`0-snapshots.json` with `0-snapshots.pb`),
+otherwise they are computed lazily on first use. The sidecar records the message timings of the
+log, so it's ignored if the log is rewritten.
+'''
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import threading
+
+from xviz.message import XVIZMessage
+from xviz.filter import STREAM_FIELDS
+from xviz.v2.core_pb2 import StreamSet, TimeSeriesState
+from xviz.v2.session_pb2 import StateUpdate
+
+SNAPSHOT_INDEX_NAME = '0-snapshots.json'
+SNAPSHOT_DATA_NAME = '0-snapshots.pb'
+
+# Update types replacing the whole state
+FULL_UPDATE_TYPES = (StateUpdate.UpdateType.SNAPSHOT, StateUpdate.UpdateType.COMPLETE_STATE)
+
+class XVIZStateAccumulator:
+    '''
+    Accumulate state updates into the full state. Streams in incremental and persistent updates
+    replace the previous state of the same streams, streams in `no_data_streams` are removed and
+    snapshot or complete state updates replace the whole state.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._timestamp = 0.
+        self._states = {field: {} for field in STREAM_FIELDS}
+        self._time_series = {} # (object id, stream id) -> TimeSeriesState
+
+    @property
+    def timestamp(self) -> float:
+        return self._timestamp
+
+    def apply(self, frame: StreamSet, update_type: int = StateUpdate.UpdateType.INCREMENTAL):
+        if update_type in FULL_UPDATE_TYPES:
+            self.reset()
+        self._timestamp = frame.timestamp
+
+        for field in STREAM_FIELDS:
+            self._states[field].update(getattr(frame, field).items())
+
+        for state in frame.time_series:
+            if len(state.streams) == 1:
+                self._time_series[(state.object_id, state.streams[0])] = state
+                continue
+            # split into single stream states so that they can be replaced separately
+            fields = [(field.name, values) for field, values in state.values.ListFields()
+                      if len(values) == len(state.streams)]
+            for i, stream_id in enumerate(state.streams):
+                single = TimeSeriesState(timestamp=state.timestamp, object_id=state.object_id, streams=[stream_id])
+                for name, values in fields:
+                    getattr(single.values, name).append(values[i])
+                self._time_series[(state.object_id, stream_id)] = single
+
+        if frame.no_data_streams:
+            cleared = set(frame.no_data_streams)
+            for states in self._states.values():
+                for stream_id in cleared.intersection(states):
+                    del states[stream_id]
+            for key in [key for key in self._time_series if key[1] in cleared]:
+                del self._time_series[key]
+
+    def apply_message(self, message: XVIZMessage):
+        update = message.data
+        if isinstance(update, StateUpdate):
+            for frame in update.updates:
+                self.apply(frame, update.update_type)
+
+    def get_state(self) -> StreamSet:
+        '''
+        Get the accumulated state as a new frame
+        '''
+        frame = StreamSet(timestamp=self._timestamp)
+        for field, states in self._states.items():
+            target = getattr(frame, field)
+            for stream_id, state in states.items():
+                target[stream_id].CopyFrom(state)
+        frame.time_series.extend(self._time_series.values())
+        return frame
+
+def _timings_digest(timings) -> str:
+    return hashlib.blake2b(json.dumps(list(timings)).encode('ascii'), digest_size=16).hexdigest()
+
+class XVIZSnapshotIndex:
+    '''
+    Periodic snapshots of the accumulated state of a log. The log is scanned once when the
+    snapshots are first needed, unless they are loaded from the sidecar. In event loops, use the
+    coroutine methods (e.g. `aget_state`), which scan and replay the log in an executor.
+    '''
+    def __init__(self, reader, interval=100, source=None, autosave=True):
+        '''
+        :param reader: reader of the log, such as XVIZGLBReader
+        :param interval: number of state updates between two snapshots
+        :param source: optional source containing the snapshot sidecar, it's ignored if the sidecar is
+            absent or doesn't match the log
+        :param autosave: write the sidecar into the source after the snapshots are built
+        '''
+        if interval <= 0:
+            raise ValueError("Snapshot interval must be positive")
+        self._reader = reader
+        self._interval = interval
+        self._source = source
+        self._autosave = autosave
+        self._entries = None # list of (message index, timestamp, offset, length)
+        self._data = None
+        self._start_times = None
+        self._positions = None
+        self._lock = threading.RLock()
+
+        if source is not None:
+            self._load(source)
+
+    def _load(self, source):
+        try:
+            index = json.loads(source.read(SNAPSHOT_INDEX_NAME))
+            data = source.read(SNAPSHOT_DATA_NAME)
+        except (IOError, KeyError):
+            return
+
+        timings = self._reader.message_timings
+        if index.get('count') != len(timings) or index.get('timings') != _timings_digest(timings):
+            logging.getLogger("xviz").info("Snapshot sidecar doesn't match the log, it will be rebuilt")
+            return
+        self._interval = index['interval']
+        self._entries = [tuple(entry) for entry in index['snapshots']]
+        self._data = data
+
+    def build(self):
+        '''
+        Scan the log and take a snapshot every `interval` updates
+        '''
+        accumulator = XVIZStateAccumulator()
+        entries, parts, offset = [], [], 0
+        for position, (_, _, index) in enumerate(self._reader.message_timings):
+            accumulator.apply_message(self._reader.read_message(index))
+            if (position + 1) % self._interval == 0:
+                data = accumulator.get_state().SerializeToString()
+                entries.append((index, accumulator.timestamp, offset, len(data)))
+                parts.append(data)
+                offset += len(data)
+
+        self._entries = entries
+        self._data = b''.join(parts)
+
+    def save(self, sink):
+        '''
+        Write the snapshots as sidecar into the sink
+        '''
+        self._ensure_built()
+        timings = self._reader.message_timings
+        sink.write(self._data, SNAPSHOT_DATA_NAME)
+        index = dict(interval=self._interval, snapshots=self._entries,
+                     count=len(timings), timings=_timings_digest(timings))
+        sink.write(json.dumps(index, separators=(',', ':')).encode('ascii'), SNAPSHOT_INDEX_NAME)
+
+    def _ensure_built(self):
+        if self._positions is not None:
+            return
+
+        with self._lock:
+            if self._entries is None:
+                self.build()
+                if self._source is not None and self._autosave:
+                    try:
+                        self.save(self._source)
+                    except (IOError, ValueError) as e:
+                        logging.getLogger("xviz").warning("Failed to save snapshot sidecar: %s", e)
+            if self._positions is None:
+                timings = self._reader.message_timings
+                self._start_times = [tmin for tmin, _, _ in timings]
+                self._positions = {index: position for position, (_, _, index) in enumerate(timings)}
+
+    @property
+    def built(self) -> bool:
+        return self._positions is not None
+
+    async def abuild(self, executor=None):
+        '''
+        Load or build the snapshots in the executor (the default executor if not given)
+        '''
+        if not self.built:
+            await asyncio.get_running_loop().run_in_executor(executor, self._ensure_built)
+
+    def __len__(self):
+        self._ensure_built()
+        return len(self._entries)
+
+    def get_state(self, index: int) -> StreamSet:
+        '''
+        Get the accumulated state after the state update of given message index
+        '''
+        self._ensure_built()
+        if index not in self._positions:
+            raise KeyError("Message %d is not found in the log" % index)
+        position = self._positions[index]
+
+        # snapshot i is taken after the update at position (i + 1) * interval - 1
+        snapshot = min((position + 1) // self._interval, len(self._entries))
+        accumulator = XVIZStateAccumulator()
+        start = 0
+        if snapshot > 0:
+            _, _, offset, length = self._entries[snapshot - 1]
+            accumulator.apply(StreamSet.FromString(self._data[offset:offset + length]),
+                              StateUpdate.UpdateType.COMPLETE_STATE)
+            start = snapshot * self._interval
+
+        for _, _, message_index in self._reader.message_timings[start:position + 1]:
+            accumulator.apply_message(self._reader.read_message(message_index))
+        return accumulator.get_state()
+
+    def get_state_at(self, timestamp: float) -> StreamSet:
+        '''
+        Get the accumulated state at the timestamp, i.e. after the last update starting at or before
+        the timestamp. Return None if the timestamp is earlier than all updates.
+        '''
+        self._ensure_built()
+        position = bisect.bisect_right(self._start_times, timestamp) - 1
+        if position < 0:
+            return None
+        return self.get_state(self._reader.message_timings[position][2])
+
+    async def aget_state(self, index: int, executor=None) -> StreamSet:
+        '''
+        Coroutine version of `get_state` running in the executor
+        '''
+        return await asyncio.get_running_loop().run_in_executor(executor, self.get_state, index)
+
+    async def aget_state_at(self, timestamp: float, executor=None) -> StreamSet:
+        '''
+        Coroutine version of `get_state_at` running in the executor
+        '''
+        return await asyncio.get_running_loop().run_in_executor(executor, self.get_state_at, timestamp)
@@ -4,6 +4,10 @@ Here the source is the combine definition of `source` and `sink` as from xviz JS
 '''
 import os
 import io
+import mmap
+import threading
+import weakref
+import zipfile
 from collections import defaultdict
 
 class BaseSource:
@@ -22,6 +26,7 @@ class BaseSource:
 class DirectorySource:
     def __init__(self, directory):
         self._dir = directory
+        self._maps = weakref.WeakSet()
         assert os.path.isdir(self._dir)
 
     def open(self, name, mode='r'):
@@ -37,13 +42,58 @@ class DirectorySource:
 
     def write(self, data, name):
         with open(os.path.join(self._dir, name), 'wb') as fout:
-            fout.write(fout, data)
+            fout.write(data)
+
+    def mmap(self, name):
+        '''
+        Map the file into memory for read-only access
+        '''
+        with open(os.path.join(self._dir, name), 'rb') as fin:
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.add(mapped)
+        return mapped
 
     def close(self):
-        pass
+        '''
+        Close the memory maps. Maps still referenced by arrays (e.g. columnar frames) are
+        released when the arrays are collected.
+        '''
+        for mapped in list(self._maps):
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._maps.clear()
 
 class ZipSource:
-    pass
+    '''
+    Source stored in a zip archive. Messages are usually already compressed, so they are stored
+    without compression by default.
+    '''
+    def __init__(self, path, mode='r', compression=zipfile.ZIP_STORED):
+        '''
+        :param path: path or file object of the archive
+        :param mode: 'r' to read, 'w' to create or 'a' to append
+        '''
+        self._zip = zipfile.ZipFile(path, mode, compression)
+        self._lock = threading.Lock()
+
+    def namelist(self):
+        return self._zip.namelist()
+
+    def open(self, name, mode='r'):
+        return self._zip.open(name, mode)
+
+    def read(self, name):
+        with self._lock:
+            return self._zip.read(name)
+
+    def write(self, data, name):
+        with self._lock:
+            self._zip.writestr(name, data)
+
+    def close(self):
+        self._zip.close()
 
 class _BytesIOWrapper(io.BytesIO):
     '''
@@ -0,0 +1,245 @@
+'''
+This module exports XVIZ logs into columnar tables for offline analysis. Time series, variables and
+primitive metadata are written into separate tables, with rows grouped by frames. Parquet is used
+if pyarrow is installed, otherwise each row group is written as a numpy `.npz` file.
+
+The row groups are listed in `index.json` with their time ranges, so that scans over a time range
+only read the needed row groups and columns.
+'''
+import json
+import math
+import numpy as np
+
+from xviz.message import XVIZMessage, StateUpdate
+from xviz.columnar import VERTEX_FIELDS
+
+TABLE_COLUMNS = dict(
+    time_series=('timestamp', 'stream_id', 'object_id', 'value', 'value_string'),
+    variables=('timestamp', 'stream_id', 'object_id', 'index', 'value', 'value_string'),
+    primitives=('timestamp', 'stream_id', 'category', 'object_id', 'classes', 'vertex_count')
+)
+COLUMN_DTYPES = dict(timestamp=np.float64, index=np.int32, value=np.float64, vertex_count=np.int64)
+
+def _get_table_format(table_format: str = None) -> str:
+    if table_format is None:
+        try:
+            import pyarrow # noqa: F401
+        except ImportError:
+            return 'npz'
+        return 'parquet'
+
+    if table_format not in ('parquet', 'npz'):
+        raise ValueError("Unsupported table format: %s" % table_format)
+    return table_format
+
+def _iter_values(values):
+    '''
+    Yield (number, string) of each value in `Values`, number is NaN for strings
+    '''
+    for value in values.doubles:
+        yield value, ''
+    for value in values.int32s:
+        yield float(value), ''
+    for value in values.bools:
+        yield float(value), ''
+    for value in values.strings:
+        yield math.nan, value
+
+class XVIZTableExporter:
+    def __init__(self, sink, table_format=None, row_group_size=1000):
+        '''
+        :param sink: object of type in xviz.io.sources
+        :param table_format: 'parquet' or 'npz', parquet is used if pyarrow is installed by default
+        :param row_group_size: number of frames in each row group
+        '''
+        if sink is None:
+            raise ValueError("Data sink must be specified!")
+        self._source = sink
+        self._format = _get_table_format(table_format)
+        self._row_group_size = row_group_size
+
+        self._rows = {table: {column: [] for column in columns} for table, columns in TABLE_COLUMNS.items()}
+        self._frame_count = 0
+        self._times = []
+        self._index = dict(format=self._format, tables={table: [] for table in TABLE_COLUMNS})
+        self._parquet_writers = {}
+
+    def export(self, reader):
+        '''
+        Export all state updates from a reader (e.g. XVIZGLBReader) and close the exporter
+        '''
+        for _, _, index in reader.message_timings:
+            self.add_message(reader.read_message(index))
+        self.close()
+
+    def add_message(self, message: XVIZMessage):
+        self._check_valid()
+        if not isinstance(message.data, StateUpdate):
+            return
+
+        for frame in message.data.updates:
+            self._add_frame(frame)
+            self._frame_count += 1
+            if self._frame_count >= self._row_group_size:
+                self._flush()
+
+    def _add_frame(self, frame):
+        timestamp = frame.timestamp
+        self._times.append(timestamp)
+
+        rows = self._rows['time_series']
+        for state in frame.time_series:
+            for stream_id, (value, value_string) in zip(state.streams, _iter_values(state.values)):
+                self._times.append(state.timestamp or timestamp)
+                rows['timestamp'].append(state.timestamp or timestamp)
+                rows['stream_id'].append(stream_id)
+                rows['object_id'].append(state.object_id)
+                rows['value'].append(value)
+                rows['value_string'].append(value_string)
+
+        rows = self._rows['variables']
+        for stream_id, state in frame.variables.items():
+            for variable in state.variables:
+                for index, (value, value_string) in enumerate(_iter_values(variable.values)):
+                    rows['timestamp'].append(timestamp)
+                    rows['stream_id'].append(stream_id)
+                    rows['object_id'].append(variable.base.object_id)
+                    rows['index'].append(index)
+                    rows['value'].append(value)
+                    rows['value_string'].append(value_string)
+
+        rows = self._rows['primitives']
+        for stream_id, state in frame.primitives.items():
+            for field, _ in state.ListFields():
+                vertex_field = VERTEX_FIELDS.get(field.name)
+                for primitive in getattr(state, field.name):
+                    rows['timestamp'].append(timestamp)
+                    rows['stream_id'].append(stream_id)
+                    rows['category'].append(field.name)
+                    rows['object_id'].append(primitive.base.object_id)
+                    rows['classes'].append(','.join(primitive.base.classes))
+                    rows['vertex_count'].append(len(getattr(primitive, vertex_field)) // 3
+                        if vertex_field else 0)
+
+    def _flush(self):
+        if not self._frame_count:
+            return
+
+        start_time, end_time = min(self._times), max(self._times)
+        for table, columns in self._rows.items():
+            if not columns['timestamp']:
+                continue
+
+            data = {name: np.array(values, dtype=COLUMN_DTYPES.get(name, str))
+                    for name, values in columns.items()}
+            entries = self._index['tables'][table]
+            entry = dict(start_time=start_time, end_time=end_time, rows=len(data['timestamp']))
+
+            if self._format == 'parquet':
+                entry['name'] = self._write_parquet(table, data)
+                entry['row_group'] = len(entries)
+            else:
+                entry['name'] = "%s-%d.npz" % (table, len(entries))
+                with self._source.open(entry['name'], 'w') as fout:
+                    np.savez(fout, **data)
+            entries.append(entry)
+
+            for values in columns.values():
+                values.clear()
+
+        self._frame_count = 0
+        self._times = []
+
+    def _write_parquet(self, table: str, data: dict) -> str:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        name = table + '.parquet'
+        arrow_table = pa.table(data)
+        if table not in self._parquet_writers:
+            fout = self._source.open(name, 'w')
+            self._parquet_writers[table] = (fout, pq.ParquetWriter(fout, arrow_table.schema))
+        self._parquet_writers[table][1].write_table(arrow_table, row_group_size=max(len(arrow_table), 1))
+        return name
+
+    def close(self):
+        '''
+        Write remaining rows and the index into the sink and then close the source.
+        '''
+        if self._source:
+            self._flush()
+            for fout, writer in self._parquet_writers.values():
+                writer.close()
+                fout.close()
+            self._source.write(json.dumps(self._index, separators=(',', ':')).encode('ascii'), 'index.json')
+            self._source.close()
+            self._source = None
+
+    def _check_valid(self):
+        if not self._source:
+            raise ValueError("The exporter has been closed!")
+
+class XVIZTableReader:
+    '''
+    Read tables written by XVIZTableExporter
+    '''
+    def __init__(self, source):
+        '''
+        :param source: object of type in xviz.io.sources
+        '''
+        if source is None:
+            raise ValueError("Data source must be specified!")
+        self._source = source
+        self._index = json.loads(self._source.read('index.json'))
+
+    @property
+    def tables(self):
+        return list(self._index['tables'])
+
+    def read(self, table: str, columns: list = None, start_time: float = None, end_time: float = None) -> dict:
+        '''
+        Read columns of a table as dictionary of numpy arrays. Only row groups overlapping with
+        the time range are read, and rows are filtered by their timestamps.
+
+        :param columns: names of columns to read, all columns are read by default
+        '''
+        if table not in self._index['tables']:
+            raise KeyError("Table %s is not found" % table)
+        columns = list(columns or TABLE_COLUMNS[table])
+        read_columns = columns if 'timestamp' in columns else columns + ['timestamp']
+
+        entries = [entry for entry in self._index['tables'][table]
+            if (start_time is None or entry['end_time'] >= start_time)
+            and (end_time is None or entry['start_time'] <= end_time)]
+
+        parts = []
+        if self._index['format'] == 'parquet':
+            import pyarrow.parquet as pq
+            names = sorted(set(entry['name'] for entry in entries))
+            for name in names:
+                with self._source.open(name, 'r') as fin:
+                    row_groups = [entry['row_group'] for entry in entries if entry['name'] == name]
+                    arrow_table = pq.ParquetFile(fin).read_row_groups(row_groups, columns=read_columns)
+                    parts.append({column: arrow_table.column(column).to_numpy() for column in read_columns})
+        else:
+            for entry in entries:
+                with self._source.open(entry['name'], 'r') as fin:
+                    with np.load(fin) as data:
+                        parts.append({column: data[column] for column in read_columns})
+
+        if parts:
+            result = {column: np.concatenate([part[column] for part in parts]) for column in read_columns}
+        else:
+            result = {column: np.array([], dtype=COLUMN_DTYPES.get(column, str)) for column in read_columns}
+
+        mask = np.ones(len(result['timestamp']), dtype=bool)
+        if start_time is not None:
+            mask &= result['timestamp'] >= start_time
+        if end_time is not None:
+            mask &= result['timestamp'] <= end_time
+        return {column: result[column][mask] for column in columns}
+
+    def close(self):
+        if self._source:
+            self._source.close()
+            self._source = None
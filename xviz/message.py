@@ -5,7 +5,7 @@ from xviz.v2.core_pb2 import StreamSet
 from xviz.v2.session_pb2 import StateUpdate, Metadata
 from xviz.v2.options_pb2 import xviz_json_schema
 from xviz.v2.envelope_pb2 import Envelope
-from google.protobuf.json_format import MessageToDict
+from google.protobuf.json_format import MessageToDict, ParseDict
 
 def _unravel_list(list_: list, width: int) -> List[list]: # XXX: This is actually not used
     if len(list_) % width != 0:
@@ -23,6 +23,39 @@ def _unravel_style_object(style: dict):
     if 'stroke_color' in style:
         style['stroke_color'] = list(base64.b64decode(style['stroke_color']))
 
+def _ravel_style_object(style: dict):
+    if 'fill_color' in style and not isinstance(style['fill_color'], str):
+        style['fill_color'] = base64.b64encode(bytes(style['fill_color'])).decode('ascii')
+    if 'stroke_color' in style and not isinstance(style['stroke_color'], str):
+        style['stroke_color'] = base64.b64encode(bytes(style['stroke_color'])).decode('ascii')
+
+def _ravel_primitive_state(pdata: dict):
+    '''
+    Inverse of `_unravel_primitive_state`
+    '''
+    if 'points' in pdata:
+        for pldata in pdata['points']:
+            if 'colors' in pldata and not isinstance(pldata['colors'], str):
+                pldata['colors'] = base64.b64encode(bytes(pldata['colors'])).decode('ascii')
+
+    for pcats in pdata.values():
+        for pldata in pcats:
+            if 'base' in pldata and 'style' in pldata['base']:
+                _ravel_style_object(pldata['base']['style'])
+
+def _unravel_primitive_state(pdata: dict):
+    # process colors
+    if 'points' in pdata:
+        for pldata in pdata['points']:
+            if 'colors' in pldata:
+                pldata['colors'] = list(base64.b64decode(pldata['colors']))
+
+    # process styles
+    for pcats in pdata.values():
+        for pldata in pcats:
+            if 'base' in pldata and 'style' in pldata['base']:
+                _unravel_style_object(pldata['base']['style'])
+
 class XVIZFrame:
     '''
     This class is basically a wrapper around protobuf message `StreamSet`. It represent a frame of update.
@@ -43,18 +76,8 @@ class XVIZFrame:
 
         if 'primitives' in dataobj:
             for pdata in dataobj['primitives'].values():
-                # process colors
-                if 'points' in pdata:
-                    for pldata in pdata['points']:
-                        if 'colors' in pldata:
-                            pldata['colors'] = list(base64.b64decode(pldata['colors']))
-
-                # process styles
-                for pcats in pdata.values():
-                    for pldata in pcats:
-                        if 'base' in pldata and 'style' in pldata['base']:
-                            _unravel_style_object(pldata['base']['style'])
-                    
+                _unravel_primitive_state(pdata)
+
         return dataobj
 
     @property
@@ -84,6 +107,40 @@ class XVIZMessage:
                 raise ValueError("Message data has already been set!")
             self._data = metadata
 
+    @staticmethod
+    def from_object(obj: Dict) -> 'XVIZMessage':
+        '''
+        Restore message from the object generated by `to_object`. Envelope objects (with `type`
+        and `data` keys) are also accepted. The object may be modified.
+        '''
+        if 'type' in obj and 'data' in obj:
+            if obj['type'] == 'xviz/state_update':
+                return XVIZMessage(update=XVIZMessage._parse_update(obj['data']))
+            elif obj['type'] == 'xviz/metadata':
+                return XVIZMessage(metadata=XVIZMessage._parse_metadata(obj['data']))
+            else:
+                raise ValueError("Unrecognized message type: %s" % obj['type'])
+
+        if 'updates' in obj:
+            return XVIZMessage(update=XVIZMessage._parse_update(obj))
+        return XVIZMessage(metadata=XVIZMessage._parse_metadata(obj))
+
+    @staticmethod
+    def _parse_update(dataobj: Dict) -> StateUpdate:
+        for frame in dataobj.get('updates', []):
+            if 'primitives' in frame:
+                for pdata in frame['primitives'].values():
+                    _ravel_primitive_state(pdata)
+        return ParseDict(dataobj, StateUpdate())
+
+    @staticmethod
+    def _parse_metadata(dataobj: Dict) -> Metadata:
+        if 'streams' in dataobj:
+            for sdata in dataobj['streams'].values():
+                if 'stream_style' in sdata:
+                    _ravel_style_object(sdata['stream_style'])
+        return ParseDict(dataobj, Metadata())
+
     def get_schema(self) -> str:
         return type(self._data).DESCRIPTOR.GetOptions().Extensions[xviz_json_schema]
 
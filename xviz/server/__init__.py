@@ -1,3 +1,35 @@
-from .server import XVIZServer
-from .handlers import XVIZLogPlayHandler
-from .sessions import XVIZBaseSession, XVIZLogPlaySession
+'''
+This module contains the websocket server of XVIZ. The server and sessions are imported on first
+access, so that websockets is only loaded when it's needed.
+'''
+from typing import TYPE_CHECKING
+from xviz import _lazy_getattr
+
+_LAZY_IMPORTS = dict(
+    XVIZServer='xviz.server.server',
+    XVIZRouter='xviz.server.routing',
+    XVIZLogPlayHandler='xviz.server.handlers',
+    XVIZBaseSession='xviz.server.sessions',
+    XVIZLogPlaySession='xviz.server.sessions',
+    XVIZFrameBusSession='xviz.server.sessions',
+    XVIZAdaptiveSender='xviz.server.sender',
+    XVIZFrameBus='xviz.server.bus',
+    XVIZFrameBusReader='xviz.server.bus'
+)
+__all__ = list(_LAZY_IMPORTS)
+
+def __getattr__(name):
+    value = _lazy_getattr(__name__, _LAZY_IMPORTS, name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
+
+if TYPE_CHECKING:
+    from .server import XVIZServer
+    from .routing import XVIZRouter
+    from .handlers import XVIZLogPlayHandler
+    from .sessions import XVIZBaseSession, XVIZLogPlaySession, XVIZFrameBusSession
+    from .sender import XVIZAdaptiveSender
+    from .bus import XVIZFrameBus, XVIZFrameBusReader
@@ -0,0 +1,235 @@
+'''
+This module provides a frame bus in shared memory, so that serialized messages published once
+by a producer process (e.g. a vehicle bridge) are read by all server workers without copying
+them between processes.
+
+The bus is a ring of fixed size slots. Each slot is stamped with the sequence number of the
+message in it, which is cleared while the slot is being written, so readers detect messages
+overwritten before or during reading. The latest metadata is kept in a separate area for
+clients connecting later.
+'''
+import asyncio
+import os
+import struct
+import sys
+from multiprocessing import shared_memory, resource_tracker
+
+BUS_MAGIC = b'XVIZBUS1'
+# magic, slot count, slot size, metadata size, last sequence number
+HEADER_FORMAT = '<8sIIIQ'
+# sequence number, data length, flags
+SLOT_HEADER_FORMAT = '<QII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SLOT_HEADER_SIZE = struct.calcsize(SLOT_HEADER_FORMAT)
+SEQUENCE_OFFSET = HEADER_SIZE - 8
+
+FLAG_TEXT = 1
+
+def _attach_shared_memory(name, track):
+    '''
+    Attach to an existing shared memory. The tracker unlinks the memory registered to it when the
+    process exits, so only the creator should be tracked (see bpo-39959).
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=track)
+
+    shm = shared_memory.SharedMemory(name)
+    if not track and os.name == 'posix':
+        # registered with the leading slash of POSIX names
+        resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    return shm
+
+class XVIZFrameBus:
+    '''
+    Ring buffer of serialized messages in shared memory. There should be only one producer
+    publishing into a bus, while any number of XVIZFrameBusReader can read from it.
+    '''
+    def __init__(self, name=None, create=False, slot_count=64, slot_size=1 << 20, metadata_size=1 << 20,
+                 track=False):
+        '''
+        :param name: name of the shared memory, generated if a new bus is created without name
+        :param create: create a new bus, otherwise attach to an existing bus
+        :param slot_count: number of messages kept in the bus
+        :param slot_size: maximum size of a message in bytes
+        :param metadata_size: maximum size of the metadata in bytes
+        :param track: keep an attached bus registered to the resource tracker. Before Python 3.13 the
+            registration is removed otherwise, which also removes the registration of the creator if the
+            tracker is shared with it, so it should be True in processes started by the creator with
+            multiprocessing. A created bus is always tracked.
+        '''
+        if create:
+            if slot_count <= 0 or slot_size <= 0:
+                raise ValueError("Slot count and slot size must be positive")
+            size = HEADER_SIZE + SLOT_HEADER_SIZE * (slot_count + 1) + slot_size * slot_count + metadata_size
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            struct.pack_into(HEADER_FORMAT, self._shm.buf, 0, BUS_MAGIC, slot_count, slot_size, metadata_size, 0)
+        else:
+            self._shm = _attach_shared_memory(name, track)
+            magic, slot_count, slot_size, metadata_size, _ = struct.unpack_from(HEADER_FORMAT, self._shm.buf, 0)
+            if magic != BUS_MAGIC:
+                self._shm.close()
+                raise ValueError("Shared memory %s is not a frame bus" % name)
+
+        self._owner = create
+        self._slot_count = slot_count
+        self._slot_size = slot_size
+        self._metadata_size = metadata_size
+        self._metadata_offset = HEADER_SIZE
+        self._slots_offset = HEADER_SIZE + SLOT_HEADER_SIZE + metadata_size
+        self._metadata_sequence = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def slot_count(self) -> int:
+        return self._slot_count
+
+    @property
+    def sequence(self) -> int:
+        '''
+        Sequence number of the last published message, 0 if nothing is published
+        '''
+        return struct.unpack_from('<Q', self._shm.buf, SEQUENCE_OFFSET)[0]
+
+    def _write(self, offset: int, capacity: int, sequence: int, data):
+        flags = 0
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+            flags |= FLAG_TEXT
+        if len(data) > capacity:
+            raise ValueError("Message of %d bytes exceeds the capacity of %d bytes" % (len(data), capacity))
+
+        buf = self._shm.buf
+        struct.pack_into('<Q', buf, offset, 0) # mark as being written
+        buf[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + len(data)] = data
+        struct.pack_into(SLOT_HEADER_FORMAT, buf, offset, sequence, len(data), flags)
+
+    def publish(self, data) -> int:
+        '''
+        Publish a serialized message, strings are sent as text and bytes as binary message
+
+        :return: sequence number of the message
+        '''
+        sequence = self.sequence + 1
+        self._write(self._slot_offset(sequence), self._slot_size, sequence, data)
+        struct.pack_into('<Q', self._shm.buf, SEQUENCE_OFFSET, sequence)
+        return sequence
+
+    def publish_metadata(self, data):
+        self._metadata_sequence += 1
+        self._write(self._metadata_offset, self._metadata_size, self._metadata_sequence, data)
+
+    def _slot_offset(self, sequence: int) -> int:
+        return self._slots_offset + (sequence % self._slot_count) * (SLOT_HEADER_SIZE + self._slot_size)
+
+    def _read_view(self, offset: int):
+        '''
+        Return (sequence, memoryview of data, is text) of a slot
+        '''
+        sequence, length, flags = struct.unpack_from(SLOT_HEADER_FORMAT, self._shm.buf, offset)
+        start = offset + SLOT_HEADER_SIZE
+        return sequence, self._shm.buf[start:start + length], bool(flags & FLAG_TEXT)
+
+    def _slot_sequence(self, offset: int) -> int:
+        return struct.unpack_from('<Q', self._shm.buf, offset)[0]
+
+    def read_metadata(self):
+        '''
+        Get the latest metadata as str or bytes, None if it's not published
+        '''
+        sequence, view, text = self._read_view(self._metadata_offset)
+        data = bytes(view)
+        view.release()
+        if not sequence or self._slot_sequence(self._metadata_offset) != sequence:
+            return None
+        return data.decode('utf-8') if text else data
+
+    def close(self):
+        '''
+        Detach from the bus, and also remove the bus if it's created by this object
+        '''
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+
+class XVIZFrameBusReader:
+    '''
+    Read messages published into a frame bus in order. Each reader has its own cursor, messages
+    overwritten before being read are skipped and counted as lost.
+    '''
+    def __init__(self, bus: XVIZFrameBus, latest=True):
+        '''
+        :param latest: start from the latest message instead of the oldest message in the bus
+        '''
+        self._bus = bus
+        sequence = bus.sequence
+        self._cursor = max(sequence if latest else sequence - bus.slot_count + 1, 1)
+        self._lost = 0
+
+    @property
+    def lost(self) -> int:
+        '''
+        Number of messages overwritten before being read
+        '''
+        return self._lost
+
+    @property
+    def pending(self) -> int:
+        return max(self._bus.sequence - self._cursor + 1, 0)
+
+    def read_view(self):
+        '''
+        Read the next message without copying. Return (sequence, memoryview, is text), or None if
+        there is no new message. The view is only valid while `is_valid(sequence)` is True, and it
+        should be released after use.
+        '''
+        while True:
+            latest = self._bus.sequence
+            if self._cursor > latest:
+                return None
+            if latest - self._cursor >= self._bus.slot_count:
+                oldest = latest - self._bus.slot_count + 1
+                self._lost += oldest - self._cursor
+                self._cursor = oldest
+
+            sequence, view, text = self._bus._read_view(self._bus._slot_offset(self._cursor))
+            self._cursor += 1
+            if sequence == self._cursor - 1:
+                return sequence, view, text
+
+            # overwritten by the producer
+            view.release()
+            self._lost += 1
+
+    def is_valid(self, sequence: int) -> bool:
+        return self._bus._slot_sequence(self._bus._slot_offset(sequence)) == sequence
+
+    def read(self):
+        '''
+        Read a copy of the next message as str or bytes, None if there is no new message
+        '''
+        while True:
+            result = self.read_view()
+            if result is None:
+                return None
+
+            sequence, view, text = result
+            data = bytes(view)
+            view.release()
+            if self.is_valid(sequence):
+                return data.decode('utf-8') if text else data
+            self._lost += 1
+
+    async def next(self, poll_interval=0.005):
+        '''
+        Wait for and return the next message
+        '''
+        while True:
+            data = self.read()
+            if data is not None:
+                return data
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,255 @@
+'''
+This module contains caches shared by sessions in a server process, so that a log opened by
+several clients is only opened, decoded and encoded once.
+'''
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from xviz.io.sources import DirectorySource
+from xviz.io.snapshot import XVIZSnapshotIndex
+from xviz.io.prefetch import XVIZPrefetchReader
+
+class XVIZFrameCache:
+    '''
+    LRU cache of decoded messages and encoded data with a limit of total bytes. The size of
+    decoded messages is estimated by their serialized size.
+    '''
+    def __init__(self, max_bytes=256 << 20):
+        '''
+        :param max_bytes: maximum total size of cached items
+        '''
+        self._max_bytes = max_bytes
+        self._data = OrderedDict() # key -> (value, size)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size: int):
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            if key in self._data:
+                self._nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self._nbytes += size
+            while self._nbytes > self._max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._nbytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get_or_create(self, key, create, sizeof):
+        '''
+        Get cached value, or create it by `create()` and cache it with size given by `sizeof(value)`
+        '''
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value, sizeof(value))
+        return value
+
+class _CachedReader:
+    '''
+    Messages of a shared reader read through the frame cache, wrapped by the read ahead of each session
+    '''
+    def __init__(self, shared):
+        self._shared = shared
+
+    @property
+    def message_timings(self):
+        return self._shared.message_timings
+
+    def read_message(self, index: int):
+        return self._shared._read_cached(index)
+
+    def close(self):
+        pass
+
+class XVIZSharedReader:
+    '''
+    Reader handed out by XVIZReaderPool. Decoded messages are cached in the frame cache of the pool,
+    and closing it releases the reader in the pool. Messages returned are shared between sessions
+    and must not be modified.
+
+    If the pool reads ahead, each shared reader follows the playback of its own session, while the
+    messages read ahead are cached for all sessions.
+    '''
+    def __init__(self, pool, key, entry):
+        self._pool = pool
+        self._key = key
+        self._reader = entry['reader']
+        self._snapshots = entry['snapshots']
+        self._prefetch = None
+        if entry['executor'] is not None:
+            self._prefetch = XVIZPrefetchReader(_CachedReader(self), executor=entry['executor'])
+        self._closed = False
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def snapshots(self) -> XVIZSnapshotIndex:
+        return self._snapshots
+
+    @property
+    def message_timings(self):
+        return self._reader.message_timings
+
+    def __len__(self):
+        return len(self._reader)
+
+    def find_message(self, timestamp: float) -> int:
+        return self._reader.find_message(timestamp)
+
+    def find_messages(self, start_time: float = None, end_time: float = None):
+        return self._reader.find_messages(start_time, end_time)
+
+    def read_metadata(self):
+        return self.read_message(1)
+
+    @property
+    def prefetch(self) -> XVIZPrefetchReader:
+        '''
+        Read ahead of this reader, None if the pool doesn't read ahead
+        '''
+        return self._prefetch
+
+    def _read_cached(self, index: int):
+        return self._pool.cache.get_or_create((self._key, 'message', index),
+            lambda: self._reader.read_message(index), lambda message: message.data.ByteSize())
+
+    def read_message(self, index: int):
+        if self._prefetch is not None:
+            return self._prefetch.read_message(index)
+        return self._read_cached(index)
+
+    async def aread_message(self, index: int):
+        '''
+        Read message without blocking the event loop if the pool reads ahead, otherwise it's read directly
+        '''
+        if self._prefetch is not None:
+            return await self._prefetch.aread_message(index)
+        return self._read_cached(index)
+
+    def get_encoded(self, index: int, encoding, encode):
+        '''
+        Get message encoded by `encode(message)`, cached by the encoding (e.g. message format)
+        '''
+        data = self._pool.cache.get((self._key, encoding, index))
+        if data is None:
+            data = encode(self.read_message(index))
+            self._pool.cache.put((self._key, encoding, index), data, len(data))
+        elif self._prefetch is not None:
+            self._prefetch.skip(index)
+        return data
+
+    async def aget_encoded(self, index: int, encoding, encode):
+        '''
+        Same as `get_encoded`, but the message is read by `aread_message`
+        '''
+        data = self._pool.cache.get((self._key, encoding, index))
+        if data is None:
+            data = encode(await self.aread_message(index))
+            self._pool.cache.put((self._key, encoding, index), data, len(data))
+        elif self._prefetch is not None:
+            self._prefetch.skip(index)
+        return data
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            if self._prefetch is not None:
+                self._prefetch.close()
+            self._pool.release(self._key)
+
+class XVIZReaderPool:
+    '''
+    Readers of logs shared by sessions in a process. Readers are reference counted by path and
+    closed when the last session releases them. Decoded and encoded frames are cached in a
+    XVIZFrameCache shared by all logs.
+    '''
+    def __init__(self, cache: XVIZFrameCache = None, open_reader=None, prefetch=False):
+        '''
+        :param cache: frame cache shared by the readers, a cache with default budget is created if not given
+        :param open_reader: function opening reader of a log directory, returning None if the log is not found
+        :param prefetch: read ahead on sequential playback of each session with XVIZPrefetchReader, the
+            messages of a log are read on a single background thread
+        '''
+        if open_reader is None:
+            from .handlers import open_log_reader
+            open_reader = open_log_reader
+
+        self._cache = cache if cache is not None else XVIZFrameCache()
+        self._open_reader = open_reader
+        self._prefetch = prefetch
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> XVIZFrameCache:
+        return self._cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, directory: str, snapshot_interval: int = None) -> XVIZSharedReader:
+        '''
+        Get a shared reader of the log, return None if no log is found in the directory
+
+        :param snapshot_interval: create snapshot index with given interval for seeking if it's not created yet
+        '''
+        with self._lock:
+            entry = self._entries.get(directory)
+            if entry is None:
+                reader = self._open_reader(directory)
+                if reader is None:
+                    return None
+                executor = ThreadPoolExecutor(1, thread_name_prefix='xviz-prefetch') if self._prefetch else None
+                entry = self._entries[directory] = dict(reader=reader, executor=executor, snapshots=None, refcount=0)
+
+            if snapshot_interval and entry['snapshots'] is None:
+                sidecar = DirectorySource(directory) if os.path.isdir(directory) else None
+                entry['snapshots'] = XVIZSnapshotIndex(entry['reader'], snapshot_interval, sidecar)
+            entry['refcount'] += 1
+            return XVIZSharedReader(self, directory, entry)
+
+    def release(self, directory: str):
+        with self._lock:
+            entry = self._entries[directory]
+            entry['refcount'] -= 1
+            if entry['refcount'] == 0:
+                del self._entries[directory]
+                if entry['executor'] is not None:
+                    entry['executor'].shutdown(wait=True)
+                entry['reader'].close()
@@ -1,15 +1,84 @@
 import os
+import zipfile
+from xviz.io.sources import DirectorySource, ZipSource
 from .sessions import XVIZLogPlaySession
 
+_default_pool = None
+
+def get_default_pool():
+    '''
+    Get the XVIZReaderPool shared by log-play handlers in this process
+    '''
+    global _default_pool
+    if _default_pool is None:
+        from .cache import XVIZReaderPool
+        _default_pool = XVIZReaderPool()
+    return _default_pool
+
+def open_log_reader(path):
+    '''
+    Open a reader according to the files in the log, return None if no log is found
+
+    :param path: directory or zip archive containing the log written by XVIZGLBWriter or XVIZProtobufWriter
+    '''
+    from xviz.io import XVIZGLBReader, XVIZProtobufReader
+
+    if os.path.isdir(path):
+        source, names = DirectorySource(path), os.listdir(path)
+    elif zipfile.is_zipfile(path):
+        source = ZipSource(path)
+        names = source.namelist()
+    else:
+        return None
+
+    if '1-frame.glb' in names:
+        return XVIZGLBReader(source)
+    if '1-frame.pbe' in names:
+        return XVIZProtobufReader(source)
+    for name in names:
+        if name.endswith('.idx'):
+            return XVIZProtobufReader(source, log_name=name[:-len('.idx')])
+    source.close()
+    return None
+
 class XVIZLogPlayHandler:
-    def __init__(self, root=None):
+    def __init__(self, root=None, delay=0, autoplay=False, snapshot_interval=100, pool=None,
+                 fragment_cache=None, decimator=None):
         '''
         :param root: root path of the files
+        :param delay: default interval between two messages in seconds, can be overriden by
+            `delay` parameter (in milliseconds) of the request
+        :param autoplay: play the whole log on connection instead of waiting for `xviz/transform_log`
+        :param snapshot_interval: number of state updates between two state snapshots used for seeking,
+            the snapshots are loaded from the sidecar in the log directory, or built in background when
+            the session starts and saved as sidecar.
+            None to disable seeking.
+        :param pool: XVIZReaderPool sharing readers and decoded frames between sessions, the pool
+            shared in the process is used by default
+        :param fragment_cache: optional XVIZFragmentCache shared by the sessions to serialize JSON messages
+        :param decimator: optional XVIZPointCloudDecimator applied to point clouds sent by the sessions
         '''
         self._root = root
+        self._delay = delay
+        self._autoplay = autoplay
+        self._snapshot_interval = snapshot_interval
+        self._pool = pool if pool is not None else get_default_pool()
+        self._fragment_cache = fragment_cache
+        self._decimator = decimator
 
     def __call__(self, socket, request):
-        directory = os.path.join(self._root, request.path) if self._root else request.path
-        reader = None # XXXReader(directory)
-        session = XVIZLogPlaySession(socket, request, reader)
-        return session
+        if self._root:
+            root = os.path.realpath(self._root)
+            directory = os.path.realpath(os.path.join(root, request['path'].lstrip('/')))
+            if os.path.commonpath([root, directory]) != root:
+                return None
+        else:
+            directory = request['path']
+
+        reader = self._pool.acquire(directory, self._snapshot_interval)
+        if reader is None:
+            return None
+
+        delay = float(request['delay']) / 1000 if 'delay' in request else self._delay
+        return XVIZLogPlaySession(socket, request, reader, delay=delay, autoplay=self._autoplay,
+            snapshots=reader.snapshots, fragment_cache=self._fragment_cache, decimator=self._decimator)
@@ -0,0 +1,63 @@
+'''
+This module contains the route table used by XVIZServer to dispatch connections to handlers.
+'''
+import re
+from functools import lru_cache
+
+class XVIZRouter:
+    '''
+    Route table mapping request paths to handlers. A route is either a path prefix (e.g. "/logs"),
+    which matches the path itself and paths under it, or a regular expression starting with "^",
+    whose named groups are added to the request parameters.
+
+    Pattern routes are tried in the order they are added, then prefix routes from the longest
+    prefix. Handlers of all matching routes are tried until one of them returns a session.
+    '''
+    def __init__(self, routes=None, cache_size=1024):
+        '''
+        :param routes: dictionary or list of (route, handler)
+        :param cache_size: number of paths whose resolution is cached
+        '''
+        self._patterns = []
+        self._prefixes = []
+        self._resolve = lru_cache(maxsize=cache_size)(self._match)
+
+        if isinstance(routes, dict):
+            routes = routes.items()
+        for route, handler in routes or []:
+            self.add(route, handler)
+
+    def __len__(self):
+        return len(self._patterns) + len(self._prefixes)
+
+    def add(self, route: str, handler):
+        '''
+        :param handler: function taking (socket, request) and returning a session, or None if not supported
+        '''
+        if route.startswith('^'):
+            self._patterns.append((re.compile(route), handler))
+        else:
+            prefix = '/' + route.strip('/') if route.strip('/') else ''
+            self._prefixes.append((prefix, handler))
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True) # stable for equal prefixes
+        self._resolve.cache_clear()
+
+    def _match(self, path: str) -> tuple:
+        matches = []
+        for pattern, handler in self._patterns:
+            match = pattern.match(path)
+            if match:
+                matches.append((handler, path, match.groupdict()))
+        for prefix, handler in self._prefixes:
+            if path == prefix or path.startswith(prefix + '/') or not prefix:
+                matches.append((handler, path[len(prefix):] or '/', {}))
+        return tuple(matches)
+
+    def resolve(self, path: str) -> tuple:
+        '''
+        Get the candidates for the path as list of (handler, path relative to the route, parameters)
+        '''
+        return self._resolve(path)
+
+    def cache_info(self):
+        return self._resolve.cache_info()
@@ -0,0 +1,142 @@
+'''
+This module provides rate-adaptive sending of live data. Messages are queued without blocking the
+producer, and state updates queued while the client is behind are merged so that only the latest
+state of each stream is sent.
+'''
+import asyncio
+import time
+from collections import deque
+
+from xviz.message import XVIZMessage
+from xviz.filter import STREAM_FIELDS
+from xviz.io.snapshot import FULL_UPDATE_TYPES, XVIZStateAccumulator
+from xviz.stats import LatencyHistogram
+from xviz.v2.session_pb2 import StateUpdate
+
+class _PendingUpdate:
+    '''
+    State updates merged while waiting to be sent
+    '''
+    def __init__(self, message: XVIZMessage):
+        self.message = message
+        self.count = 1
+        self._accumulator = None
+        self._cleared = set()
+        self._full = False
+
+    def merge(self, message: XVIZMessage):
+        if self._accumulator is None:
+            self._accumulator = XVIZStateAccumulator()
+            self._add(self.message.data)
+        self._add(message.data)
+        self.message = None
+        self.count += 1
+
+    def _add(self, update: StateUpdate):
+        for frame in update.updates:
+            if update.update_type in FULL_UPDATE_TYPES:
+                self._full = True
+                self._cleared.clear()
+            for field in STREAM_FIELDS:
+                self._cleared.difference_update(getattr(frame, field).keys())
+            for state in frame.time_series:
+                self._cleared.difference_update(state.streams)
+            self._cleared.update(frame.no_data_streams)
+            self._accumulator.apply(frame, update.update_type)
+
+    def get_message(self) -> XVIZMessage:
+        if self.message is not None:
+            return self.message
+
+        frame = self._accumulator.get_state()
+        frame.no_data_streams.extend(sorted(self._cleared))
+        update_type = StateUpdate.UpdateType.COMPLETE_STATE if self._full else StateUpdate.UpdateType.INCREMENTAL
+        return XVIZMessage(update=StateUpdate(update_type=update_type, updates=[frame]))
+
+class XVIZAdaptiveSender:
+    '''
+    Send messages of a session at the pace of the client. While a send is in progress, the write
+    buffer of the socket is above `max_buffer_size` or the send latency is above `max_latency`,
+    queued state updates are merged, keeping the latest state of each stream. Other messages
+    (e.g. metadata) are sent in order without merging.
+
+    Usage::
+
+        sender = XVIZAdaptiveSender(session)
+        task = asyncio.ensure_future(sender.run())
+        sender.push(message) # doesn't block
+    '''
+    def __init__(self, session, max_buffer_size=1 << 20, max_latency=0.2, poll_interval=0.01):
+        '''
+        :param session: XVIZBaseSession used to filter, serialize and send messages
+        :param max_buffer_size: bytes allowed in the write buffer of the socket before holding messages
+        :param max_latency: send latency in seconds above which messages are sent less frequently
+        :param poll_interval: interval in seconds to check the write buffer when it's full
+        '''
+        self._session = session
+        self._max_buffer_size = max_buffer_size
+        self._max_latency = max_latency
+        self._poll_interval = poll_interval
+
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._latency = 0. # moving average of the send latency
+        self._latencies = LatencyHistogram()
+        self._sent = 0
+        self._merged = 0
+
+    @property
+    def latency(self) -> float:
+        return self._latency
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def get_stats(self) -> dict:
+        return dict(sent=self._sent, merged=self._merged, pending=len(self._queue),
+                    buffer_size=self._get_buffer_size(), latency=self._latencies.to_object())
+
+    def push(self, message: XVIZMessage):
+        '''
+        Queue a message to be sent. State updates are merged into the last queued state update.
+        '''
+        if isinstance(message.data, StateUpdate) and self._queue and isinstance(self._queue[-1], _PendingUpdate):
+            self._queue[-1].merge(message)
+            self._merged += 1
+        elif isinstance(message.data, StateUpdate):
+            self._queue.append(_PendingUpdate(message))
+        else:
+            self._queue.append(message)
+        self._ready.set()
+
+    def _get_buffer_size(self) -> int:
+        transport = getattr(self._session.socket, 'transport', None)
+        return transport.get_write_buffer_size() if transport is not None else 0
+
+    async def _wait_client(self):
+        # let the client catch up while new updates are merged
+        while self._get_buffer_size() > self._max_buffer_size:
+            await asyncio.sleep(self._poll_interval)
+        if self._latency > self._max_latency:
+            await asyncio.sleep(self._latency)
+
+    async def run(self):
+        '''
+        Send queued messages until cancelled
+        '''
+        while True:
+            await self._ready.wait()
+            await self._wait_client()
+
+            item = self._queue.popleft()
+            if not self._queue:
+                self._ready.clear()
+            message = item.get_message() if isinstance(item, _PendingUpdate) else item
+
+            start = time.perf_counter()
+            await self._session.send_message(message)
+            latency = time.perf_counter() - start
+            self._latencies.add(latency)
+            self._latency = 0.8 * self._latency + 0.2 * latency
+            self._sent += 1
@@ -1,56 +1,173 @@
-from easydict import EasyDict as edict
 import asyncio
 import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+from urllib.parse import urlsplit, parse_qsl
 import websockets
 from websockets.exceptions import ConnectionClosed
 
+from xviz.stats import LatencyHistogram
+from .routing import XVIZRouter
+
 class XVIZServer:
-    def __init__(self, handlers, port=3000, per_message_deflate=True):
+    def __init__(self, handlers, port=3000, host="localhost", per_message_deflate=True, workers=1):
         '''
-        :param handlers: single or list of handlers that acts as function and return a session object, or None if not supported
+        :param handlers: single or list of handlers that acts as function and return a session object, or None if not
+            supported. It can also be a XVIZRouter or a dictionary of routes to handlers, see XVIZRouter for details.
+        :param host: host name or address to bind, None to listen on all interfaces
+        :param workers: number of worker processes sharing the port when served with `run()`
         '''
         if not handlers:
             raise ValueError("No handler is registered!")
+        elif isinstance(handlers, XVIZRouter):
+            self._router = handlers
+        elif isinstance(handlers, dict):
+            self._router = XVIZRouter(handlers)
         elif not isinstance(handlers, (list, tuple)):
-            self._handlers = [handlers]
+            self._router = XVIZRouter([('/', handlers)])
         else:
-            self._handlers = handlers
+            self._router = XVIZRouter([('/', handler) for handler in handlers])
+        if workers < 1:
+            raise ValueError("Number of workers must be positive")
 
         self._logger = logging.getLogger("xviz-server")
-        self._connections = []
+        self._workers = workers
+        self._stats = dict(pid=os.getpid(), connections=0, active=0, rejected=0)
+        self._setup_latency = LatencyHistogram()
 
         compression = "deflate" if per_message_deflate else None
-        self._serve_options = dict(ws_handler=self.handle_session,
-            host="localhost", port=port, compression=compression)
+        self._serve_options = dict(host=host, port=port, compression=compression)
+
+    @property
+    def router(self) -> XVIZRouter:
+        return self._router
 
-    async def handle_session(self, socket, request):
+    @property
+    def stats(self) -> dict:
+        '''
+        Connection statistics of this process, including latency of setting up sessions
+        '''
+        return dict(self._stats, setup_latency=self._setup_latency.to_object())
+
+    async def handle_session(self, socket, request=None):
         '''
         This function handles all generated connection
+
+        :param request: request path, it's read from the socket if not given by the websockets library
         '''
+        start = time.perf_counter()
+        if request is None:
+            request = socket.request.path
+
         self._logger.info("[> Connection] created.")
-        if "?" in request:
-            path, params = request.split("?")
-        else:
-            path, params = request, ""
-        params = [item.split("=") for item in params.split("&") if "=" in item]
-        params = edict({k:v for k, v in params})
-        params.path = path
+        self._stats['connections'] += 1
+        url = urlsplit(request)
+        query = dict(parse_qsl(url.query))
 
         # find proper handler
-        for handler in self._handlers:
+        for handler, path, route_params in self._router.resolve(url.path):
+            params = dict(query, **route_params)
+            params['path'] = path
             session = handler(socket, params)
             if session:
+                self._setup_latency.add(time.perf_counter() - start)
                 session.on_connect()
+                self._stats['active'] += 1
                 try:
                     await session.main()
                 except ConnectionClosed:
                     self._logger.info("[> Disconnected]")
                     session.on_disconnect()
                 finally:
+                    self._stats['active'] -= 1
                     return
 
+        self._stats['rejected'] += 1
         await socket.close()
         self._logger.info("[> Connection] closed due to no handler found")
 
-    def serve(self):
-        return websockets.serve(**self._serve_options)
+    def serve(self, **options):
+        '''
+        Create the websocket server in the running event loop
+
+        :param options: additional options passed to `websockets.serve`, such as `sock` or `reuse_port`
+        '''
+        return websockets.serve(self.handle_session, **dict(self._serve_options, **options))
+
+    async def serve_forever(self, **options):
+        '''
+        Serve until SIGINT or SIGTERM is received, then close the connections gracefully
+        '''
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+        server = await self.serve(**options)
+        try:
+            await stop
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def _run_worker(self, options, stats_queue):
+        self._stats['pid'] = os.getpid()
+        try:
+            asyncio.run(self.serve_forever(**options))
+        finally:
+            stats_queue.put(self.stats)
+
+    def run(self):
+        '''
+        Serve in blocking mode until SIGINT or SIGTERM is received. With multiple workers, processes are
+        forked and share the port with SO_REUSEPORT where supported, otherwise they accept connections
+        from a socket bound before forking.
+
+        :return: list of connection statistics of each worker
+        '''
+        if self._workers == 1:
+            asyncio.run(self.serve_forever())
+            return [self.stats]
+
+        options = {}
+        if hasattr(socket, 'SO_REUSEPORT'):
+            options['reuse_port'] = True
+        else:
+            sock = socket.create_server((self._serve_options['host'] or '', self._serve_options['port']))
+            options.update(sock=sock, host=None, port=None)
+
+        # handlers are usually not picklable, so workers have to be forked
+        context = multiprocessing.get_context('fork')
+        stats_queue = context.Queue()
+        workers = [context.Process(target=self._run_worker, args=(options, stats_queue), daemon=True)
+                   for _ in range(self._workers)]
+
+        def forward(signum, _):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGTERM)
+
+        for worker in workers:
+            worker.start()
+        handlers = {signum: signal.signal(signum, forward) for signum in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            self._logger.info("Started %d workers: %s", len(workers), [worker.pid for worker in workers])
+            for worker in workers:
+                worker.join()
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            if 'sock' in options:
+                options['sock'].close()
+
+        stats = []
+        for _ in workers:
+            try:
+                stats.append(stats_queue.get(timeout=1))
+            except queue.Empty: # the worker crashed
+                pass
+        return sorted(stats, key=lambda item: item['pid'])
@@ -1,10 +1,99 @@
+import asyncio
+import json
 import logging
 
+from google.protobuf.json_format import MessageToDict, ParseDict
+
+from xviz.filter import XVIZStreamFilter
+from xviz.message import XVIZMessage
+from xviz.io.sources import MemorySource
+from xviz.v2.envelope_pb2 import Envelope
+from xviz.v2.session_pb2 import StateUpdate, Start, Reconfigure, TransformLog, TransformLogDone, TransformPointInTime, Error
+
+# Messages that can be sent from clients
+SESSION_MESSAGE_TYPES = {
+    'xviz/start': Start,
+    'xviz/reconfigure': Reconfigure,
+    'xviz/transform_log': TransformLog,
+    'xviz/transform_point_in_time': TransformPointInTime
+}
+
+def _normalize_enums(obj: dict, descriptor):
+    # Enum values may be sent in lower case (e.g. "delta")
+    for field in descriptor.fields:
+        if field.enum_type and isinstance(obj.get(field.name), str):
+            obj[field.name] = obj[field.name].upper()
+
+def parse_session_message(data):
+    '''
+    Parse message from client, which is either JSON envelope in text or binary, or protobuf envelope.
+
+    :return: (message type, protobuf message)
+    '''
+    if isinstance(data, str):
+        obj = json.loads(data)
+    else:
+        data = bytes(data)
+        try:
+            obj = json.loads(data)
+        except ValueError: # protobuf data
+            envelope = Envelope.FromString(data)
+            if envelope.type not in SESSION_MESSAGE_TYPES:
+                raise ValueError("Unsupported message type: %s" % envelope.type)
+            return envelope.type, SESSION_MESSAGE_TYPES[envelope.type].FromString(envelope.data.value)
+
+    message_type = obj.get('type')
+    if message_type not in SESSION_MESSAGE_TYPES:
+        raise ValueError("Unsupported message type: %s" % message_type)
+    message_class = SESSION_MESSAGE_TYPES[message_type]
+    dataobj = obj.get('data', {})
+    _normalize_enums(dataobj, message_class.DESCRIPTOR)
+    return message_type, ParseDict(dataobj, message_class(), ignore_unknown_fields=True)
+
 class XVIZBaseSession:
-    def __init__(self, socket, request, logger=None):
+    '''
+    Base class of sessions. Messages from the client are dispatched to `on_<type>` methods
+    (e.g. `on_start`, `on_reconfigure`), and messages to the client are filtered by the stream
+    filter and serialized in the format requested by the client.
+
+    Streams can be selected by the client with `xviz/reconfigure` message, where `desired_streams`
+    and `disabled_streams` lists in `config_update` are used as the allow list and deny list.
+    '''
+    def __init__(self, socket, request, logger=None, fragment_cache=None, decimator=None):
+        '''
+        :param fragment_cache: optional XVIZFragmentCache used to serialize JSON messages, it can be
+            shared between sessions so that unchanged streams are encoded only once
+        :param decimator: optional XVIZPointCloudDecimator applied to messages sent to the client
+        '''
         self._socket = socket
         self._request = request
         self._logger = logger or logging.getLogger('xviz-server')
+        self._fragment_cache = fragment_cache
+        self._decimator = decimator
+        self._stream_filter = XVIZStreamFilter()
+        self._message_format = Start.MessageFormat.JSON
+        self._recorder = None
+
+    @property
+    def socket(self):
+        return self._socket
+
+    @property
+    def recorder(self):
+        return self._recorder
+
+    def set_recorder(self, recorder):
+        '''
+        Record messages sent to the client before stream filtering, including messages sent as encoded
+        data. The recorder is not closed by the session.
+
+        :param recorder: XVIZAsyncWriter, writes are queued so that sending is not blocked by the disk
+        '''
+        self._recorder = recorder
+
+    @property
+    def stream_filter(self) -> XVIZStreamFilter:
+        return self._stream_filter
 
     def on_connect(self):
         '''
@@ -24,20 +113,266 @@ class XVIZBaseSession:
         '''
         raise NotImplementedError("Derived class should implement this method")
 
+    def on_start(self, message: Start):
+        if message.message_format:
+            self._message_format = message.message_format
+
+    def on_reconfigure(self, message: Reconfigure):
+        config = MessageToDict(message.config_update)
+        self._stream_filter.update(config.get('desired_streams'), config.get('disabled_streams'),
+            full=message.update_type != Reconfigure.UpdateType.DELTA)
+
+    async def handle_message(self, data):
+        '''
+        Parse a message from the client and dispatch it
+        '''
+        try:
+            message_type, message = parse_session_message(data)
+        except ValueError as e:
+            self._logger.warning("Failed to parse message from client: %s", e)
+            return
+
+        handler = getattr(self, 'on_' + message_type.split('/', 1)[1], None)
+        if handler is None:
+            self._logger.warning("Message %s is not supported by the session", message_type)
+            return
+
+        result = handler(message)
+        if asyncio.iscoroutine(result):
+            await result
+
+    async def receive_loop(self):
+        '''
+        Handle messages from the client until the connection is closed
+        '''
+        async for data in self._socket:
+            await self.handle_message(data)
+
+    def serialize(self, message: XVIZMessage):
+        '''
+        Serialize message into JSON string or GLB bytes
+        '''
+        from xviz.io import XVIZJsonWriter, XVIZGLBWriter
+
+        source = MemorySource(latest_only=True)
+        if self._message_format == Start.MessageFormat.BINARY:
+            XVIZGLBWriter(source, decimator=self._decimator).write_message(message)
+            return source.read()
+
+        XVIZJsonWriter(source, cache=self._fragment_cache, decimator=self._decimator).write_message(message)
+        return source.read().decode('ascii')
+
+    async def send_data(self, data, message: XVIZMessage = None):
+        '''
+        Send a serialized message to the client, and record it if a recorder is set. Subclasses
+        should send metadata and state updates through this method.
+
+        :param message: the message before serialization to be recorded, it's decoded from the data if not given
+        '''
+        if self._recorder is not None:
+            if message is None:
+                from xviz.io.gltf import GLBDecoder
+                message = GLBDecoder(data).to_message() if isinstance(data, bytes) \
+                    else XVIZMessage.from_object(json.loads(data))
+            await self._recorder.write_message(message, wait=False)
+        await self._socket.send(data)
+
+    async def send_message(self, message: XVIZMessage):
+        '''
+        Filter streams in the message and send it to the client
+        '''
+        await self.send_data(self.serialize(self._stream_filter.apply(message)), message)
+
+    async def send_session_message(self, message_type: str, message):
+        '''
+        Send session messages other than metadata and state update (e.g. `xviz/transform_log_done`)
+        as JSON envelope, which is accepted by clients in both JSON and binary format.
+        '''
+        obj = dict(type=message_type, data=MessageToDict(message, preserving_proto_field_name=True))
+        await self._socket.send(json.dumps(obj, separators=(',', ':')))
+
 class XVIZLogPlaySession(XVIZBaseSession):
     '''
-    This class holds a session playing autonomy data from files
+    This class holds a session playing autonomy data from files. The metadata is sent on
+    connection, then state updates are sent on `xviz/transform_log` requests from the client,
+    or played through the whole log if `autoplay` is enabled.
+
+    Requested ranges are streamed in a background task, so that other messages from the client
+    are handled meanwhile. A new request cancels the range being streamed.
     '''
-    def __init__(self, socket, request, reader, logger=None):
-        super().__init__(socket, request, logger)
+    def __init__(self, socket, request, reader, delay=0, autoplay=False, snapshots=None, logger=None,
+                 fragment_cache=None, decimator=None):
+        '''
+        :param reader: reader of the log, such as XVIZGLBReader or XVIZSharedReader. It's closed when the session ends.
+        :param delay: interval between sending two messages in seconds when autoplaying
+        :param autoplay: send all state updates after the metadata without waiting for requests
+        :param snapshots: optional XVIZSnapshotIndex of the log. If given, ranges starting in the
+            middle of the log begin with the full state, and `xviz/transform_point_in_time` is supported.
+        '''
+        super().__init__(socket, request, logger, fragment_cache, decimator)
         self._reader = reader
+        self._delay = delay
+        self._autoplay = autoplay
+        self._snapshots = snapshots
+        self._transform = None
+
+    def on_connect(self):
+        self._logger.info("LogPlayer connected!")
+
+    def on_disconnect(self):
+        self._logger.info("LogPlayer disconnected!")
+
+    async def main(self):
+        if self._snapshots is not None and not self._snapshots.built:
+            # load or build the snapshots in background before the first seek
+            asyncio.ensure_future(self._snapshots.abuild()).add_done_callback(self._on_snapshots_built)
+
+        try:
+            await self._send_log_message(1)
+            if not self._autoplay:
+                await self.receive_loop()
+                await self._wait_transform()
+                return
+
+            receiver = asyncio.ensure_future(self.receive_loop())
+            try:
+                for _, _, index in self._reader.message_timings:
+                    await self._send_log_message(index)
+                    await asyncio.sleep(self._delay)
+            finally:
+                receiver.cancel()
+        finally:
+            self._cancel_transform()
+            self._reader.close()
+
+    def _on_snapshots_built(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._logger.error("Failed to build snapshots: %s", future.exception())
+
+    def _cancel_transform(self):
+        if self._transform is not None:
+            self._transform.cancel()
+            self._transform = None
+
+    async def _wait_transform(self):
+        '''
+        Wait for the range being streamed, e.g. when the client stops sending requests
+        '''
+        task = self._transform
+        if task is not None:
+            await asyncio.wait([task])
+            if not task.cancelled():
+                task.result()
+
+    def on_transform_log(self, message: TransformLog):
+        '''
+        Start streaming the requested range, replacing the range being streamed
+        '''
+        self._cancel_transform()
+        self._transform = asyncio.ensure_future(self._transform_log(message))
+
+    async def _transform_log(self, message: TransformLog):
+        '''
+        Send the state updates within the requested range as fast as the client takes them, and
+        then `xviz/transform_log_done`. Each send waits for the socket to drain, which applies
+        backpressure from the client.
+        '''
+        request_filter = XVIZStreamFilter(allowlist=message.desired_streams) if message.desired_streams else None
+        # unset timestamps are zero in protobuf
+        indices = self._reader.find_messages(message.start_timestamp, message.end_timestamp or None)
+        for index in indices:
+            if index == indices[0] and self._snapshots is not None and index != self._reader.message_timings[0][2]:
+                update = self._get_state_message(await self._snapshots.aget_state(index))
+                await self.send_message(request_filter.apply(update) if request_filter else update)
+            else:
+                await self._send_log_message(index, request_filter)
+        await self.send_session_message('xviz/transform_log_done', TransformLogDone(id=message.id))
+
+    async def on_transform_point_in_time(self, message: TransformPointInTime):
+        '''
+        Send the full state at the requested time, reconstructed from the nearest snapshot. The range
+        being streamed is cancelled.
+        '''
+        self._cancel_transform()
+        if self._snapshots is None:
+            self._logger.warning("Point in time query is not supported without snapshots")
+            return
+
+        state = await self._snapshots.aget_state_at(message.query_timestamp)
+        if state is None:
+            return
+        update = self._get_state_message(state)
+        if message.desired_streams:
+            update = XVIZStreamFilter(allowlist=message.desired_streams).apply(update)
+        await self.send_message(update)
+
+    async def _send_log_message(self, index: int, request_filter: XVIZStreamFilter = None):
+        '''
+        Send a message in the log. The encoded data is reused from the cache of shared readers
+        (see XVIZReaderPool) if no stream is filtered. Readers reading ahead (e.g. XVIZPrefetchReader)
+        are read without blocking the event loop.
+        '''
+        if request_filter is None and not self._stream_filter.enabled and hasattr(self._reader, 'aget_encoded'):
+            encoding = (self._message_format, self._decimator)
+            data = await self._reader.aget_encoded(index, encoding, self.serialize)
+            message = await self._reader.aread_message(index) if self._recorder is not None else None
+            await self.send_data(data, message)
+            return
+
+        if hasattr(self._reader, 'aread_message'):
+            message = await self._reader.aread_message(index)
+        else:
+            message = self._reader.read_message(index)
+        if request_filter is not None:
+            message = request_filter.apply(message)
+        await self.send_message(message)
+
+    def _get_state_message(self, state) -> XVIZMessage:
+        return XVIZMessage(update=StateUpdate(update_type=StateUpdate.UpdateType.COMPLETE_STATE, updates=[state]))
+
+class XVIZFrameBusSession(XVIZBaseSession):
+    '''
+    This class holds a session streaming live messages published into a XVIZFrameBus by another
+    process. Messages are forwarded as serialized by the producer, so `xviz/reconfigure` is rejected
+    with an `xviz/error` message and the message format of `xviz/start` is ignored.
+    '''
+    def __init__(self, socket, request, bus, poll_interval=0.005, logger=None):
+        '''
+        :param bus: XVIZFrameBus attached in this process
+        :param poll_interval: interval in seconds to check for new messages
+        '''
+        super().__init__(socket, request, logger)
+        self._bus = bus
+        self._poll_interval = poll_interval
 
     def on_connect(self):
-        print("LogPlayer connected!")
+        self._logger.info("Live session connected!")
 
     def on_disconnect(self):
-        print("LogPlayer disconnected!")
+        self._logger.info("Live session disconnected!")
+
+    def on_start(self, message: Start):
+        if message.message_format:
+            self._logger.warning("Message format is chosen by the producer of the frame bus, ignoring start request")
+
+    async def on_reconfigure(self, message: Reconfigure):
+        self._logger.warning("Stream filter is not supported by live sessions, ignoring reconfigure request")
+        await self.send_session_message('xviz/error', Error(
+            message="xviz/reconfigure is not supported by live sessions, all streams are sent"))
 
     async def main(self):
-        raise NotImplementedError() # TODO: read data and send to client
-        
\ No newline at end of file
+        from .bus import XVIZFrameBusReader
+
+        receiver = asyncio.ensure_future(self.receive_loop())
+        try:
+            metadata = self._bus.read_metadata()
+            while metadata is None:
+                await asyncio.sleep(self._poll_interval)
+                metadata = self._bus.read_metadata()
+            await self.send_data(metadata)
+
+            reader = XVIZFrameBusReader(self._bus, latest=True)
+            while True:
+                await self.send_data(await reader.next(self._poll_interval))
+        finally:
+            receiver.cancel()
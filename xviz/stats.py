@@ -0,0 +1,72 @@
+'''
+This module contains simple statistics containers used for performance reporting.
+'''
+import bisect
+import threading
+
+# Upper bounds of the latency buckets in seconds
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+
+class LatencyHistogram:
+    '''
+    Thread-safe histogram of latencies with fixed buckets. The last bucket counts all values
+    larger than the last bound.
+    '''
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._total = 0.
+        self._max = 0.
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._buckets, latency)] += 1
+            self._total += latency
+            self._max = max(self._max, latency)
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def counts(self):
+        return list(self._counts)
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    @property
+    def mean(self):
+        count = self.count
+        return self._total / count if count else 0.
+
+    @property
+    def max(self):
+        return self._max
+
+    def quantile(self, q: float) -> float:
+        '''
+        Estimate the quantile by the upper bound of the bucket containing it
+        '''
+        count = self.count
+        if not count:
+            return 0.
+
+        target = q * count
+        accumulated = 0
+        for bound, bucket_count in zip(self._buckets, self._counts):
+            accumulated += bucket_count
+            if accumulated >= target:
+                return bound
+        return self._max
+
+    def to_object(self) -> dict:
+        return dict(
+            buckets=list(self._buckets),
+            counts=self.counts,
+            count=self.count,
+            mean=self.mean,
+            max=self._max
+        )
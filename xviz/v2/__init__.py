@@ -0,0 +1,22 @@
+'''
+Generated protobuf bindings of XVIZ v2. Speed of serialization depends on the protobuf runtime,
+which is stored in `PROTOBUF_BACKEND` as one of 'python', 'cpp' or 'upb'.
+'''
+import logging
+from google.protobuf.internal import api_implementation
+
+PROTOBUF_BACKEND = api_implementation.Type()
+
+def is_fast_backend() -> bool:
+    '''
+    Whether protobuf messages are implemented in native code
+    '''
+    return PROTOBUF_BACKEND != 'python'
+
+if is_fast_backend():
+    logging.getLogger("xviz").debug("Protobuf backend: %s", PROTOBUF_BACKEND)
+else:
+    # The bindings are generated by an old protoc, which protobuf 4 (upb) rejects
+    logging.getLogger("xviz").warning("Pure python protobuf backend is used, encoding and decoding XVIZ messages "
+        "will be slow. Use a protobuf 3.x build with the C++ extension and set "
+        "PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION=cpp, or regenerate xviz/v2 with protoc>=3.19 for protobuf>=4.21.")